@@ -9,7 +9,8 @@ Date: Aug 28, 2020
 
 """
 from nash.owner import *
-from boa.interop.Neo.Runtime import GetTrigger, CheckWitness
+from boa.interop.Neo.Runtime import GetTrigger, CheckWitness, Serialize, Deserialize
+from boa.interop.Neo.Blockchain import GetHeight
 from boa.interop.System.ExecutionEngine import GetExecutingScriptHash,GetScriptContainer
 from boa.interop.Neo.TriggerType import Application, Verification
 from boa.interop.Neo.Storage import *
@@ -27,7 +28,31 @@ AppCallNex = RegisterAppCall('3A4ACD3647086E7C44398AAC0349802E6A171129', 'operat
 
 SWAP_CONTRACT_KEY= 'swapContract'
 SWAPID_PREFIX = 'swapId'
+SWAPID_PAGE_PREFIX = 'swapIdPage'
 SWAP_COUNTER = 'swapCounter'
+SWAP_RECORD_PREFIX = 'swapRecord'
+
+# Swap ledger, kept in storage so totals can be read without calling NEX
+SWAPPED_IN = 'swappedIn'
+SWAPPED_OUT = 'swappedOut'
+SWAPPED_OUTSTANDING = 'swappedOutstanding'
+
+# Processed swap ids are tracked in bitmap pages of 128 ids each.
+# A page is stored as an integer, and NeoVM integers are limited to 32 bytes
+SWAPID_PAGE_SIZE = 128
+
+# Swap ids are at most 8 bytes long
+MAX_SWAPID_LENGTH = 8
+
+# Maximum number of swap ids checked by areSwapIdsProcessed,
+# so that the resulting bitmask fits in a NeoVM integer
+MAX_SWAPID_CHECK = 240
+
+# Maximum number of swaps returned by getSwapRange
+MAX_SWAP_RANGE = 50
+
+# Replay keys of swapToEth are concat(txHash, addr)
+REPLAY_KEY_LENGTH = 52
 
 # Minimum amount to swap is 500 NEX
 MIN_SWAP_AMOUNT = 50000000000
@@ -64,23 +89,88 @@ def Main(operation, args):
                 return swapToEth(args)
             raise Exception("Invalid argument length")
 
+        elif operation == 'swapToEthBatch':
+            if len(args) == 2:
+                return swapToEthBatch(args)
+            raise Exception("Invalid argument length")
+
         elif operation == 'swapFromEth':
             if len(args) == 4:
                 return swapFromEth(args)
             raise Exception("Invalid argument length")
 
+        elif operation == 'swapFromEthBatch':
+            if len(args) > 0:
+                return swapFromEthBatch(args)
+            raise Exception("Invalid argument length")
+
+        elif operation == 'getSwap':
+            if len(args) == 1:
+                return getSwap(args[0])
+            raise Exception("Invalid argument length")
+
+        elif operation == 'getSwapRange':
+            if len(args) == 2:
+                return getSwapRange(args)
+            raise Exception("Invalid argument length")
+
+        elif operation == 'isSwapIdProcessed':
+            if len(args) == 1:
+                return isSwapIdProcessed(args[0])
+            raise Exception("Invalid argument length")
+
+        elif operation == 'areSwapIdsProcessed':
+            return areSwapIdsProcessed(args)
+
+        elif operation == 'getSwapIdPage':
+            if len(args) == 1:
+                return Get(ctx, swapIdPageKey(args[0]))
+            raise Exception("Invalid argument length")
+
         elif operation == 'totalSwapped':
             return getTotalSwapped()
 
+        elif operation == 'totalSwappedIn':
+            return Get(ctx, SWAPPED_IN)
+
+        elif operation == 'totalSwappedOut':
+            return Get(ctx, SWAPPED_OUT)
+
+        elif operation == 'reconcileSwapped':
+            return reconcileSwapped()
+
+        elif operation == 'syncSwapped':
+            if len(args) < 2:
+                return syncSwapped(args)
+            raise Exception("Invalid argument length")
+
         # owner / admin methods
         elif operation == 'initializeOwners':
             return initialize_owners(ctx)
 
         elif operation == 'setMinter':
-            if len(args) == 1:                
+            if len(args) == 1 or len(args) == 2:
                 return setMinter(args)
             raise Exception('Invalid argument length')
 
+        elif operation == 'removeMinter':
+            if len(args) == 1:
+                return removeMinter(args)
+            raise Exception('Invalid argument length')
+
+        elif operation == 'setMinterSlots':
+            if len(args) == 1:
+                return setMinterSlots(args)
+            raise Exception('Invalid argument length')
+
+        elif operation == 'getMinter':
+            if len(args) == 1:
+                return Get(ctx, minter_key(args[0]))
+            raise Exception('Invalid argument length')
+
+        elif operation == 'getMinterSlots':
+            return get_minter_slots(ctx)
+
         elif operation == 'getOwners':
             return get_owners(ctx)
 
@@ -90,6 +180,22 @@ def Main(operation, args):
         elif operation == 'switchOwner':
             return switch_owner(ctx, args)
 
+        elif operation == 'addOwner':
+            return add_owner(ctx, args)
+
+        elif operation == 'removeOwner':
+            return remove_owner(ctx, args)
+
+        elif operation == 'migrateSwapIds':
+            if len(args) == 1:
+                return migrateSwapIds(args[0])
+            raise Exception('Invalid argument length')
+
+        elif operation == 'importReplayKeys':
+            if len(args) == 1:
+                return importReplayKeys(args[0])
+            raise Exception('Invalid argument length')
+
 
         raise Exception("Unknown operation")
 
@@ -126,27 +232,134 @@ def swapToEth(args):
             swapId = swapId +1
             Put(ctx, SWAP_COUNTER, swapId)
             Put(ctx, replayCheck, 1)
+            addSwappedIn(amount)
+            putSwapRecord(swapId, addr, ethAddr, amount, GetHeight())
             OnSwapToEth(addr, ethAddr, amount, swapId)
             return True
 
     raise Exception("Could not transfer tokens to swap contract")
 
 
+def swapToEthBatch(args):
+    """
+    Swap to several eth addresses with a single transfer of tokens.
+    Every leg gets its own swap id and onSwapToEth event
+
+    :param args: list of the addr and a list of [ethAddr, amount] legs
+    :return: bool
+    """
+    addr = args[0]
+    legs = args[1]
+
+    validateAddr(addr)
+
+    legCount = len(legs)
+    if legCount == 0:
+        raise Exception("Need at least one swap")
+
+    totalAmount = 0
+    for leg in legs:
+        if len(leg) != 2:
+            raise Exception("Invalid argument length")
+
+        validateAddr(leg[0])
+
+        if leg[1] < MIN_SWAP_AMOUNT:
+            raise Exception("Need to swap at least 500 NEX")
+
+        totalAmount = totalAmount + leg[1]
+
+    tx = GetScriptContainer()
+    txHash = tx.Hash
+    replayCheck = concat(txHash, addr)
+
+    if Get(ctx, replayCheck) > 0:
+        raise Exception("Already swap for this transaction and address")
+
+    if CheckWitness(addr):
+
+        args = [addr, GetExecutingScriptHash(), totalAmount]
+
+        transferOfTokens = AppCallNex('transferFrom', args)
+
+        if transferOfTokens:
+            # Reserve a contiguous range of swap ids for all legs
+            swapId = Get(ctx, SWAP_COUNTER)
+            Put(ctx, SWAP_COUNTER, swapId + legCount)
+            Put(ctx, replayCheck, 1)
+            addSwappedIn(totalAmount)
+
+            height = GetHeight()
+            for leg in legs:
+                swapId = swapId + 1
+                putSwapRecord(swapId, addr, leg[0], leg[1], height)
+                OnSwapToEth(addr, leg[0], leg[1], swapId)
+            return True
+
+    raise Exception("Could not transfer tokens to swap contract")
+
+
+def putSwapRecord(swapId, addr, ethAddr, amount, height):
+    record = Serialize([addr, ethAddr, amount, height])
+    Put(ctx, concat(SWAP_RECORD_PREFIX, swapId), record)
+
+
+def getSwap(swapId):
+    """
+    Retrieves a swap to eth by its swap id
+
+    :param swapId: int
+    :return: list: [addr, ethAddr, amount, height] or False if there is no such swap
+    """
+    record = Get(ctx, concat(SWAP_RECORD_PREFIX, swapId))
+    if not record:
+        return False
+    return Deserialize(record)
+
+
+def getSwapRange(args):
+    """
+    Retrieves consecutive swaps to eth, at most MAX_SWAP_RANGE per call
+
+    :param args: list of the first swap id and the number of swaps
+    :return: list: [swapCounter, list of swap records as returned by getSwap]
+    """
+    swapId = args[0]
+    count = args[1]
+
+    if swapId < 1 or count < 0:
+        raise Exception("Invalid range")
+
+    if count > MAX_SWAP_RANGE:
+        count = MAX_SWAP_RANGE
+
+    counter = Get(ctx, SWAP_COUNTER)
+
+    end = swapId + count
+    if end > counter + 1:
+        end = counter + 1
+
+    records = []
+    while swapId < end:
+        records.append(getSwap(swapId))
+        swapId += 1
+
+    return [counter, records]
+
 
 def swapFromEth(args):
     """
-    Only admin may execute a swap from eth
+    Only the minter of the slot the swapId belongs to may execute a swap from eth
     """
-    if check_minter(ctx):
+    swapId = args[3] # integer
+
+    if check_minter(ctx, swapId % get_minter_slots(ctx)):
         addr = args[0] # Neo Address to send NEX to 
         ethAddr = args[1]
         amount = args[2]
-        swapId = args[3] # integer
-
-        swapIdStorage = concat(SWAPID_PREFIX, swapId)
 
         # Prevent admin from accidentally performing swap back more than once
-        if Get(ctx, swapIdStorage) > 0:
+        if isSwapIdProcessed(swapId):
             raise Exception("Already swap for this transaction and address")
 
         validateAddr(ethAddr)
@@ -161,29 +374,340 @@ def swapFromEth(args):
 
         transferOfTokens = AppCallNex('transfer', args)
         if transferOfTokens:
-            Put(ctx, swapIdStorage, 1)
+            markSwapIdProcessed(swapId)
+            addSwappedOut(amount)
             OnSwapFromEth(addr,ethAddr,amount,swapId)
             return True
 
     return False
 
 
+def swapFromEthBatch(swaps):
+    """
+    Only the minter may execute a batch of swaps from eth, so
+    all swap ids of a batch need to belong to the same minter slot.
+    Swap ids that were already processed are skipped, so a
+    relayer can safely resubmit a batch. A swap id that is
+    repeated within the batch is only swapped once
+
+    :param swaps: list of [addr, ethAddr, amount, swapId] lists
+    :return: int: The number of swaps performed
+    """
+    slots = get_minter_slots(ctx)
+    slot = swaps[0][3] % slots
+
+    if not check_minter(ctx, slot):
+        return False
+
+    # Validate every item and mark the swap ids that still have to be
+    # swapped back. Marking them right away makes a repeated swap id
+    # show up as processed, and the whole batch faults if anything fails
+    pending = []
+    totalAmount = 0
+    for swap in swaps:
+        if len(swap) != 4:
+            raise Exception("Invalid argument length")
+
+        swapId = swap[3]
+        if swapId % slots != slot:
+            raise Exception("Swap ids belong to different minters")
+
+        validateAddr(swap[1])
+        validateAddr(swap[0])
+
+        amount = swap[2]
+        if amount <= 0:
+            raise Exception("Invalid amount")
+
+        if not isSwapIdProcessed(swapId):
+            markSwapIdProcessed(swapId)
+            pending.append(swap)
+            totalAmount = totalAmount + amount
+
+    totalAvailable = getTotalSwapped()
+    if totalAvailable < totalAmount:
+        raise Exception("Can not swap back from eth tokens that were never swapped")
+
+    contractAddress = GetExecutingScriptHash()
+
+    for swap in pending:
+        addr = swap[0]
+        amount = swap[2]
+
+        args = [contractAddress, addr, amount]
+
+        transferOfTokens = AppCallNex('transfer', args)
+        if not transferOfTokens:
+            raise Exception("Could not transfer tokens from swap contract")
+
+        OnSwapFromEth(addr, swap[1], amount, swap[3])
+
+    swapped = len(pending)
+    if swapped > 0:
+        addSwappedOut(totalAmount)
+
+    return swapped
+
+
+def isSwapIdProcessed(swapId):
+    """
+    Swap ids are always interpreted as integers,
+    so 1 and b'\x01' refer to the same swap id
+
+    :param swapId: int
+    :return: bool
+    """
+    validateSwapId(swapId)
+
+    page = Get(ctx, swapIdPageKey(swapId / SWAPID_PAGE_SIZE))
+    if page & (1 << (swapId % SWAPID_PAGE_SIZE)):
+        return True
+
+    # Swap ids processed before bitmap pages were introduced
+    if Get(ctx, concat(SWAPID_PREFIX, swapId)) > 0:
+        return True
+
+    return False
+
+
+def areSwapIdsProcessed(swapIds):
+    """
+    Checks many swap ids at once. Consecutive swap ids
+    in the same page only read the page once
+
+    :param swapIds: list of at most MAX_SWAPID_CHECK swap ids
+    :return: int: a bitmask with bit i set if swapIds[i] was processed
+    """
+    if len(swapIds) > MAX_SWAPID_CHECK:
+        raise Exception("Too many swap ids")
+
+    result = 0
+    bit = 1
+    pageIndex = -1
+    page = 0
+
+    for swapId in swapIds:
+        validateSwapId(swapId)
+
+        index = swapId / SWAPID_PAGE_SIZE
+        if index != pageIndex:
+            pageIndex = index
+            page = Get(ctx, swapIdPageKey(index))
+
+        if page & (1 << (swapId % SWAPID_PAGE_SIZE)):
+            result = result | bit
+
+        # Swap ids processed before bitmap pages were introduced
+        elif Get(ctx, concat(SWAPID_PREFIX, swapId)) > 0:
+            result = result | bit
+
+        bit = bit << 1
+
+    return result
+
+
+def validateSwapId(swapId):
+    """
+    Swap ids are integers in their shortest little endian encoding.
+    The VM can't tell an integer from a byte array, but a longer encoding
+    of the same number, like b'\x01\x00' for 1, would check and mark a
+    different legacy key than the number itself, so it is rejected
+
+    :param swapId: int
+    """
+    if swapId < 0:
+        raise Exception("Invalid swap id")
+
+    length = len(swapId)
+    if length > MAX_SWAPID_LENGTH:
+        raise Exception("Invalid swap id")
+
+    # 0 is either empty or a zero byte
+    shortest = 1
+    limit = 128
+    while swapId >= limit:
+        limit = limit * 256
+        shortest += 1
+
+    if length > shortest:
+        raise Exception("Invalid swap id")
+
+
+def markSwapIdProcessed(swapId):
+    pageKey = swapIdPageKey(swapId / SWAPID_PAGE_SIZE)
+    page = Get(ctx, pageKey)
+    Put(ctx, pageKey, page | (1 << (swapId % SWAPID_PAGE_SIZE)))
+
+
+def swapIdPageKey(index):
+    """
+    The storage key of a bitmap page. Page 0 is stored under the plain
+    prefix, both for a literal 0 and for a 0 computed by the VM, which
+    neo-python serializes as a zero byte
+
+    :param index: int: the page index
+    :return: bytearray
+    """
+    if not index:
+        return SWAPID_PAGE_PREFIX
+    return concat(SWAPID_PAGE_PREFIX, index)
+
+
+def migrateSwapIds(swapIds):
+    """
+    Moves swap ids that were processed before bitmap pages were
+    introduced from their own keys to the pages, so checking them
+    reads a single page. Swap ids that were not moved are still
+    found under their own keys.
+    Requires full owner permission ( 3 owners )
+
+    :param swapIds: list of the swap ids to move
+    :return: int: the number of swap ids moved
+    """
+    if check_owners(ctx, ADMINS_REQUIRED):
+        moved = 0
+        for swapId in swapIds:
+            validateSwapId(swapId)
+            legacyKey = concat(SWAPID_PREFIX, swapId)
+            if Get(ctx, legacyKey) > 0:
+                markSwapIdProcessed(swapId)
+                Delete(ctx, legacyKey)
+                moved += 1
+
+        return moved
+    return False
+
+
 def getTotalSwapped():
+    """
+    The amount swapped to eth that has not been swapped back yet
+    """
+    return Get(ctx, SWAPPED_OUTSTANDING)
+
+
+def addSwappedIn(amount):
+    Put(ctx, SWAPPED_IN, Get(ctx, SWAPPED_IN) + amount)
+    Put(ctx, SWAPPED_OUTSTANDING, Get(ctx, SWAPPED_OUTSTANDING) + amount)
+
+
+def addSwappedOut(amount):
+    Put(ctx, SWAPPED_OUT, Get(ctx, SWAPPED_OUT) + amount)
+    Put(ctx, SWAPPED_OUTSTANDING, Get(ctx, SWAPPED_OUTSTANDING) - amount)
+
+
+def reconcileSwapped():
+    """
+    Compares the swap ledger with the actual NEX balance of this contract.
+    The balance can be higher than the outstanding amount when tokens
+    were sent to the contract directly instead of through swapToEth,
+    owners can set the outstanding amount with syncSwapped
+
+    :return: list: [swappedIn, swappedOut, outstanding, balance]
+    """
     contractAddress = GetExecutingScriptHash()
     args = [contractAddress]
     balance = AppCallNex('balanceOf',args)
 
-    return balance
+    return [Get(ctx, SWAPPED_IN), Get(ctx, SWAPPED_OUT), Get(ctx, SWAPPED_OUTSTANDING), balance]
+
+
+def syncSwapped(args):
+    """
+    Sets the outstanding amount that can be swapped back from eth.
+    A contract that held NEX before the swap ledger was introduced,
+    e.g. after a migration, starts with nothing outstanding.
+    Requires full owner permission ( 3 owners )
+
+    :param args: list with optionally the outstanding amount, the NEX balance of this contract if not given
+    :return: int: the new outstanding amount
+    """
+    if check_owners(ctx, ADMINS_REQUIRED):
+        contractAddress = GetExecutingScriptHash()
+        balance = AppCallNex('balanceOf', [contractAddress])
+
+        outstanding = balance
+        if len(args) == 1:
+            outstanding = args[0]
+
+        if outstanding < 0 or outstanding > balance:
+            raise Exception("Outstanding amount exceeds the balance")
+
+        Put(ctx, SWAPPED_OUTSTANDING, outstanding)
+        return outstanding
+    return False
 
 
 def setMinter(args):
+    """
+    Set the minter of a slot, slot 0 if no slot is given
+
+    :param args: list of the minter script hash and optionally the slot
+    :return: bool
+    """
     if check_owners(ctx, ADMINS_REQUIRED):
         minter = args[0]
+        slot = 0
+        if len(args) == 2:
+            slot = args[1]
+
+        if slot < 0 or slot >= get_minter_slots(ctx):
+            return False
+
         if len(minter) == 20:
-            Put(ctx, MINTER_ROLE, minter)
+            Put(ctx, minter_key(slot), minter)
             return True 
     return False
 
+
+def removeMinter(args):
+    if check_owners(ctx, ADMINS_REQUIRED):
+        Delete(ctx, minter_key(args[0]))
+        return True
+    return False
+
+
+def setMinterSlots(args):
+    """
+    Set the number of minter slots. Note that this reassigns
+    the swap ids that each minter is allowed to swap from eth
+
+    :param args: list with the number of slots
+    :return: bool
+    """
+    if check_owners(ctx, ADMINS_REQUIRED):
+        slots = args[0]
+        if slots > 0:
+            Put(ctx, MINTER_SLOTS, slots)
+            return True
+    return False
+
+def importReplayKeys(keys):
+    """
+    Marks swaps to eth as done, e.g. when migrating from another contract.
+    Keys that are already set are skipped, so a batch can be sent again
+
+    :param keys: bytearray: replay keys of REPLAY_KEY_LENGTH bytes each, concatenated
+    :return: int: the number of keys written
+    """
+    if check_owners(ctx, ADMINS_REQUIRED):
+        length = len(keys)
+        if length == 0 or length % REPLAY_KEY_LENGTH != 0:
+            raise Exception("Invalid replay keys")
+
+        written = 0
+        start = 0
+        while start < length:
+            end = start + REPLAY_KEY_LENGTH
+            replayCheck = keys[start:end]
+            if not Get(ctx, replayCheck):
+                Put(ctx, replayCheck, 1)
+                written += 1
+            start = end
+
+        return written
+    return False
+
+
 def validateAddr(addr):
     if len(addr) != 20:
         raise Exception("Invalid Addr")
@@ -19,7 +19,17 @@ TOKEN_OWNER5 = b'\xe3\x9cZ\x9e\x04u\x1b\xfb\x85\xdf\xd0\xb6\x07vl\xdc\xb9\x95q\x
 
 
 OWNERS_INITIALIZED = 'owners_initialized'
+OWNERS = 'owners'
 MINTER_ROLE = 'minter_role'
+MINTER_SLOTS = 'minter_slots'
+
+# Owners are stored as one packed bytearray of 20 byte script hashes
+OWNER_LENGTH = 20
+
+# The Verification trigger requires 4 owner signatures,
+# so there always need to be at least that many owners
+MIN_OWNERS = 4
+MAX_OWNERS = 16
     
 
 def initialize_owners(ctx):
@@ -28,31 +38,37 @@ def initialize_owners(ctx):
     to a storage based version, so that owners can be swapped in case
     an address in compromised or otherwise changed.
 
+    Owners that were initialized under the separate 'owner1'..'owner5'
+    keys are migrated to the packed layout.
+
     :param ctx: StorageContext
     :return:
     """
     print("checking owners initialized")
     if not Get(ctx, OWNERS_INITIALIZED):
         print("initializing owners!")
-        Put(ctx, 'owner1', TOKEN_OWNER1)
-        Put(ctx, 'owner2', TOKEN_OWNER2)
-        Put(ctx, 'owner3', TOKEN_OWNER3)
-        Put(ctx, 'owner4', TOKEN_OWNER4)
-        Put(ctx, 'owner5', TOKEN_OWNER5)
+        owners = concat(TOKEN_OWNER1, TOKEN_OWNER2)
+        owners = concat(owners, TOKEN_OWNER3)
+        owners = concat(owners, TOKEN_OWNER4)
+        owners = concat(owners, TOKEN_OWNER5)
+        Put(ctx, OWNERS, owners)
         Put(ctx, OWNERS_INITIALIZED, True)
         return True
 
-    return False
-
-def is_owner_str(owner):
-    """
-    Determines whether a string is a valid owner string
-
-    :param owner: string identifying an owner
-    :return: bool
-    """
-    if owner == 'owner1' or owner == 'owner2' or owner == 'owner3' or owner == 'owner4' or owner == 'owner5':
+    if not Get(ctx, OWNERS):
+        print("migrating owners!")
+        owners = concat(Get(ctx, 'owner1'), Get(ctx, 'owner2'))
+        owners = concat(owners, Get(ctx, 'owner3'))
+        owners = concat(owners, Get(ctx, 'owner4'))
+        owners = concat(owners, Get(ctx, 'owner5'))
+        Put(ctx, OWNERS, owners)
+        Delete(ctx, 'owner1')
+        Delete(ctx, 'owner2')
+        Delete(ctx, 'owner3')
+        Delete(ctx, 'owner4')
+        Delete(ctx, 'owner5')
         return True
+
     return False
 
 
@@ -63,11 +79,107 @@ def get_owners(ctx):
     :param ctx: StorageContext
     :return: list: a list of owners
     """
-    return [Get(ctx, 'owner1'), Get(ctx, 'owner2'), Get(ctx, 'owner3'), Get(ctx, 'owner4'), Get(ctx, 'owner5')]
+    packed = Get(ctx, OWNERS)
+    total = len(packed)
+
+    owners = []
+    start = 0
+    end = OWNER_LENGTH
+    while end <= total:
+        owners.append(packed[start:end])
+        start = end
+        end = end + OWNER_LENGTH
+
+    return owners
+
+
+def find_owner(packed, owner):
+    """
+    Finds the position of an owner in the packed owners
+
+    :param packed: bytearray: the packed owners
+    :param owner: script hash of the owner
+    :return: int: the offset of the owner, or -1 if it is not an owner
+    """
+    total = len(packed)
+
+    start = 0
+    end = OWNER_LENGTH
+    while end <= total:
+        if packed[start:end] == owner:
+            return start
+        start = end
+        end = end + OWNER_LENGTH
+
+    return -1
+
+
+def owner_position(packed, owner):
+    """
+    Finds the position of an owner given either by its script hash, or by
+    its 'owner1'..'owner9' name from before owners were packed, which is
+    the owner at that place in the packed owners
 
+    :param packed: bytearray: the packed owners
+    :param owner: script hash or name of the owner
+    :return: int: the offset of the owner, or -1 if it is not an owner
+    """
+    if len(owner) == OWNER_LENGTH:
+        return find_owner(packed, owner)
+
+    if len(owner) != 6 or owner[0:5] != 'owner':
+        return -1
+
+    # the digit is a single byte, '1' is 49
+    index = owner[5:6] - 49
+    if index < 0 or index > 8:
+        return -1
+
+    position = index * OWNER_LENGTH
+    if position + OWNER_LENGTH > len(packed):
+        return -1
+
+    return position
+
+
+def get_minter_slots(ctx):
+    """
+    Retrieves the number of minter slots. Swap ids are assigned to
+    minters by ``swapId % slots``, so that several minters can swap
+    from eth in parallel without colliding on the same swap ids
+
+    :param ctx: StorageContext
+    :return: int
+    """
+    slots = Get(ctx, MINTER_SLOTS)
+    if not slots:
+        return 1
+    return slots
 
-def check_minter(ctx):
-    minter = Get(ctx, MINTER_ROLE)
+
+def minter_key(slot):
+    """
+    The storage key of the minter of a slot. Slot 0 is stored under the
+    plain MINTER_ROLE key, both for a literal 0 and for a 0 computed by
+    the VM, which neo-python serializes as a zero byte
+
+    :param slot: int: the minter slot
+    :return: bytearray
+    """
+    if not slot:
+        return MINTER_ROLE
+    return concat(MINTER_ROLE, slot)
+
+
+def check_minter(ctx, slot):
+    """
+    Determines whether this transaction was signed by the minter of a slot
+
+    :param ctx: StorageContext
+    :param slot: int: the minter slot
+    :return: bool
+    """
+    minter = Get(ctx, minter_key(slot))
 
     if not minter:
         print("Please Set a minter")
@@ -81,30 +193,43 @@ def check_minter(ctx):
 def check_owners(ctx, required):
     """
 
-    Determines whether or not this transaction was signed with at least 3 of 5 owner signatures
+    Determines whether or not this transaction was signed with at least
+    the required number of owner signatures
 
     :param ctx: StorageContext
+    :param required: int: the number of owner signatures required
     :return: bool
     """
-    if not Get(ctx, OWNERS_INITIALIZED):
+    packed = Get(ctx, OWNERS)
+    if not packed:
         print("Please run initializeOwners")
         return False
-        
-    total = 0
 
-    owners = get_owners(ctx)
-    for owner in owners:
-        if CheckWitness(owner):
+    count = len(packed)
+
+    total = 0
+    start = 0
+    end = OWNER_LENGTH
+    while end <= count:
+        if CheckWitness(packed[start:end]):
             total += 1
-    return total >= required
+            if total >= required:
+                return True
+        start = end
+        end = end + OWNER_LENGTH
+
+    return False
 
 
 def switch_owner(ctx, args):
     """
     Switch the script hash of an owner to a new one.
-    Requires full owner permission ( 3 of 5 )
+    Requires full owner permission ( 3 owners )
 
-    :param args: a list of arguments with the owner name first ( eg 'owner1') and a script hash second
+    The current owner is given by its script hash, or by its 'owner1'..'owner5'
+    name as before owners were packed
+
+    :param args: a list of arguments with the current owner first and the new script hash second
     :return: bool
     """
     if not check_owners(ctx, 3):
@@ -113,15 +238,77 @@ def switch_owner(ctx, args):
     if len(args) != 2:
         return False
 
-    which_owner = args[0]
+    new_value = args[1]
+    if len(new_value) != OWNER_LENGTH:
+        return False
 
-    if not is_owner_str(which_owner):
+    packed = Get(ctx, OWNERS)
+    if find_owner(packed, new_value) >= 0:
         return False
 
-    new_value = args[1]
+    position = owner_position(packed, args[0])
+    if position < 0:
+        return False
 
-    if len(new_value) == 20:
-        Put(ctx, which_owner, new_value)
-        return True
+    end = position + OWNER_LENGTH
+    owners = concat(packed[0:position], new_value)
+    owners = concat(owners, packed[end:len(packed)])
+    Put(ctx, OWNERS, owners)
+    return True
 
-    return False
+
+def add_owner(ctx, args):
+    """
+    Add a new owner.
+    Requires full owner permission ( 3 owners )
+
+    :param args: a list with the script hash of the new owner
+    :return: bool
+    """
+    if not check_owners(ctx, 3):
+        return False
+
+    if len(args) != 1:
+        return False
+
+    new_value = args[0]
+    if len(new_value) != OWNER_LENGTH:
+        return False
+
+    packed = Get(ctx, OWNERS)
+    if len(packed) >= MAX_OWNERS * OWNER_LENGTH:
+        return False
+
+    if find_owner(packed, new_value) >= 0:
+        return False
+
+    Put(ctx, OWNERS, concat(packed, new_value))
+    return True
+
+
+def remove_owner(ctx, args):
+    """
+    Remove an owner, as long as at least MIN_OWNERS remain.
+    Requires full owner permission ( 3 owners )
+
+    :param args: a list with the script hash of the owner to remove
+    :return: bool
+    """
+    if not check_owners(ctx, 3):
+        return False
+
+    if len(args) != 1:
+        return False
+
+    packed = Get(ctx, OWNERS)
+    if len(packed) <= MIN_OWNERS * OWNER_LENGTH:
+        return False
+
+    position = find_owner(packed, args[0])
+    if position < 0:
+        return False
+
+    end = position + OWNER_LENGTH
+    owners = concat(packed[0:position], packed[end:len(packed)])
+    Put(ctx, OWNERS, owners)
+    return True
@@ -0,0 +1,465 @@
+"""
+Runs NexSwap Main(operation, args) directly in the NEO VM
+
+ContractVM loads the compiled contract and executes it in an
+ApplicationEngine, so opcodes, GAS and the VM limits are the same as on
+the chain, but without a blockchain, wallets, transactions or blocks:
+
+- the storage of the contract is a dict of key -> value, the Storage
+  reads and writes of all invocations are counted
+- AppCallNex is answered by a StubNEP5 with balances and allowances in dicts
+- the witnesses CheckWitness accepts and the script container, whose hash
+  is the transaction hash the contract sees, are passed per invocation
+
+Storage and stub writes of an invocation that faults are undone, like
+the storage of a transaction that faults on the chain.
+
+ApplicationEngine checks the stack, item and array limits of the VM
+before every opcode, and counts all stack items again before every
+SYSCALL, PICKITEM, SETITEM and APPEND, about 120 times per swapToEth.
+ContractVM(check_limits=False) only charges GAS, for fuzzing at about
+three times the rate, when the limits are not what is tested.
+
+On a single core a swapToEth, 558 opcodes, runs about 30 times per
+second with the limits and 100 times without them. Without the limits
+over three quarters of that is StepInto and ExecuteOp of neo-python's
+ExecutionEngine, about 14us per opcode, so thousands of swaps per second
+are out of reach for this VM.
+
+Usage:
+
+    vm = ContractVM.load('NexSwap.py')
+    vm.nex.mint(addr, amount)
+    vm.nex.approve(addr, vm.script_hash, amount)
+    invocation = vm.invoke('swapToEth', [addr, eth_addr, amount], witnesses=[addr])
+
+"""
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+from logzero import logger
+from neocore.Cryptography.Crypto import Crypto
+from neocore.Fixed8 import Fixed8
+from neocore.UInt160 import UInt160
+from neocore.UInt256 import UInt256
+
+from neo.SmartContract.ApplicationEngine import ApplicationEngine
+from neo.SmartContract.StateReader import StateReader
+from neo.SmartContract.TriggerType import Application
+from neo.VM import VMState
+from neo.VM.InteropService import Array, ByteArray, Map, StackItem
+from neo.VM.OpCode import PUSHBYTES20, RET, SYSCALL
+from tools.compile_cache import compile_contract
+
+# AppCallNex of NexSwap.py
+NEX_SCRIPT_HASH = UInt160.ParseString('3A4ACD3647086E7C44398AAC0349802E6A171129')
+
+# Called by the script that stands in for a stub contract
+APPCALL_SYSCALL = b'NexSwap.ContractVM.AppCall'
+
+Invocation = namedtuple('Invocation', ['halted', 'result', 'notifications', 'logs', 'gas_consumed', 'ops'])
+
+Notification = namedtuple('Notification', ['name', 'args'])
+
+# compiled scripts by contract path
+_scripts = {}
+
+
+def stack_item(value) -> StackItem:
+    """
+    :param value: int, bool, bytes, str, UInt160 or a list of those
+    :return: StackItem
+    """
+    if isinstance(value, StackItem):
+        return value
+    if isinstance(value, (list, tuple)):
+        return Array([stack_item(item) for item in value])
+    if isinstance(value, str):
+        return ByteArray(bytearray(value.encode('utf-8')))
+    if isinstance(value, UInt160):
+        return ByteArray(bytearray(value.Data))
+    if isinstance(value, bytes):
+        return ByteArray(bytearray(value))
+    return StackItem.New(value)
+
+
+def script_hash_bytes(value) -> bytes:
+    """
+    :param value: UInt160 or its 20 bytes
+    :return: bytes
+    """
+    if isinstance(value, UInt160):
+        return bytes(value.Data)
+    return bytes(value)
+
+
+class Journal:
+    """
+    Records the previous values of the writes of an invocation, so they can be undone
+    """
+
+    MISSING = object()
+
+    def __init__(self):
+        self.entries = []
+
+    def put(self, mapping: dict, key, value):
+        self.entries.append((mapping, key, mapping.get(key, Journal.MISSING)))
+        mapping[key] = value
+
+    def delete(self, mapping: dict, key):
+        if key in mapping:
+            self.entries.append((mapping, key, mapping.pop(key)))
+
+    def undo(self):
+        for mapping, key, value in reversed(self.entries):
+            if value is Journal.MISSING:
+                mapping.pop(key, None)
+            else:
+                mapping[key] = value
+        self.entries = []
+
+    def clear(self):
+        self.entries = []
+
+
+class StubNEP5:
+    """
+    NEP5 token answering AppCalls of a contract. transferFrom moves tokens
+    the calling contract was approved for, transfer moves the tokens of
+    the calling contract itself
+    """
+
+    def __init__(self, journal: Journal = None):
+        self.journal = journal or Journal()
+        self.balances = {}
+        self.allowances = {}
+
+    def mint(self, addr, amount):
+        addr = script_hash_bytes(addr)
+        self.balances[addr] = self.balances.get(addr, 0) + amount
+
+    def approve(self, owner, spender, amount):
+        self.allowances[(script_hash_bytes(owner), script_hash_bytes(spender))] = amount
+
+    def balance_of(self, addr) -> int:
+        return self.balances.get(script_hash_bytes(addr), 0)
+
+    def invoke(self, caller: bytes, operation: str, args: list):
+        """
+        :param caller: bytes: script hash of the calling contract
+        :param operation: str
+        :param args: list: StackItems
+        :return: the result pushed to the calling contract
+        """
+        if operation == 'balanceOf':
+            return self.balance_of(args[0].GetByteArray())
+
+        if operation == 'transfer':
+            t_from, t_to, amount = bytes(args[0].GetByteArray()), bytes(args[1].GetByteArray()), int(args[2].GetBigInteger())
+            if t_from != caller:
+                return False
+            return self._move(t_from, t_to, amount)
+
+        if operation == 'transferFrom':
+            t_from, t_to, amount = bytes(args[0].GetByteArray()), bytes(args[1].GetByteArray()), int(args[2].GetBigInteger())
+            allowed = self.allowances.get((t_from, caller), 0)
+            if amount > allowed or not self._move(t_from, t_to, amount):
+                return False
+            self.journal.put(self.allowances, (t_from, caller), allowed - amount)
+            return True
+
+        raise Exception("Unknown operation %s" % operation)
+
+    def _move(self, t_from, t_to, amount):
+        if amount <= 0 or self.balances.get(t_from, 0) < amount:
+            return False
+        self.journal.put(self.balances, t_from, self.balances[t_from] - amount)
+        self.journal.put(self.balances, t_to, self.balances.get(t_to, 0) + amount)
+        return True
+
+
+class ScriptContainer:
+    """
+    Stands in for the transaction of an invocation, the contract only reads its hash
+    """
+
+    def __init__(self, hash: UInt256):
+        self.Hash = hash
+
+
+# What GetItemCount does with a stack item, by its type
+ITEM, ARRAY, MAP = range(3)
+_item_kinds = {}
+
+
+def item_kind(item_type):
+    kind = _item_kinds.get(item_type)
+    if kind is None:
+        if issubclass(item_type, Map):
+            kind = MAP
+        elif issubclass(item_type, Array):
+            kind = ARRAY
+        else:
+            kind = ITEM
+        _item_kinds[item_type] = kind
+    return kind
+
+
+class ContractVMEngine(ApplicationEngine):
+
+    def __init__(self, vm, trigger, container, witnesses, height, gas):
+        super(ContractVMEngine, self).__init__(trigger, container, vm, vm.service, gas)
+        self.check_limits = vm.check_limits
+        self.witnesses = witnesses
+        self.height = height
+        self.notifications = []
+        self.logs = []
+
+    @property
+    def CurrentContext(self):
+        # ExecutionEngine.CurrentContext without the bounds checks of
+        # RandomAccessStack.Peek, the VM reads it several times per opcode
+        return self._InvocationStack._list[-1]
+
+    def GetItemCount(self, items_list):
+        # ApplicationEngine.GetItemCount, with the kind of an item looked up by
+        # its type instead of isinstance checks against the ABC based stack
+        # items, which took over half of the time of an invocation with limits
+        count = 0
+        kinds = _item_kinds
+        items = list(items_list)
+        pop = items.pop
+        while items:
+            item = pop()
+            kind = kinds.get(type(item))
+            if kind is None:
+                kind = item_kind(type(item))
+            if kind == MAP:
+                items.extend(item.Values)
+            elif kind == ARRAY:
+                items.extend(item.GetArray())
+            else:
+                count += 1
+
+        return count
+
+    def Execute(self):
+        if self.check_limits:
+            return super(ContractVMEngine, self).Execute()
+
+        # ApplicationEngine.Execute without the checks of the VM limits
+        while self._VMState & VMState.HALT == 0 and self._VMState & VMState.FAULT == 0:
+            context = self._InvocationStack._list[-1]
+            if context.InstructionPointer < len(context.Script):
+                try:
+                    self.gas_consumed = self.gas_consumed + (self.GetPrice() * self.ratio)
+                except Exception as e:
+                    logger.debug("Exception calculating gas consumed %s " % e)
+                    self._VMState |= VMState.FAULT
+                    return False
+
+                if self.gas_consumed > self.gas_amount:
+                    self._VMState |= VMState.FAULT
+                    return False
+
+            self.StepInto()
+
+        return not self._VMState & VMState.FAULT > 0
+
+
+class ContractVMService(StateReader):
+    """
+    The interop service of the engine, storage and the chain are answered by a ContractVM
+    """
+
+    def __init__(self, vm):
+        super(ContractVMService, self).__init__()
+        self.vm = vm
+
+        for prefix in ['System', 'Neo']:
+            self.Register('%s.Storage.Put' % prefix, self.Storage_Put)
+            self.Register('%s.Storage.Delete' % prefix, self.Storage_Delete)
+
+        self.Register(APPCALL_SYSCALL.decode('ascii'), self.Stub_AppCall)
+
+    def CheckWitnessHash(self, engine: ContractVMEngine, hash):
+        return bytes(hash.Data) in engine.witnesses
+
+    def CheckStorageContext(self, context):
+        return context is not None and bytes(context.ScriptHash.Data) == bytes(self.vm.script_hash.Data)
+
+    def Runtime_Notify(self, engine: ContractVMEngine):
+        state = engine.CurrentContext.EvaluationStack.Pop()
+        items = state.GetArray()
+        engine.notifications.append(Notification(items[0].GetString(), items[1:]))
+        return True
+
+    def Runtime_Log(self, engine: ContractVMEngine):
+        engine.logs.append(engine.CurrentContext.EvaluationStack.Pop().GetString())
+        return True
+
+    def Blockchain_GetHeight(self, engine: ContractVMEngine):
+        engine.CurrentContext.EvaluationStack.PushT(engine.height)
+        return True
+
+    def Storage_Get(self, engine: ContractVMEngine):
+        context = engine.CurrentContext.EvaluationStack.Pop().GetInterface()
+        if not self.CheckStorageContext(context):
+            return False
+
+        key = bytes(engine.CurrentContext.EvaluationStack.Pop().GetByteArray())
+        engine.CurrentContext.EvaluationStack.PushT(bytearray(self.vm.storage.get(key, b'')))
+        self.vm.storage_reads += 1
+        return True
+
+    def Storage_Put(self, engine: ContractVMEngine):
+        context = engine.CurrentContext.EvaluationStack.Pop().GetInterface()
+        if not self.CheckStorageContext(context):
+            return False
+
+        key = bytes(engine.CurrentContext.EvaluationStack.Pop().GetByteArray())
+        if len(key) > 1024:
+            return False
+
+        value = bytes(engine.CurrentContext.EvaluationStack.Pop().GetByteArray())
+        self.vm.journal.put(self.vm.storage, key, value)
+        self.vm.storage_writes += 1
+        return True
+
+    def Storage_Delete(self, engine: ContractVMEngine):
+        context = engine.CurrentContext.EvaluationStack.Pop().GetInterface()
+        if not self.CheckStorageContext(context):
+            return False
+
+        key = bytes(engine.CurrentContext.EvaluationStack.Pop().GetByteArray())
+        self.vm.journal.delete(self.vm.storage, key)
+        self.vm.storage_writes += 1
+        return True
+
+    def Stub_AppCall(self, engine: ContractVMEngine):
+        estack = engine.CurrentContext.EvaluationStack
+        stub = self.vm.stubs.get(bytes(estack.Pop().GetByteArray()))
+        operation = estack.Pop().GetString()
+        args = estack.Pop().GetArray()
+
+        try:
+            result = stub.invoke(bytes(engine.CallingContext.ScriptHash()), operation, args)
+        except Exception:
+            # faults the invocation like a failing syscall
+            return False
+
+        estack.PushT(result)
+        return True
+
+
+class ContractVM:
+    """
+    Executes a contract with its storage in a dict, see the module docstring
+    """
+
+    def __init__(self, script: bytes, check_limits=True):
+        """
+        :param script: bytes: the compiled contract
+        :param check_limits: bool: whether to check the VM limits before every opcode
+        """
+        self.script = bytes(script)
+        self.check_limits = check_limits
+        self.script_hash = UInt160(data=Crypto.Hash160Bytes(self.script))
+
+        self.journal = Journal()
+        self.storage = {}
+        self.height = 0
+        self.invocations = 0
+
+        # Storage.Get and Storage.Put or Delete calls of all invocations
+        self.storage_reads = 0
+        self.storage_writes = 0
+
+        self.service = ContractVMService(self)
+        self.stubs = {}
+        self.stub_scripts = {}
+
+        self.nex = self.register_stub(NEX_SCRIPT_HASH, StubNEP5(self.journal))
+
+    @classmethod
+    def load(cls, contract_path, check_limits=True):
+        """
+        :param contract_path: str: path of the contract source, compiled through the compile cache
+        :param check_limits: bool: whether to check the VM limits before every opcode
+        :return: ContractVM
+        """
+        contract_path = os.path.abspath(contract_path)
+
+        if contract_path not in _scripts:
+            with tempfile.TemporaryDirectory() as output_dir:
+                avm_path = compile_contract(contract_path, output_path=os.path.join(output_dir, 'contract.avm'))
+                with open(avm_path, 'rb') as handle:
+                    _scripts[contract_path] = handle.read()
+
+        return cls(_scripts[contract_path], check_limits=check_limits)
+
+    def register_stub(self, script_hash: UInt160, stub):
+        """
+        Answers the AppCalls to a script hash with the invoke method of a stub
+
+        :param script_hash: UInt160
+        :param stub: an object with invoke(caller, operation, args)
+        :return: the stub
+        """
+        self.stubs[bytes(script_hash.Data)] = stub
+
+        # a script that hands the operation and arguments to the stub
+        name = APPCALL_SYSCALL
+        self.stub_scripts[script_hash.ToBytes()] = PUSHBYTES20 + bytes(script_hash.Data) + SYSCALL + bytes([len(name)]) + name + RET
+
+        return stub
+
+    def GetScript(self, script_hash):
+        return self.stub_scripts.get(script_hash)
+
+    def GetContractState(self, script_hash):
+        return None
+
+    def next_container(self) -> ScriptContainer:
+        """
+        :return: ScriptContainer: with a hash that is distinct for every invocation of this vm
+        """
+        self.invocations += 1
+        return ScriptContainer(UInt256(data=bytearray(hashlib.sha256(self.invocations.to_bytes(8, 'little')).digest())))
+
+    def invoke(self, operation, args=(), witnesses=(), container=None, trigger=Application, height=None, gas=Fixed8.Zero()) -> Invocation:
+        """
+        :param operation: str
+        :param args: list: the arguments, converted with stack_item
+        :param witnesses: list: script hashes CheckWitness accepts, UInt160 or 20 bytes
+        :param container: the script container, defaults to a ScriptContainer with a new hash
+        :param trigger: the trigger type, Application or Verification
+        :param height: int: the height GetHeight returns, defaults to the height attribute
+        :param gas: Fixed8: the GAS on top of the free 10 GAS
+        :return: Invocation
+        """
+        if container is None:
+            container = self.next_container()
+
+        engine = ContractVMEngine(self, trigger, container,
+                                  {script_hash_bytes(witness) for witness in witnesses},
+                                  self.height if height is None else height, gas)
+
+        context = engine.LoadScript(self.script)
+        context.EvaluationStack.PushT(stack_item(list(args)))
+        context.EvaluationStack.PushT(stack_item(operation))
+
+        self.journal.clear()
+        halted = engine.Execute() and engine.State & VMState.HALT > 0
+
+        if halted:
+            self.journal.clear()
+            result = engine.ResultStack.Peek() if engine.ResultStack.Count else None
+        else:
+            self.journal.undo()
+            result = None
+
+        return Invocation(halted, result, engine.notifications, engine.logs, engine.GasConsumed(), engine.ops_processed)
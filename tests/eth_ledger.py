@@ -0,0 +1,50 @@
+import time
+from collections import namedtuple
+
+EthMint = namedtuple('EthMint', ['swap_id', 'eth_addr', 'amount', 'timestamp'])
+EthBurn = namedtuple('EthBurn', ['burn_id', 'eth_addr', 'neo_addr', 'amount', 'timestamp'])
+
+
+class EthLedger:
+    """
+    In-process stand-in for the NEX ERC-20 contract on Ethereum.
+
+    Mints are keyed by the swapId of an onSwapToEth event, so minting the
+    same swap twice is rejected just like on Ethereum. Burns get sequential
+    burn ids, which are the swap ids used for swapFromEth on NEO.
+    """
+
+    def __init__(self, first_burn_id=1):
+        self.balances = {}
+        self.mints = {}
+        self.burns = []
+        self.next_burn_id = first_burn_id
+
+    def mint(self, swap_id, eth_addr, amount) -> EthMint:
+
+        if swap_id in self.mints:
+            raise Exception("Already minted swap %s" % swap_id)
+
+        eth_addr = bytes(eth_addr)
+        self.balances[eth_addr] = self.balances.get(eth_addr, 0) + amount
+
+        minted = EthMint(swap_id, eth_addr, amount, time.perf_counter())
+        self.mints[swap_id] = minted
+        return minted
+
+    def burn(self, eth_addr, neo_addr, amount) -> EthBurn:
+
+        eth_addr = bytes(eth_addr)
+        if self.balances.get(eth_addr, 0) < amount:
+            raise Exception("Insufficient balance to burn")
+
+        self.balances[eth_addr] -= amount
+
+        burned = EthBurn(self.next_burn_id, eth_addr, neo_addr, amount, time.perf_counter())
+        self.burns.append(burned)
+        self.next_burn_id += 1
+        return burned
+
+    @property
+    def total_supply(self):
+        return sum(self.balances.values())
@@ -0,0 +1,178 @@
+"""
+A blockchain that keeps its database in memory
+
+MemoryBlockchain is a LevelDBBlockchain whose database is a MemoryDB, a
+dict with a sorted key index that implements the part of the plyvel API
+neo-python uses (get, put, delete, prefix iterators, write batches and
+snapshots). Everything else, from persisting blocks to the application
+engine, is the LevelDB implementation, so it can be registered with
+Blockchain.RegisterBlockchain in place of a LevelDBBlockchain.
+
+A fixture chain is loaded once with from_leveldb() and every test class
+registers its own Clone() of it.
+"""
+from bisect import bisect_left, insort
+
+from neo.Core.Blockchain import Blockchain
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import \
+    LevelDBBlockchain
+
+
+class MemoryDB:
+    """
+    The subset of plyvel.DB used by neo-python, keys are iterated in byte order like LevelDB
+    """
+
+    def __init__(self, items=None):
+        self._items = dict(items) if items else {}
+        self._keys = sorted(self._items)
+
+    def get(self, key, default=None):
+        return self._items.get(bytes(key), default)
+
+    def put(self, key, value):
+        key = bytes(key)
+        if key not in self._items:
+            insort(self._keys, key)
+        self._items[key] = bytes(value)
+
+    def delete(self, key):
+        key = bytes(key)
+        if key in self._items:
+            del self._items[key]
+            del self._keys[bisect_left(self._keys, key)]
+
+    def iterator(self, prefix=None, include_key=True, include_value=True, reverse=False):
+        """
+        Iterates over the items at the time of the call, like a plyvel iterator does over its implicit snapshot
+        """
+        if prefix:
+            prefix = bytes(prefix)
+            start = bisect_left(self._keys, prefix)
+            end = start
+            while end < len(self._keys) and self._keys[end].startswith(prefix):
+                end += 1
+            keys = self._keys[start:end]
+        else:
+            keys = list(self._keys)
+
+        if reverse:
+            keys.reverse()
+
+        if include_key and include_value:
+            return iter([(key, self._items[key]) for key in keys])
+        if include_value:
+            return iter([self._items[key] for key in keys])
+        return iter(keys)
+
+    def write_batch(self, transaction=False):
+        return MemoryWriteBatch(self, transaction)
+
+    def snapshot(self):
+        return self.copy()
+
+    def copy(self):
+        db = MemoryDB()
+        db._items = dict(self._items)
+        db._keys = list(self._keys)
+        return db
+
+    def __len__(self):
+        return len(self._items)
+
+    def close(self):
+        pass
+
+
+class MemoryWriteBatch:
+    """
+    Collects puts and deletes and applies them when the batch is written
+    """
+
+    def __init__(self, db: MemoryDB, transaction=False):
+        self.db = db
+        self.transaction = transaction
+        self.operations = []
+
+    def put(self, key, value):
+        self.operations.append((bytes(key), bytes(value)))
+
+    def delete(self, key):
+        self.operations.append((bytes(key), None))
+
+    def clear(self):
+        self.operations = []
+
+    def write(self):
+        for key, value in self.operations:
+            if value is None:
+                self.db.delete(key)
+            else:
+                self.db.put(key, value)
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # like plyvel, a batch is only discarded on an exception if it is a transaction
+        if exc_type is None or not self.transaction:
+            self.write()
+
+
+class MemoryBlockchain(LevelDBBlockchain):
+
+    def __init__(self, db: MemoryDB = None, header_index=None, current_block_height=0, stored_header_count=0):
+        """
+        Without a database this is a new chain with only the genesis block
+
+        :param db: MemoryDB: the items of a chain
+        :param header_index: list: the header hashes of that chain
+        :param current_block_height: int
+        :param stored_header_count: int: number of header hashes stored in IX_HeaderHashList
+        """
+        self._path = ':memory:'
+        self._block_cache = {}
+        self.TXProcessed = 0
+
+        if db is None:
+            self._db = MemoryDB()
+            self._header_index = [Blockchain.GenesisBlock().Header.Hash.ToBytes()]
+            self._current_block_height = 0
+            self._stored_header_count = 0
+
+            self.Persist(Blockchain.GenesisBlock())
+            self._db.put(DBPrefix.SYS_Version, self._sysversion)
+        else:
+            self._db = db
+            self._header_index = list(header_index)
+            self._current_block_height = current_block_height
+            self._stored_header_count = stored_header_count
+
+    @classmethod
+    def from_leveldb(cls, path):
+        """
+        Loads a LevelDB chain into memory. The LevelDB chain is opened as
+        usual, so the header index is restored the same way
+
+        :param path: str: path of the LevelDB chain
+        :return: MemoryBlockchain
+        """
+        leveldb = LevelDBBlockchain(path, skip_version_check=True)
+        try:
+            return cls(db=MemoryDB(leveldb._db.iterator()),
+                       header_index=leveldb._header_index,
+                       current_block_height=leveldb._current_block_height,
+                       stored_header_count=leveldb._stored_header_count)
+        finally:
+            leveldb.Dispose()
+
+    def Clone(self):
+        """
+        :return: MemoryBlockchain: an independent copy of this chain
+        """
+        return MemoryBlockchain(db=self._db.copy(),
+                                header_index=self._header_index,
+                                current_block_height=self._current_block_height,
+                                stored_header_count=self._stored_header_count)
@@ -1,4 +1,6 @@
 import datetime
+import hashlib
+import json
 import os
 import shutil
 import tarfile
@@ -6,7 +8,6 @@ from uuid import uuid4
 
 import logzero
 import requests
-from boa.compiler import Compiler
 from logzero import logger
 from neocore.KeyPair import KeyPair
 from neocore.UInt160 import UInt160
@@ -21,6 +22,7 @@ from neo.Core.Witness import Witness
 from neo.EventHub import events
 from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import \
     LevelDBBlockchain
+from neo.Implementations.Wallets.peewee.Models import Account
 from neo.Implementations.Wallets.peewee.UserWallet import UserWallet
 from neo.Network.NodeLeader import NodeLeader
 from neo.Prompt.Commands.BuildNRun import generate_deploy_script
@@ -34,17 +36,82 @@ from neo.SmartContract.SmartContractEvent import (NotifyEvent,
 from neo.Utils.BlockchainFixtureTestCase import BlockchainFixtureTestCase
 from neo.Wallets.NEP5Token import NEP5Token
 from neo.Wallets.utils import to_aes_key
+from tests.memory_blockchain import MemoryBlockchain
+from tools.compile_cache import compile_contract
 
 settings.USE_DEBUG_STORAGE = True
 settings.DEBUG_STORAGE_PATH = './fixtures/debugstorage'
 settings.LOG_SMART_CONTRACT_EVENTS = True
 settings.DATA_DIR_PATH = os.getcwd()
 
+
+def worker_id():
+    """
+    :return: str: the pytest-xdist worker running the tests, empty when they run in a single process
+    """
+    return os.environ.get('PYTEST_XDIST_WORKER', '')
+
+
+def worker_path(path):
+    """
+    Scopes a path that tests write to to the worker, so workers never share a chain, wallet or build output
+
+    :param path: str
+    :return: str: the path with the worker as suffix, or the path itself outside of pytest-xdist
+    """
+    worker = worker_id()
+    if not worker:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return '%s-%s%s' % (root, worker, ext)
+
+
+class FixtureWallet(UserWallet):
+    """
+    A UserWallet that shares decrypted key pairs between the wallets of a process,
+    as every test class opens fresh copies of the same fixture wallets
+    """
+
+    key_pairs = {}
+
+    def LoadKeyPairs(self):
+        keypairs = {}
+        for db_account in Account.select():
+            cache_key = (self._iv, self._master_key, bytes(db_account.PrivateKeyEncrypted))
+
+            acct = FixtureWallet.key_pairs.get(cache_key)
+            if acct is None:
+                acct = KeyPair(self.DecryptPrivateKey(db_account.PrivateKeyEncrypted))
+                FixtureWallet.key_pairs[cache_key] = acct
+
+            keypairs[acct.PublicKeyHash.ToBytes()] = acct
+
+        return keypairs
+
+
 class NexFixtureTest(BlockchainFixtureTestCase):
 
     FIXTURE_REMOTE_LOC = 'https://s3.us-east-2.amazonaws.com/cityofzion/fixtures/empty_fixture.tar.gz'
     FIXTURE_FILENAME = './fixtures/empty_fixture.tar.gz'
 
+    # extracted fixtures, one directory per tarball checksum
+    FIXTURE_TEMPLATES_PATH = './fixtures/templates'
+
+    # LevelDB never modifies table files, so those are hard linked into clones
+    IMMUTABLE_CHAIN_FILES = ('.ldb', '.sst')
+
+    # run on a copy of the fixture chain in memory, NEX_LEVELDB_CHAIN=1 runs every class on LevelDB
+    USE_MEMORY_CHAIN = not os.environ.get('NEX_LEVELDB_CHAIN')
+
+    # fixture chains loaded into memory, by their path in the template
+    memory_chains = {}
+
+    # the chain taken by snapshot_state, a MemoryBlockchain or the path of a LevelDB copy,
+    # and the copies of the wallets at that time, by wallet name
+    chain_snapshot = None
+    wallet_snapshots = None
+
     dirname = None
 
     dispatched_events = []
@@ -53,9 +120,20 @@ class NexFixtureTest(BlockchainFixtureTestCase):
 
     deployed_contract = None
 
+    # transactions for the next block of _commit_queued_txs, and the wallets that sent them
+    queued_txs = []
+    queued_wallets = []
+
+    @classmethod
+    def fixture_chain_path(cls):
+        """
+        :return: str: path of the chain in the fixture tarball
+        """
+        return 'fixtures/test_chain'
+
     @classmethod
-    def leveldb_testpath(self):
-        return os.path.join(settings.DATA_DIR_PATH, 'fixtures/test_chain')
+    def leveldb_testpath(cls):
+        return worker_path(os.path.join(settings.DATA_DIR_PATH, cls.fixture_chain_path()))
 
     def on_notif(self, evt):
         ntype = ''
@@ -241,9 +319,24 @@ class NexFixtureTest(BlockchainFixtureTestCase):
         nep5.Query()
         return nep5
 
+    @classmethod
+    def wallet_path(cls, wallet_name):
+        return worker_path('./tmp/%s' % wallet_name)
+
     @classmethod
     def get_wallet(cls, wallet_name):
-        wallet = UserWallet.Open('./tmp/%s' % wallet_name, to_aes_key(cls.wallet_pw()))
+        """
+        Opens a copy of a fixture wallet. The fixture is copied on first use
+        in a test class, so only the wallets a test needs are copied and opened
+        """
+        path = cls.wallet_path(wallet_name)
+
+        if wallet_name not in NexFixtureTest.copied_wallets:
+            shutil.copyfile('./fixtures/%s' % wallet_name, path)
+            NexFixtureTest.copied_wallets.append(wallet_name)
+
+        wallet = FixtureWallet.Open(path, to_aes_key(cls.wallet_pw()))
+        NexFixtureTest.opened_wallets.append(wallet)
         return wallet
 
     @classmethod
@@ -272,6 +365,13 @@ class NexFixtureTest(BlockchainFixtureTestCase):
     agent = None
     monitor = None
 
+    WALLET_ATTRIBUTES = ('wallet1', 'wallet2', 'wallet3', 'wallet4', 'tokenOwner1', 'owner1', 'owner2',
+                         'owner3', 'owner4', 'owner5', 'agent', 'monitor')
+
+    # names of the fixture wallets copied to tmp, and the wallets opened from them
+    copied_wallets = []
+    opened_wallets = []
+
     @classmethod
     def GetWallet1(cls, recreate=False):
         if not cls.wallet1 or recreate:
@@ -359,43 +459,208 @@ class NexFixtureTest(BlockchainFixtureTestCase):
 
                 response.raise_for_status()
                 os.makedirs(os.path.dirname(cls.FIXTURE_FILENAME), exist_ok=True)
-                with open(cls.FIXTURE_FILENAME, 'wb+') as handle:
+
+                # download next to the tarball and rename, as other workers may be waiting for it
+                download_path = '%s.%s' % (cls.FIXTURE_FILENAME, uuid4().hex)
+                with open(download_path, 'wb+') as handle:
                     for block in response.iter_content(1024):
                         handle.write(block)
+                os.replace(download_path, cls.FIXTURE_FILENAME)
 
             try:
-                tar = tarfile.open(cls.FIXTURE_FILENAME)
-                tar.extractall(path=settings.DATA_DIR_PATH)
-                tar.close()
+                template = cls.fixture_template()
             except Exception as e:
                 raise Exception("Could not extract tar file - %s. You may want need to remove the fixtures file %s manually to fix this." % (e, cls.FIXTURE_FILENAME))
 
-            if not os.path.exists(cls.leveldb_testpath()):
-                raise Exception("Error downloading fixtures at %s" % cls.leveldb_testpath())
-
             settings.setup_unittest_net()
+            settings.DEBUG_STORAGE_PATH = worker_path(settings.DEBUG_STORAGE_PATH)
 
-            cls._blockchain = LevelDBBlockchain(path=cls.leveldb_testpath(), skip_version_check=True)
-            Blockchain.RegisterBlockchain(cls._blockchain)
+            if cls.USE_MEMORY_CHAIN:
+                cls._blockchain = cls.memory_chain(template).Clone()
+            else:
+                cls.clone_fixture_chain(template)
+                cls._blockchain = LevelDBBlockchain(path=cls.leveldb_testpath(), skip_version_check=True)
 
-            shutil.copyfile('./fixtures/%s' % cls.wtest1_wallet(), './tmp/%s' % cls.wtest1_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.wtest2_wallet(), './tmp/%s' % cls.wtest2_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.wtest3_wallet(), './tmp/%s' % cls.wtest3_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.wtest4_wallet(), './tmp/%s' % cls.wtest4_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.owner1_wallet(), './tmp/%s' % cls.owner1_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.owner2_wallet(), './tmp/%s' % cls.owner2_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.owner3_wallet(), './tmp/%s' % cls.owner3_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.owner4_wallet(), './tmp/%s' % cls.owner4_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.owner5_wallet(), './tmp/%s' % cls.owner5_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.token_owner_wallet(), './tmp/%s' % cls.token_owner_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.agent_wallet(), './tmp/%s' % cls.agent_wallet())
-            shutil.copyfile('./fixtures/%s' % cls.monitor_wallet(), './tmp/%s' % cls.monitor_wallet())
+            Blockchain.RegisterBlockchain(cls._blockchain)
 
             NodeLeader.Instance().MemPool = {}
 
         except Exception as e:
             print("Could not setup NexSimpleTset: %s " % e)
 
+    @classmethod
+    def fixture_checksum(cls):
+        """
+        sha256 of the fixture tarball. It is stored next to the tarball along with
+        its size and modification time, so it is only computed again when those change
+        """
+        stat = os.stat(cls.FIXTURE_FILENAME)
+        checksum_path = '%s.sha256' % cls.FIXTURE_FILENAME
+
+        try:
+            with open(checksum_path) as handle:
+                cached = json.load(handle)
+            if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                return cached['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        sha256 = hashlib.sha256()
+        with open(cls.FIXTURE_FILENAME, 'rb') as handle:
+            for block in iter(lambda: handle.read(1 << 20), b''):
+                sha256.update(block)
+
+        temp_path = '%s.%s' % (checksum_path, uuid4().hex)
+        with open(temp_path, 'w') as handle:
+            json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256.hexdigest()}, handle)
+        os.replace(temp_path, checksum_path)
+
+        return sha256.hexdigest()
+
+    @classmethod
+    def fixture_template(cls):
+        """
+        Extracts the fixture tarball once into a read only template directory
+
+        :return: str: path of the template, it has the same layout as settings.DATA_DIR_PATH
+        """
+        name = os.path.basename(cls.FIXTURE_FILENAME).split('.')[0]
+        template = os.path.join(cls.FIXTURE_TEMPLATES_PATH, '%s-%s' % (name, cls.fixture_checksum()[:16]))
+
+        if os.path.exists(template):
+            return template
+
+        os.makedirs(cls.FIXTURE_TEMPLATES_PATH, exist_ok=True)
+
+        # templates of an earlier version of this tarball, but not ones other workers are extracting now
+        for existing in os.listdir(cls.FIXTURE_TEMPLATES_PATH):
+            if existing.startswith('%s-' % name) and not existing.startswith(os.path.basename(template)):
+                shutil.rmtree(os.path.join(cls.FIXTURE_TEMPLATES_PATH, existing), ignore_errors=True)
+
+        # extract next to the template and rename, so a template is never seen half extracted
+        extract_path = '%s.%s' % (template, uuid4().hex)
+        tar = tarfile.open(cls.FIXTURE_FILENAME)
+        tar.extractall(path=extract_path)
+        tar.close()
+
+        for root, dirs, files in os.walk(extract_path):
+            for file in files:
+                os.chmod(os.path.join(root, file), 0o444)
+
+        try:
+            os.rename(extract_path, template)
+        except OSError:
+            # extracted by another process in the meantime
+            shutil.rmtree(extract_path, ignore_errors=True)
+
+        return template
+
+    @classmethod
+    def clone_fixture_chain(cls, template):
+        """
+        Clones the chain of a template to leveldb_testpath, hard linking the table files
+        """
+        chain_path = cls.leveldb_testpath()
+        template_chain = os.path.join(template, cls.fixture_chain_path())
+
+        if not os.path.exists(template_chain):
+            raise Exception("Error downloading fixtures at %s" % chain_path)
+
+        cls.copy_chain(template_chain, chain_path)
+
+    @classmethod
+    def copy_chain(cls, source, destination):
+        """
+        Copies a closed LevelDB chain, hard linking the table files
+        """
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+
+        def copy(src, dst):
+            if src.endswith(cls.IMMUTABLE_CHAIN_FILES):
+                try:
+                    return os.link(src, dst)
+                except OSError:
+                    pass
+            shutil.copyfile(src, dst)
+            os.chmod(dst, 0o644)
+
+        shutil.copytree(source, destination, copy_function=copy)
+
+    @classmethod
+    def memory_chain(cls, template):
+        """
+        Loads the chain of a template into memory, once per process
+
+        :return: MemoryBlockchain: the loaded chain, test classes register a clone of it
+        """
+        template_chain = os.path.join(template, cls.fixture_chain_path())
+
+        if template_chain not in NexFixtureTest.memory_chains:
+            cls.clone_fixture_chain(template)
+            NexFixtureTest.memory_chains[template_chain] = MemoryBlockchain.from_leveldb(cls.leveldb_testpath())
+            shutil.rmtree(cls.leveldb_testpath())
+
+        return NexFixtureTest.memory_chains[template_chain]
+
+    @classmethod
+    def register_chain(cls, blockchain):
+        Blockchain.DeregisterBlockchain()
+        cls._blockchain = blockchain
+        Blockchain.RegisterBlockchain(blockchain)
+
+    @classmethod
+    def snapshot_state(cls):
+        """
+        Takes a snapshot of the chain and of the wallets copied so far, restore_state returns to it
+        """
+        if cls.USE_MEMORY_CHAIN:
+            cls.chain_snapshot = cls._blockchain.Clone()
+        else:
+            # LevelDB has to be closed to be copied
+            cls.chain_snapshot = '%s-snapshot' % cls.leveldb_testpath()
+            cls._blockchain.Dispose()
+            cls.copy_chain(cls.leveldb_testpath(), cls.chain_snapshot)
+            cls.register_chain(LevelDBBlockchain(path=cls.leveldb_testpath(), skip_version_check=True))
+
+        cls.wallet_snapshots = {}
+        for wallet_name in NexFixtureTest.copied_wallets:
+            snapshot_path = '%s.snapshot' % cls.wallet_path(wallet_name)
+            shutil.copyfile(cls.wallet_path(wallet_name), snapshot_path)
+            cls.wallet_snapshots[wallet_name] = snapshot_path
+
+    @classmethod
+    def restore_state(cls):
+        """
+        Returns the chain and the wallets to the last snapshot. Wallets are
+        closed and opened again on their next use, wallets copied after the
+        snapshot are removed and transactions in the mempool are dropped
+        """
+        for wallet in NexFixtureTest.opened_wallets:
+            wallet.Close()
+        NexFixtureTest.opened_wallets = []
+
+        for attribute in cls.WALLET_ATTRIBUTES:
+            setattr(cls, attribute, None)
+
+        for wallet_name in list(NexFixtureTest.copied_wallets):
+            if wallet_name in cls.wallet_snapshots:
+                shutil.copyfile(cls.wallet_snapshots[wallet_name], cls.wallet_path(wallet_name))
+            else:
+                os.remove(cls.wallet_path(wallet_name))
+                NexFixtureTest.copied_wallets.remove(wallet_name)
+
+        cls._blockchain.Dispose()
+        if cls.USE_MEMORY_CHAIN:
+            cls.register_chain(cls.chain_snapshot.Clone())
+        else:
+            cls.copy_chain(cls.chain_snapshot, cls.leveldb_testpath())
+            cls.register_chain(LevelDBBlockchain(path=cls.leveldb_testpath(), skip_version_check=True))
+
+        NodeLeader.Instance().MemPool = {}
+        NexFixtureTest.queued_txs = []
+        NexFixtureTest.queued_wallets = []
+
     @classmethod
     def tearDownClass(cls):
 
@@ -404,56 +669,39 @@ class NexFixtureTest(BlockchainFixtureTestCase):
         if cls._blockchain is not None:
             cls._blockchain.Dispose()
 
-        shutil.rmtree(cls.leveldb_testpath())
+        if not cls.USE_MEMORY_CHAIN:
+            shutil.rmtree(cls.leveldb_testpath())
+
+            if cls.chain_snapshot:
+                shutil.rmtree(cls.chain_snapshot)
+
+        cls.chain_snapshot = None
 
         NodeLeader.Instance().MemPool = {}
 
-        if cls.wallet1:
-            cls.wallet1.Close()
-        if cls.wallet2:
-            cls.wallet2.Close()
-        if cls.wallet3:
-            cls.wallet3.Close()
-        if cls.wallet4:
-            cls.wallet4.Close()
-        if cls.owner1:
-            cls.owner1.Close()
-        if cls.owner2:
-            cls.owner2.Close()
-        if cls.owner3:
-            cls.owner3.Close()
-        if cls.owner4:
-            cls.owner4.Close()
-        if cls.owner5:
-            cls.owner5.Close()
-        if cls.agent:
-            cls.agent.Close()
-        if cls.monitor:
-            cls.monitor.Close()
-        if cls.tokenOwner1:
-            cls.tokenOwner1.Close()
-        try:
-            os.remove('./tmp/%s' % cls.wtest1_wallet())
-            os.remove('./tmp/%s' % cls.wtest2_wallet())
-            os.remove('./tmp/%s' % cls.wtest3_wallet())
-            os.remove('./tmp/%s' % cls.wtest4_wallet())
-            os.remove('./tmp/%s' % cls.owner1_wallet())
-            os.remove('./tmp/%s' % cls.owner2_wallet())
-            os.remove('./tmp/%s' % cls.owner3_wallet())
-            os.remove('./tmp/%s' % cls.owner4_wallet())
-            os.remove('./tmp/%s' % cls.owner5_wallet())
-            os.remove('./tmp/%s' % cls.token_owner_wallet())
-            os.remove('./tmp/%s' % cls.agent_wallet())
-            os.remove('./tmp/%s' % cls.monitor_wallet())
+        for wallet in NexFixtureTest.opened_wallets:
+            wallet.Close()
 
-        except Exception as e:
-            print("couldn't remove wallets %s " % e)
+        for attribute in cls.WALLET_ATTRIBUTES:
+            setattr(cls, attribute, None)
 
-    def _deploy_contract_to_blockcahin(self, contract_path, wallet) -> (UInt160, Block):
+        for wallet_name in NexFixtureTest.copied_wallets:
+            try:
+                os.remove(cls.wallet_path(wallet_name))
+            except Exception as e:
+                print("couldn't remove wallet %s " % e)
+
+        if cls.wallet_snapshots:
+            for snapshot_path in cls.wallet_snapshots.values():
+                os.remove(snapshot_path)
+            cls.wallet_snapshots = None
 
-        Compiler.instance().load_and_save(contract_path)
+        NexFixtureTest.opened_wallets = []
+        NexFixtureTest.copied_wallets = []
 
-        compiled_contract_path = contract_path.replace('.py', '.avm')
+    def _deploy_contract_to_blockcahin(self, contract_path, wallet) -> (UInt160, Block):
+
+        compiled_contract_path = compile_contract(contract_path, output_path=worker_path('%s.avm' % os.path.splitext(contract_path)[0]))
 
         return self._deploy_compiled_contract_to_blockchain(compiled_contract_path, wallet)
 
@@ -479,7 +727,7 @@ class NexFixtureTest(BlockchainFixtureTestCase):
 
             return function_code.ScriptHash(), block
 
-    def _invoke_tx_on_blockchain(self, transaction, wallet, make_tx=True, sync_wallet=True, fee=None, timestamp=None, sign=True, skip_verify=False) -> (Transaction, Block):
+    def _prepare_tx(self, transaction, wallet, make_tx=True, fee=None, sign=True) -> Transaction:
         if make_tx:
             if fee:
                 transaction = wallet.MakeTransaction(transaction, fee=fee)
@@ -498,6 +746,11 @@ class NexFixtureTest(BlockchainFixtureTestCase):
             wallet.Sign(context)
             transaction.scripts = context.GetScripts()
 
+        return transaction
+
+    def _invoke_tx_on_blockchain(self, transaction, wallet, make_tx=True, sync_wallet=True, fee=None, timestamp=None, sign=True, skip_verify=False) -> (Transaction, Block):
+        transaction = self._prepare_tx(transaction, wallet, make_tx=make_tx, fee=fee, sign=sign)
+
         if skip_verify or NodeLeader.Instance().AddTransaction(transaction):
             block = self._create_block_with_tx([transaction], timestamp=timestamp)
 
@@ -508,6 +761,54 @@ class NexFixtureTest(BlockchainFixtureTestCase):
 
         return False, False
 
+    def _queue_tx(self, transaction, wallet, make_tx=True, fee=None, sign=True, skip_verify=False) -> Transaction:
+        """
+        Queues a transaction for the next block created by _commit_queued_txs.
+        It is verified against the mempool right away, so it can not spend
+        the same coins as a transaction queued before.
+        Identical invocations need a distinct attribute to get distinct hashes.
+        Transactions that are made and signed already need no wallet.
+
+        :return: the transaction, or False if it did not verify
+        """
+        transaction = self._prepare_tx(transaction, wallet, make_tx=make_tx, fee=fee, sign=sign)
+
+        if not skip_verify and not NodeLeader.Instance().AddTransaction(transaction):
+            return False
+
+        self.queued_txs.append(transaction)
+
+        if wallet is not None:
+            # so the next transaction of this wallet does not use the same coins
+            if transaction.inputs:
+                wallet.SaveTransaction(transaction)
+
+            if wallet not in self.queued_wallets:
+                self.queued_wallets.append(wallet)
+
+        return transaction
+
+    def _commit_queued_txs(self, timestamp=None) -> Block:
+        """
+        Persists all queued transactions in a single block and
+        syncs each wallet that queued a transaction once
+        """
+        transactions = self.queued_txs
+        wallets = self.queued_wallets
+        NexFixtureTest.queued_txs = []
+        NexFixtureTest.queued_wallets = []
+
+        block = self._create_block_with_tx(list(transactions), timestamp=timestamp)
+
+        if block:
+            for transaction in transactions:
+                NodeLeader.Instance().RemoveTransaction(transaction)
+
+            for wallet in wallets:
+                wallet.ProcessNewBlock(block)
+
+        return block
+
     def _create_block_with_tx(self, tx_list, timestamp=None) -> Block:
 
         if timestamp is None:
@@ -1,4 +1,3 @@
-import os
 import time
 from functools import reduce
 
@@ -34,9 +33,13 @@ class TestSwapBase(NexFixtureTest):
 
     INITIALIZED_SWAP_BASE = False
 
+    # every test starts from the state right after setup_swap_contracts,
+    # classes with a single test turn this off to skip taking the snapshot
+    RESTORE_STATE = True
+
     @classmethod
-    def leveldb_testpath(self):
-        return os.path.join(settings.DATA_DIR_PATH, 'Chains/vaultnet')
+    def fixture_chain_path(cls):
+        return 'Chains/vaultnet'
 
     def setUp(self):
         super(TestSwapBase, self).setUp()
@@ -45,6 +48,12 @@ class TestSwapBase(NexFixtureTest):
             TestSwapBase.INITIALIZED_SWAP_BASE = True
             self.setup_swap_contracts()
 
+            if self.RESTORE_STATE:
+                self.snapshot_state()
+
+        elif self.RESTORE_STATE:
+            self.restore_state()
+
     @classmethod
     def tearDownClass(cls):
 
@@ -97,15 +106,17 @@ class TestSwapBase(NexFixtureTest):
         token_owner = self.GetTokenOwner()
         token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
 
-        # send 100000 nex to owner1, owner2, owner3
+        # send 100000 nex to owner1, owner2, owner3 in one block
         send_tx, fee, results = token.Transfer(token_owner, self.token_owner_addr(), self.owner1_addr(), Fixed8.FromDecimal(100000).value)
-        tx, block = self._invoke_tx_on_blockchain(send_tx, token_owner)
+        self._queue_tx(send_tx, token_owner)
 
         send_tx, fee, results = token.Transfer(token_owner, self.token_owner_addr(), self.owner2_addr(), Fixed8.FromDecimal(100000).value)
-        tx, block = self._invoke_tx_on_blockchain(send_tx, token_owner)
+        self._queue_tx(send_tx, token_owner)
 
         send_tx, fee, results = token.Transfer(token_owner, self.token_owner_addr(), self.owner3_addr(), Fixed8.FromDecimal(100000).value)
-        tx, block = self._invoke_tx_on_blockchain(send_tx, token_owner)
+        self._queue_tx(send_tx, token_owner)
+
+        self._commit_queued_txs()
 
         self.assertEqual(token.GetBalance(owner_wallet, self.owner1_addr()), 100000)
         self.assertEqual(token.GetBalance(owner_wallet, self.owner2_addr()), 100000)
@@ -124,22 +135,25 @@ class TestSwapBase(NexFixtureTest):
         deposit_amount = Fixed8.FromDecimal(500000)
 
         approve_tx, fee, results = token.Approve(user_wallet, self.token_owner_addr(), TestSwapBase.swap_contract.Data, deposit_amount.value)
-        tx, block = self._invoke_tx_on_blockchain(approve_tx, user_wallet)
+        tx = self._queue_tx(approve_tx, user_wallet)
         self.assertIsInstance(tx, Transaction)
 
         approve_amount = Fixed8.FromDecimal(50000).value
 
         # owner1 50k to swap
         a, f, r = token.Approve(owner, self.owner1_addr(), TestSwapBase.swap_contract.Data, approve_amount)
-        self._invoke_tx_on_blockchain(a, owner)
+        self._queue_tx(a, owner)
 
         # owner2 50k to swap
         a, f, r = token.Approve(owner, self.owner2_addr(), TestSwapBase.swap_contract.Data, approve_amount)
-        self._invoke_tx_on_blockchain(a, owner2)
+        self._queue_tx(a, owner2)
 
         # owner3 50k to swap
         a, f, r = token.Approve(owner, self.owner3_addr(), TestSwapBase.swap_contract.Data, approve_amount)
-        self._invoke_tx_on_blockchain(a, owner3)
+        self._queue_tx(a, owner3)
+
+        # all approvals in one block
+        self._commit_queued_txs()
 
         # just to make sure
         tx, fee, result = token.Allowance(owner, self.owner1_addr(), TestSwapBase.swap_contract.Data)
@@ -0,0 +1,168 @@
+import binascii
+import os
+import tempfile
+from unittest import TestCase
+
+import plyvel
+from neocore.BigInteger import BigInteger
+from neocore.Fixed8 import Fixed8
+from neocore.IO.BinaryWriter import BinaryWriter
+from neocore.UInt160 import UInt160
+
+from neo.Core.State.StorageItem import StorageItem
+from neo.Core.TX.InvocationTransaction import InvocationTransaction
+from neo.Core.TX.TransactionAttribute import (TransactionAttribute,
+                                              TransactionAttributeUsage)
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from neo.IO.MemoryStream import StreamManager
+from neo.SmartContract.ContractParameter import ContractParameter
+from neo.SmartContract.ContractParameterType import ContractParameterType
+from neo.SmartContract.SmartContractEvent import (NotifyEvent,
+                                                  SmartContractEvent)
+from neo.VM.InteropService import Array, ByteArray, Integer
+from neo.VM.OpCode import APPCALL, PACK
+from neo.VM.ScriptBuilder import ScriptBuilder
+from tools.backfill import (NOTIFICATION_BLOCK_PREFIX, backfill,
+                            decode_invocations, decode_swaps_from_eth)
+from tools.indexer import (NEX_SCRIPT_HASH, SWAP_FROM_ETH, SWAP_TO_ETH,
+                           SwapEvent, SwapIndex)
+
+
+class TestBackfill(TestCase):
+
+    contract_hash = UInt160(data=bytearray(b'\x01' * 20))
+    addr = b'\xa3(\x0f\xb5\x00\x93\x10\xad\xe9\xb3<\x07\xe6\xa6|U2\xe2\xfc\x10'
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+    addr2 = b'\x02' * 20
+    eth_addr2 = b'\x03' * 20
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_decode_swap_from_eth(self):
+
+        sb = ScriptBuilder()
+        sb.EmitAppCallWithOperationAndArgs(self.contract_hash, 'swapFromEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(100000000000), 12])
+        script = sb.ToArray()
+
+        invocations = decode_invocations(bytes.fromhex(script.decode()), bytes(self.contract_hash.Data))
+        self.assertEqual(len(invocations), 1)
+
+        operation, args = invocations[0]
+        self.assertEqual(operation, 'swapFromEth')
+
+        swaps = decode_swaps_from_eth(args, operation)
+        self.assertEqual(len(swaps), 1)
+        addr, eth_addr, amount, swap_id = swaps[0]
+        self.assertEqual(addr, self.addr)
+        self.assertEqual(eth_addr, self.eth_addr)
+        self.assertEqual(int.from_bytes(amount, 'little'), 100000000000)
+        self.assertEqual(swap_id, 12)
+
+    def test_decode_other_contract(self):
+
+        sb = ScriptBuilder()
+        sb.EmitAppCallWithOperationAndArgs(UInt160(data=bytearray(20)), 'swapFromEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(100000000000), 12])
+        script = sb.ToArray()
+
+        self.assertEqual(decode_invocations(bytes.fromhex(script.decode()), bytes(self.contract_hash.Data)), [])
+
+    def emit(self, sb, value):
+        # EmitAppCallWithOperationAndArgs does not support nested arrays
+        if isinstance(value, list):
+            for item in reversed(value):
+                self.emit(sb, item)
+            sb.push(len(value))
+            sb.Emit(PACK)
+        else:
+            sb.push(value)
+
+    def invocation(self, operation, args, nonce):
+        sb = ScriptBuilder()
+        self.emit(sb, args)
+        sb.push(operation.encode('utf-8').hex())
+        sb.Emit(APPCALL, self.contract_hash.Data)
+
+        tx = InvocationTransaction()
+        tx.Version = 1
+        tx.Gas = Fixed8.Zero()
+        tx.Script = binascii.unhexlify(sb.ToArray())
+        tx.Attributes = [TransactionAttribute(usage=TransactionAttributeUsage.Remark, data=bytearray([nonce]))]
+        return tx
+
+    def transfer(self, tx, height, addr_from, addr_to, amount, token_hash=NEX_SCRIPT_HASH):
+        payload = ContractParameter(ContractParameterType.Array, value=[
+            ContractParameter(ContractParameterType.ByteArray, value=b'transfer'),
+            ContractParameter(ContractParameterType.ByteArray, value=addr_from),
+            ContractParameter(ContractParameterType.ByteArray, value=addr_to),
+            ContractParameter(ContractParameterType.Integer, value=str(amount)),
+        ])
+        notification = NotifyEvent(SmartContractEvent.RUNTIME_NOTIFY, payload, token_hash, height, tx.Hash, execution_success=True)
+        return notification.ToByteArray()
+
+    def swap_record(self, addr, eth_addr, amount, height):
+        stream = StreamManager.GetStream()
+        Array([ByteArray(addr), ByteArray(eth_addr), Integer(BigInteger(amount)), Integer(BigInteger(height))]).Serialize(BinaryWriter(stream))
+        record = stream.getvalue()
+        StreamManager.ReleaseStream(stream)
+        return bytes(record)
+
+    def test_backfill(self):
+
+        contract = bytes(self.contract_hash.Data)
+
+        swap_a = self.invocation('swapToEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(100)], 1)
+        swap_b = self.invocation('swapToEthBatch', [bytearray(self.addr2), [[bytearray(self.eth_addr), BigInteger(50)], [bytearray(self.eth_addr2), BigInteger(70)]]], 2)
+        faulted_to_eth = self.invocation('swapToEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(100)], 3)
+        faulted_from_eth = self.invocation('swapFromEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(30), 7], 4)
+        swap_from_eth = self.invocation('swapFromEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(30), 7], 5)
+
+        chain = plyvel.DB(self.path('chain'), create_if_missing=True)
+        for height, tx in [(10, swap_a), (10, swap_b), (11, faulted_to_eth), (12, faulted_from_eth), (13, swap_from_eth)]:
+            chain.put(DBPrefix.DATA_Transaction + tx.Hash.ToBytes(), height.to_bytes(4, 'little') + tx.ToArray())
+
+        prefix = DBPrefix.ST_Storage + contract
+        storage = {
+            b'swapRecord\x03': self.swap_record(self.addr, self.eth_addr, 100, 10),
+            # a swap whose invocation can't be decoded
+            b'swapRecord\x09': self.swap_record(self.addr2, self.eth_addr2, 20, 14),
+            b'swapIdPage': bytes([1 << 7]),
+        }
+        for key, value in storage.items():
+            chain.put(prefix + key, StorageItem(value).ToByteArray())
+        chain.close()
+
+        # swap_b was executed first, the little endian positions don't sort lexicographically
+        notifications = plyvel.DB(self.path('notifications'), create_if_missing=True)
+        for height, position, tx, addr_from, addr_to, amount in [(10, 256, swap_a, self.addr, contract, 100),
+                                                                 (10, 1, swap_b, self.addr2, contract, 120),
+                                                                 (13, 0, swap_from_eth, contract, self.addr, 30)]:
+            key = NOTIFICATION_BLOCK_PREFIX + height.to_bytes(4, 'little') + position.to_bytes(4, 'little')
+            notifications.put(key, self.transfer(tx, height, addr_from, addr_to, amount))
+
+        # a transfer of another token doesn't confirm the faulted swap
+        notifications.put(NOTIFICATION_BLOCK_PREFIX + (11).to_bytes(4, 'little') + bytes(4),
+                          self.transfer(faulted_to_eth, 11, self.addr, contract, 100, token_hash=UInt160(data=bytearray(b'\x04' * 20))))
+        notifications.close()
+
+        index = SwapIndex(self.path('swaps.db'))
+        swap_events = backfill(self.path('chain'), self.path('notifications'), self.contract_hash, index, 20, workers=2)
+
+        self.assertEqual(swap_events, [
+            SwapEvent(SWAP_TO_ETH, 1, self.addr2, self.eth_addr, 50, 10, swap_b.Hash.ToString()),
+            SwapEvent(SWAP_TO_ETH, 2, self.addr2, self.eth_addr2, 70, 10, swap_b.Hash.ToString()),
+            SwapEvent(SWAP_TO_ETH, 3, self.addr, self.eth_addr, 100, 10, swap_a.Hash.ToString()),
+            SwapEvent(SWAP_FROM_ETH, 7, self.addr, self.eth_addr, 30, 13, swap_from_eth.Hash.ToString()),
+            SwapEvent(SWAP_TO_ETH, 9, self.addr2, self.eth_addr2, 20, 14, None),
+        ])
+
+        self.assertEqual(index.checkpoint, 20)
+        self.assertEqual(index.last_swap_id(SWAP_TO_ETH), 9)
+        self.assertEqual(index.get_swap(SWAP_FROM_ETH, 7).tx_hash, swap_from_eth.Hash.ToString())
+        index.close()
@@ -0,0 +1,134 @@
+import json
+import os
+from unittest import TestCase
+
+from neocore.Fixed8 import Fixed8
+
+from neo.SmartContract.TriggerType import Application, Verification
+from tests.contract_vm import ContractVM
+
+# Costs are compared against this file. It is only written when
+# NEX_UPDATE_BENCHMARK_BASELINE=1 is set, which records the measured
+# operations instead of comparing them, e.g. after an intended cost change
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+UPDATE_BASELINE = os.environ.get('NEX_UPDATE_BENCHMARK_BASELINE') == '1'
+
+# Fail when a metric grows by more than this fraction of its baseline
+MAX_REGRESSION = 0.05
+
+# GAS on top of the free 10 GAS, enough for the largest batch
+MEASURE_GAS = Fixed8.FromDecimal(100)
+
+
+class TestSwapBenchmark(TestCase):
+    """
+    Records opcode count, GAS and storage reads/writes of every
+    NexSwap operation and fails when one of them regresses.
+
+    The operations run in a ContractVM, so the costs are those of NexSwap
+    itself, the AppCalls to NEX are answered by a stub
+    """
+
+    baseline = None
+    measured = {}
+
+    addr = bytes(range(1, 21))
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+    minter = bytes(range(21, 41))
+    new_owner = bytes(range(41, 61))
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                cls.baseline = json.load(f)
+        cls.measured = {}
+
+    @classmethod
+    def tearDownClass(cls):
+
+        # operations that were not measured in this run keep their baseline
+        if UPDATE_BASELINE and cls.measured:
+            costs = dict(cls.baseline)
+            costs.update(cls.measured)
+            with open(BASELINE_PATH, 'w') as f:
+                json.dump(costs, f, indent=4, sort_keys=True)
+
+    def setUp(self):
+        self.vm = ContractVM.load('NexSwap.py')
+        self.vm.nex.mint(self.addr, Fixed8.FromDecimal(20000).value)
+        self.vm.nex.approve(self.addr, self.vm.script_hash, Fixed8.FromDecimal(20000).value)
+
+        self.assertTrue(self.vm.invoke('initializeOwners').result.GetBoolean())
+        self.owners = [bytes(owner.GetByteArray()) for owner in self.vm.invoke('getOwners').result.GetArray()]
+
+        # swap some to eth so there is something to swap back
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(10000).value]
+        self.assertTrue(self.vm.invoke('swapToEth', swap_args, witnesses=[self.addr]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('setMinter', [self.minter], witnesses=self.owners[:3]).result.GetBoolean())
+
+    def measure(self, operation, params=[], witnesses=(), trigger=Application) -> dict:
+
+        reads = self.vm.storage_reads
+        writes = self.vm.storage_writes
+
+        invocation = self.vm.invoke(operation, params, witnesses=witnesses, trigger=trigger, gas=MEASURE_GAS)
+        self.assertTrue(invocation.halted, "%s failed" % operation)
+
+        return {
+            'numops': invocation.ops,
+            'gas': invocation.gas_consumed.value,
+            'storage_reads': self.vm.storage_reads - reads,
+            'storage_writes': self.vm.storage_writes - writes,
+        }
+
+    def assertCost(self, name, cost):
+
+        if UPDATE_BASELINE:
+            self.measured[name] = cost
+            return
+
+        baseline = self.baseline.get(name)
+        if baseline is None:
+            self.fail("No benchmark baseline for %s, measured %s. Record it with NEX_UPDATE_BENCHMARK_BASELINE=1" % (name, cost))
+
+        self.assertEqual(set(cost), set(baseline), "%s measures other metrics than its baseline" % name)
+        for metric, value in cost.items():
+            limit = baseline[metric] * (1 + MAX_REGRESSION)
+            self.assertLessEqual(value, limit, "%s %s regressed from %s to %s" % (name, metric, baseline[metric], value))
+
+    def test_swap_to_eth(self):
+
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(1000).value]
+        self.assertCost('swapToEth', self.measure('swapToEth', swap_args, witnesses=[self.addr]))
+
+        for legs in [1, 5, 10]:
+            swap_legs = [[self.eth_addr, Fixed8.FromDecimal(500).value] for i in range(legs)]
+            cost = self.measure('swapToEthBatch', [self.addr, swap_legs], witnesses=[self.addr])
+            self.assertCost('swapToEthBatch_%s' % legs, cost)
+
+    def test_swap_from_eth(self):
+
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(1000).value, 1]
+        self.assertCost('swapFromEth', self.measure('swapFromEth', swap_args, witnesses=[self.minter]))
+
+        # every batch swaps ids that were not processed yet
+        first_id = 2
+        for swaps in [1, 5, 10]:
+            batch = [[self.addr, self.eth_addr, Fixed8.FromDecimal(100).value, swap_id] for swap_id in range(first_id, first_id + swaps)]
+            cost = self.measure('swapFromEthBatch', batch, witnesses=[self.minter])
+            self.assertCost('swapFromEthBatch_%s' % swaps, cost)
+            first_id += swaps
+
+    def test_read_operations(self):
+
+        self.assertCost('totalSwapped', self.measure('totalSwapped'))
+        self.assertCost('reconcileSwapped', self.measure('reconcileSwapped'))
+        self.assertCost('isSwapIdProcessed', self.measure('isSwapIdProcessed', [1]))
+
+    def test_owner_operations(self):
+
+        self.assertCost('setMinter', self.measure('setMinter', [self.new_owner], witnesses=self.owners[:3]))
+        self.assertCost('switchOwner', self.measure('switchOwner', ['owner2', self.new_owner], witnesses=self.owners[1:4]))
+        self.assertCost('verification', self.measure('', witnesses=self.owners[1:5], trigger=Verification))
@@ -0,0 +1,258 @@
+import binascii
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from logzero import logger
+from neocore.BigInteger import BigInteger
+from neocore.Fixed8 import Fixed8
+from neocore.KeyPair import KeyPair
+
+from neo.Core.Blockchain import Blockchain
+from neo.Core.CoinReference import CoinReference
+from neo.Core.Helper import Helper
+from neo.Core.TX.InvocationTransaction import InvocationTransaction
+from neo.Core.TX.Transaction import ContractTransaction, TransactionOutput
+from neo.Core.TX.TransactionAttribute import (TransactionAttribute,
+                                              TransactionAttributeUsage)
+from neo.EventHub import events
+from neo.Implementations.Blockchains.LevelDB.DBCollection import DBCollection
+from neo.SmartContract import TriggerType
+from neo.SmartContract.ApplicationEngine import ApplicationEngine
+from neo.SmartContract.Contract import Contract
+from neo.SmartContract.ContractParameterContext import \
+    ContractParametersContext
+from neo.VM.ScriptBuilder import ScriptBuilder
+from tests.swap_base import TestSwapBase
+
+# Number of synthetic accounts, each of them swaps to eth once
+ACCOUNTS = int(os.environ.get('NEX_BLOCK_ACCOUNTS', 200))
+
+# Number of swaps packed into a block
+SWAPS_PER_BLOCK = int(os.environ.get('NEX_BLOCK_SWAPS', 50))
+
+# Seed of the account keys, eth addresses and amounts
+SEED = int(os.environ.get('NEX_BLOCK_SEED', 1))
+
+# Time of Persist outside of the other phases is reported as other
+PHASES = ['verification', 'vm execution', 'storage commit', 'notification dispatch', 'other']
+
+# Outputs per transaction when the swaps need GAS
+MAX_OUTPUTS_PER_TX = 500
+
+
+class PhaseTimer:
+    """
+    Adds up the time spent in each phase. Time spent in a phase
+    entered from another phase only counts for the inner one
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        self._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.totals[name] += elapsed - self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return timed
+
+
+class TimedWriteBatches:
+    """
+    Wraps the database of a chain to time writing its write batches
+    """
+
+    def __init__(self, db, timer: PhaseTimer):
+        self._db = db
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def write_batch(self, *args, **kwargs):
+        return TimedWriteBatch(self._db.write_batch(*args, **kwargs), self._timer)
+
+
+class TimedWriteBatch:
+
+    def __init__(self, batch, timer: PhaseTimer):
+        self._batch = batch
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._batch, name)
+
+    def __enter__(self):
+        self._batch.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the batch is written to the database on exit
+        with self._timer.phase('storage commit'):
+            return self._batch.__exit__(exc_type, exc_value, traceback)
+
+
+class SyntheticAccount:
+    """
+    A key pair that signs its own transactions, without a wallet
+    """
+
+    def __init__(self, rng: random.Random):
+        self.key = KeyPair(rng.getrandbits(256).to_bytes(32, 'big'))
+        self.contract = Contract.CreateSignatureContract(self.key.PublicKey)
+        self.script_hash = self.contract.ScriptHash
+        self.address = self.contract.Address
+        self.eth_addr = rng.getrandbits(160).to_bytes(20, 'big')
+        self.amount = Fixed8.FromDecimal(rng.randint(500, 1000)).value
+
+        # the GAS output that pays the swap, when swaps are not free
+        self.coin = None
+
+    def sign(self, tx):
+        context = ContractParametersContext(tx)
+        context.AddSignature(self.contract, self.key.PublicKey, Helper.Sign(tx, self.key))
+        tx.scripts = context.GetScripts()
+
+
+class TestBlockThroughput(TestSwapBase):
+    """
+    Packs the swapToEth transactions of many funded and approved synthetic
+    accounts into blocks, and reports how fast the node verifies and
+    persists them along with the time of every phase
+    """
+
+    # writing blocks to LevelDB is part of what is measured
+    USE_MEMORY_CHAIN = False
+
+    # a single test, so there is nothing to restore
+    RESTORE_STATE = False
+
+    def invocation(self, account: SyntheticAccount, script_hash, operation, args, gas=Fixed8.Zero(), inputs=None):
+        sb = ScriptBuilder()
+        sb.EmitAppCallWithOperationAndArgs(script_hash, operation, args)
+
+        tx = InvocationTransaction()
+        tx.Version = 1
+        tx.Script = binascii.unhexlify(sb.ToArray())
+        tx.Gas = gas
+        tx.inputs = inputs or []
+        tx.outputs = []
+        tx.Attributes = [TransactionAttribute(usage=TransactionAttributeUsage.Script, data=account.script_hash.Data)]
+
+        account.sign(tx)
+        return tx
+
+    def swap_gas(self) -> Fixed8:
+        """
+        :return: Fixed8: the system fee of a swapToEth, zero as long as it costs less than the free 10 GAS
+        """
+        user_wallet = self.GetTokenOwner()
+
+        swap_args = [self.token_owner_addr(), bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f'), Fixed8.FromDecimal(500).value]
+        tx, results = self.invoke_test(user_wallet, 'swapToEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+
+        return tx.Gas
+
+    def fund_accounts(self, accounts, swap_gas):
+        token_owner = self.GetTokenOwner()
+        token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
+
+        for start in range(0, len(accounts), SWAPS_PER_BLOCK):
+            for account in accounts[start:start + SWAPS_PER_BLOCK]:
+                tx, fee, results = token.Transfer(token_owner, self.token_owner_addr(), account.address, account.amount)
+                self.assertTrue(self._queue_tx(tx, token_owner))
+            self.assertTrue(self._commit_queued_txs())
+
+        if swap_gas <= Fixed8.Zero():
+            return
+
+        # one output per account, spent entirely as the system fee of its swap
+        for start in range(0, len(accounts), MAX_OUTPUTS_PER_TX):
+            funded = accounts[start:start + MAX_OUTPUTS_PER_TX]
+            outputs = [TransactionOutput(AssetId=Blockchain.SystemCoin().Hash, Value=swap_gas, script_hash=account.script_hash) for account in funded]
+
+            tx = self._queue_tx(ContractTransaction(inputs=[], outputs=outputs), token_owner)
+            self.assertTrue(tx)
+            self.assertTrue(self._commit_queued_txs())
+
+            for index, account in enumerate(funded):
+                account.coin = CoinReference(prev_hash=tx.Hash, prev_index=index)
+
+    def approve_swaps(self, accounts):
+        for start in range(0, len(accounts), SWAPS_PER_BLOCK):
+            for account in accounts[start:start + SWAPS_PER_BLOCK]:
+                approve_args = [bytearray(account.script_hash.Data), bytearray(TestSwapBase.swap_contract.Data), BigInteger(account.amount)]
+                tx = self.invocation(account, TestSwapBase.nex_contract, 'approve', approve_args)
+                self.assertTrue(self._queue_tx(tx, None, make_tx=False, sign=False))
+            self.assertTrue(self._commit_queued_txs())
+
+    def test_block_throughput(self):
+
+        rng = random.Random(SEED)
+        accounts = [SyntheticAccount(rng) for i in range(ACCOUNTS)]
+
+        swap_gas = self.swap_gas()
+        self.fund_accounts(accounts, swap_gas)
+        self.approve_swaps(accounts)
+
+        swaps = []
+        for account in accounts:
+            swap_args = [bytearray(account.script_hash.Data), bytearray(account.eth_addr), BigInteger(account.amount)]
+            swaps.append(self.invocation(account, TestSwapBase.swap_contract, 'swapToEth', swap_args,
+                                         gas=swap_gas, inputs=[account.coin] if account.coin else None))
+
+        timer = PhaseTimer()
+        blockchain = Blockchain.Default()
+
+        # witnesses are verified by the engine too, that time stays with the verification
+        def execute(engine):
+            if engine.Trigger == TriggerType.Application:
+                with timer.phase('vm execution'):
+                    return ApplicationEngine.Execute(engine)
+            return ApplicationEngine.Execute(engine)
+
+        self.dispatched_events = []
+        blocks = 0
+
+        with patch.object(ApplicationEngine, 'Execute', autospec=True, side_effect=execute), \
+                patch.object(DBCollection, 'Commit', autospec=True, side_effect=timer.wrap('storage commit', DBCollection.Commit)), \
+                patch.object(events, 'emit', new=timer.wrap('notification dispatch', events.emit)), \
+                patch.object(blockchain, '_db', new=TimedWriteBatches(blockchain._db, timer)):
+
+            for start in range(0, len(swaps), SWAPS_PER_BLOCK):
+
+                with timer.phase('verification'):
+                    for tx in swaps[start:start + SWAPS_PER_BLOCK]:
+                        self.assertTrue(self._queue_tx(tx, None, make_tx=False, sign=False))
+
+                with timer.phase('other'):
+                    self.assertTrue(self._commit_queued_txs())
+
+                blocks += 1
+
+        swapped = [evt for evt in self.dispatched_events if evt.notify_type == b'onSwapToEth']
+        self.assertEqual(len(swapped), ACCOUNTS)
+
+        elapsed = sum(timer.totals.values())
+
+        logger.info("%s swaps in %s blocks of up to %s, seed %s, %s GAS per swap" % (ACCOUNTS, blocks, SWAPS_PER_BLOCK, SEED, swap_gas.ToString()))
+        logger.info("%.2fs, %.2f blocks/s, %.2f swaps/s" % (elapsed, blocks / elapsed, ACCOUNTS / elapsed))
+        for phase in PHASES:
+            logger.info("%-22s %8.3fs %6.1f%%" % (phase, timer.totals[phase], 100 * timer.totals[phase] / elapsed))
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from boa.compiler import Compiler
+
+from tools.compile_cache import compile_contract, contract_hash
+
+CONTRACT = """from cachetest.util import *
+
+
+def Main(operation):
+    return double(VALUE)
+"""
+
+UTIL = """VALUE = 21
+
+
+def double(value):
+    return value * 2
+"""
+
+
+class TestCompileCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.write('Contract.py', CONTRACT)
+        self.write('cachetest/util.py', UTIL)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+        # boa imports the modules of a contract, so they would be found at the path of an earlier test
+        for name in ['cachetest', 'cachetest.util']:
+            sys.modules.pop(name, None)
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), 'w') as handle:
+            handle.write(content)
+
+    def compile(self):
+        with patch.object(Compiler, 'load_and_save', wraps=Compiler.load_and_save) as load_and_save:
+            output_path = compile_contract(self.path('Contract.py'))
+        with open(output_path, 'rb') as handle:
+            return handle.read(), load_and_save.call_count
+
+    def test_cache(self):
+
+        avm, compiles = self.compile()
+        self.assertEqual(compiles, 1)
+        self.assertTrue(os.path.isfile(self.path('Contract.debug.json')))
+
+        cached_avm, compiles = self.compile()
+        self.assertEqual(compiles, 0)
+        self.assertEqual(cached_avm, avm)
+
+    def test_imported_module_changes(self):
+
+        key = contract_hash(self.path('Contract.py'))
+        avm, compiles = self.compile()
+
+        self.write('cachetest/util.py', UTIL.replace('21', '22'))
+        self.assertNotEqual(contract_hash(self.path('Contract.py')), key)
+
+        changed_avm, compiles = self.compile()
+        self.assertEqual(compiles, 1)
+        self.assertNotEqual(changed_avm, avm)
+
+    def test_damaged_entry(self):
+
+        avm, compiles = self.compile()
+
+        entry_path = os.path.join(self.dir.name, '.compile_cache', contract_hash(self.path('Contract.py')))
+        with open(os.path.join(entry_path, 'Contract.avm'), 'wb') as handle:
+            handle.write(b'\x00')
+
+        repaired_avm, compiles = self.compile()
+        self.assertEqual(compiles, 1)
+        self.assertEqual(repaired_avm, avm)
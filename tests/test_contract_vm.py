@@ -0,0 +1,312 @@
+import random
+from unittest import TestCase
+from unittest.mock import patch
+
+from neocore.Fixed8 import Fixed8
+from neocore.UInt256 import UInt256
+
+from neo.SmartContract.TriggerType import Verification
+from tests.contract_vm import ContractVM, ContractVMEngine, ScriptContainer
+
+
+class TestContractVM(TestCase):
+
+    addr = bytes(range(1, 21))
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+    minter = bytes(range(21, 41))
+
+    def setUp(self):
+        self.vm = ContractVM.load('NexSwap.py')
+        self.vm.nex.mint(self.addr, Fixed8.FromDecimal(10000).value)
+        self.vm.nex.approve(self.addr, self.vm.script_hash, Fixed8.FromDecimal(10000).value)
+
+    def owners(self, vm):
+        self.assertTrue(vm.invoke('initializeOwners').result.GetBoolean())
+        return [bytes(owner.GetByteArray()) for owner in vm.invoke('getOwners').result.GetArray()]
+
+    def swap_to_eth(self, amount, **kwargs):
+        return self.vm.invoke('swapToEth', [self.addr, self.eth_addr, Fixed8.FromDecimal(amount).value], **kwargs)
+
+    def test_swap_to_eth(self):
+
+        invocation = self.swap_to_eth(500, witnesses=[self.addr], height=1234)
+        self.assertTrue(invocation.halted)
+        self.assertTrue(invocation.result.GetBoolean())
+        self.assertGreater(invocation.gas_consumed, Fixed8.Zero())
+
+        self.assertEqual(len(invocation.notifications), 1)
+        name, args = invocation.notifications[0]
+        self.assertEqual(name, 'onSwapToEth')
+        self.assertEqual(args[1].GetByteArray(), self.eth_addr)
+        self.assertEqual(args[2].GetBigInteger(), Fixed8.FromDecimal(500).value)
+        self.assertEqual(args[3].GetBigInteger(), 1)
+
+        self.assertEqual(self.vm.nex.balance_of(self.vm.script_hash), Fixed8.FromDecimal(500).value)
+        self.assertEqual(self.vm.invoke('totalSwapped').result.GetBigInteger(), Fixed8.FromDecimal(500).value)
+
+        swap = self.vm.invoke('getSwap', [1]).result.GetArray()
+        self.assertEqual(swap[0].GetByteArray(), self.addr)
+        self.assertEqual(swap[3].GetBigInteger(), 1234)
+
+    def test_fault_undoes_writes(self):
+
+        storage = dict(self.vm.storage)
+        balances = dict(self.vm.nex.balances)
+
+        # no witness, below the minimum and more than approved
+        for amount, witnesses in [(500, []), (499, [self.addr]), (20000, [self.addr])]:
+            invocation = self.swap_to_eth(amount, witnesses=witnesses)
+            self.assertFalse(invocation.halted)
+            self.assertIsNone(invocation.result)
+            self.assertEqual(self.vm.storage, storage)
+            self.assertEqual(self.vm.nex.balances, balances)
+
+    def test_script_container(self):
+
+        container = ScriptContainer(UInt256(data=bytearray(range(32))))
+        self.assertTrue(self.swap_to_eth(500, witnesses=[self.addr], container=container).halted)
+
+        # the same transaction can only swap once
+        self.assertFalse(self.swap_to_eth(500, witnesses=[self.addr], container=container).halted)
+        self.assertTrue(self.swap_to_eth(500, witnesses=[self.addr]).halted)
+
+        replay_key = bytes(container.Hash.Data) + self.addr
+        self.assertEqual(self.vm.storage[replay_key], b'\x01')
+
+    def test_swap_from_eth(self):
+
+        owners = self.owners(self.vm)
+        self.assertFalse(self.vm.invoke('setMinter', [self.minter], witnesses=owners[:2]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('setMinter', [self.minter], witnesses=owners[:3]).result.GetBoolean())
+
+        # slot 0 is the same key whether it is given or not
+        self.assertEqual(self.vm.storage[b'minter_role'], self.minter)
+        self.assertEqual(self.vm.invoke('getMinter', [0]).result.GetByteArray(), self.minter)
+
+        self.assertTrue(self.swap_to_eth(1000, witnesses=[self.addr]).halted)
+
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(300).value, 7]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=owners).result.GetBoolean())
+
+        invocation = self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter])
+        self.assertTrue(invocation.result.GetBoolean())
+        self.assertEqual(invocation.notifications[0].name, 'onSwapFromEth')
+        self.assertEqual(self.vm.nex.balance_of(self.vm.script_hash), Fixed8.FromDecimal(700).value)
+        self.assertTrue(self.vm.invoke('isSwapIdProcessed', [7]).result.GetBoolean())
+
+        # processed already
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).halted)
+
+        # more than was swapped to eth
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(800).value, 8]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).halted)
+
+    def test_minter_slots(self):
+
+        minter2 = bytes(range(41, 61))
+        owners = self.owners(self.vm)
+        self.assertTrue(self.vm.invoke('setMinterSlots', [2], witnesses=owners[:3]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('setMinter', [self.minter, 0], witnesses=owners[:3]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('setMinter', [minter2, 1], witnesses=owners[:3]).result.GetBoolean())
+        self.assertEqual(self.vm.storage[b'minter_role'], self.minter)
+        self.assertEqual(self.vm.storage[b'minter_role\x01'], minter2)
+
+        self.assertTrue(self.swap_to_eth(1000, witnesses=[self.addr]).halted)
+
+        # slot 0 computed by swapId % slots reads the same key as a literal 0
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(300).value, 8]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[minter2]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).result.GetBoolean())
+
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(300).value, 7]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('swapFromEth', swap_args, witnesses=[minter2]).result.GetBoolean())
+
+        batch = [[self.addr, self.eth_addr, Fixed8.FromDecimal(100).value, swap_id] for swap_id in [10, 12]]
+        self.assertEqual(self.vm.invoke('swapFromEthBatch', batch, witnesses=[self.minter]).result.GetBigInteger(), 2)
+
+        self.assertTrue(self.vm.invoke('removeMinter', [0], witnesses=owners[:3]).result.GetBoolean())
+        self.assertNotIn(b'minter_role', self.vm.storage)
+
+    def test_swap_from_eth_batch(self):
+
+        owners = self.owners(self.vm)
+        self.vm.invoke('setMinter', [self.minter], witnesses=owners[:3])
+        self.assertTrue(self.swap_to_eth(1000, witnesses=[self.addr]).halted)
+
+        # swap id 2 is repeated, it is only paid and counted once
+        batch = [
+            [self.addr, self.eth_addr, Fixed8.FromDecimal(600).value, 2],
+            [self.addr, self.eth_addr, Fixed8.FromDecimal(600).value, 2],
+            [self.addr, self.eth_addr, Fixed8.FromDecimal(400).value, 3],
+        ]
+        self.assertFalse(self.vm.invoke('swapFromEthBatch', batch, witnesses=owners).result.GetBoolean())
+
+        invocation = self.vm.invoke('swapFromEthBatch', batch, witnesses=[self.minter])
+        self.assertEqual(invocation.result.GetBigInteger(), 2)
+        self.assertEqual([args[3].GetBigInteger() for name, args in invocation.notifications], [2, 3])
+        self.assertEqual(self.vm.nex.balance_of(self.vm.script_hash), 0)
+        self.assertEqual(self.vm.invoke('totalSwappedOut').result.GetBigInteger(), Fixed8.FromDecimal(1000).value)
+
+        # nothing left to swap back, a fault keeps the swap ids unprocessed
+        storage = dict(self.vm.storage)
+        batch = [[self.addr, self.eth_addr, Fixed8.FromDecimal(500).value, 4]]
+        self.assertFalse(self.vm.invoke('swapFromEthBatch', batch, witnesses=[self.minter]).halted)
+        self.assertEqual(self.vm.storage, storage)
+
+    def test_swap_id_pages(self):
+
+        owners = self.owners(self.vm)
+        self.vm.invoke('setMinter', [self.minter], witnesses=owners[:3])
+        self.assertTrue(self.swap_to_eth(1000, witnesses=[self.addr]).halted)
+
+        for swap_id in [2, 7, 130]:
+            swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(100).value, swap_id]
+            self.assertTrue(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).result.GetBoolean())
+
+        # page 0 computed by swapId / 128 is the same key as a literal 0
+        self.assertEqual(self.vm.invoke('getSwapIdPage', [0]).result.GetBigInteger(), (1 << 2) | (1 << 7))
+        self.assertEqual(self.vm.invoke('getSwapIdPage', [1]).result.GetBigInteger(), 1 << 2)
+        self.assertEqual(self.vm.invoke('areSwapIdsProcessed', [2, 3, 7, 130]).result.GetBigInteger(), 0b1101)
+
+        # swap ids processed before there were pages still count before they are moved to the pages
+        self.vm.storage[b'swapId\x05'] = b'\x01'
+        self.assertTrue(self.vm.invoke('isSwapIdProcessed', [5]).result.GetBoolean())
+        self.assertEqual(self.vm.invoke('areSwapIdsProcessed', [4, 5]).result.GetBigInteger(), 0b10)
+
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(100).value, 5]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).halted)
+        batch = [[self.addr, self.eth_addr, Fixed8.FromDecimal(100).value, 5]]
+        self.assertEqual(self.vm.invoke('swapFromEthBatch', batch, witnesses=[self.minter]).result.GetBigInteger(), 0)
+
+        self.assertFalse(self.vm.invoke('migrateSwapIds', [[5, 6]], witnesses=owners[:2]).result.GetBoolean())
+        self.assertEqual(self.vm.invoke('migrateSwapIds', [[5, 6]], witnesses=owners[:3]).result.GetBigInteger(), 1)
+        self.assertNotIn(b'swapId\x05', self.vm.storage)
+        self.assertEqual(self.vm.invoke('areSwapIdsProcessed', [5, 6, 7]).result.GetBigInteger(), 0b101)
+
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).halted)
+
+    def test_swap_id_encoding(self):
+
+        owners = self.owners(self.vm)
+
+        # 255 needs two bytes, a zero byte is the empty 0 computed by the VM
+        self.assertFalse(self.vm.invoke('isSwapIdProcessed', [b'\xff\x00']).result.GetBoolean())
+        self.assertFalse(self.vm.invoke('isSwapIdProcessed', [b'\x00']).result.GetBoolean())
+
+        # a longer encoding of a swap id would be a different legacy key
+        self.vm.storage[b'swapId\x05'] = b'\x01'
+        for swap_id in [b'\x05\x00', b'\x01' * 9, -1]:
+            self.assertFalse(self.vm.invoke('isSwapIdProcessed', [swap_id]).halted)
+            self.assertFalse(self.vm.invoke('areSwapIdsProcessed', [1, swap_id]).halted)
+            self.assertFalse(self.vm.invoke('migrateSwapIds', [[swap_id]], witnesses=owners[:3]).halted)
+
+        self.assertIn(b'swapId\x05', self.vm.storage)
+
+    def test_sync_swapped(self):
+
+        owners = self.owners(self.vm)
+        self.vm.invoke('setMinter', [self.minter], witnesses=owners[:3])
+
+        # a migrated contract holds NEX that was never swapped through this ledger
+        self.vm.nex.mint(self.vm.script_hash, Fixed8.FromDecimal(2000).value)
+        swap_args = [self.addr, self.eth_addr, Fixed8.FromDecimal(300).value, 1]
+        self.assertFalse(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).halted)
+
+        self.assertFalse(self.vm.invoke('syncSwapped', witnesses=owners[:2]).result.GetBoolean())
+        self.assertFalse(self.vm.invoke('syncSwapped', [Fixed8.FromDecimal(2001).value], witnesses=owners[:3]).halted)
+
+        invocation = self.vm.invoke('syncSwapped', witnesses=owners[:3])
+        self.assertEqual(invocation.result.GetBigInteger(), Fixed8.FromDecimal(2000).value)
+
+        self.assertTrue(self.vm.invoke('swapFromEth', swap_args, witnesses=[self.minter]).result.GetBoolean())
+        ledger = self.vm.invoke('reconcileSwapped').result.GetArray()
+        self.assertEqual(ledger[2].GetBigInteger(), Fixed8.FromDecimal(1700).value)
+        self.assertEqual(ledger[3].GetBigInteger(), Fixed8.FromDecimal(1700).value)
+
+        self.assertTrue(self.vm.invoke('syncSwapped', [Fixed8.FromDecimal(1000).value], witnesses=owners[:3]).halted)
+        self.assertEqual(self.vm.invoke('totalSwapped').result.GetBigInteger(), Fixed8.FromDecimal(1000).value)
+
+    def test_owner_operations(self):
+
+        owners = self.owners(self.vm)
+        self.assertEqual(len(owners), 5)
+
+        self.assertFalse(self.vm.invoke('addOwner', [self.minter], witnesses=owners[:2]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('addOwner', [self.minter], witnesses=owners[:3]).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('removeOwner', [owners[0]], witnesses=owners[1:4]).result.GetBoolean())
+        self.assertEqual(len(self.vm.invoke('getOwners').result.GetArray()), 5)
+
+        # the current owner can also be named as before owners were packed
+        current = [bytes(owner.GetByteArray()) for owner in self.vm.invoke('getOwners').result.GetArray()]
+        new_owner = bytes(range(61, 81))
+        self.assertTrue(self.vm.invoke('switchOwner', ['owner2', new_owner], witnesses=owners[1:4]).result.GetBoolean())
+        switched = [bytes(owner.GetByteArray()) for owner in self.vm.invoke('getOwners').result.GetArray()]
+        self.assertEqual(switched, current[:1] + [new_owner] + current[2:])
+
+        self.assertTrue(self.vm.invoke('switchOwner', [new_owner, current[1]], witnesses=owners[3:5] + [new_owner]).result.GetBoolean())
+
+        for name in ['owner0', 'owner6', 'owner', 'owner10', 'other1']:
+            self.assertFalse(self.vm.invoke('switchOwner', [name, new_owner], witnesses=owners[1:4]).result.GetBoolean())
+
+        # contract migrations need 4 owners
+        self.assertFalse(self.vm.invoke('', witnesses=owners[1:4], trigger=Verification).result.GetBoolean())
+        self.assertTrue(self.vm.invoke('', witnesses=owners[1:5], trigger=Verification).result.GetBoolean())
+
+    def test_same_as_with_limits(self):
+
+        unchecked = ContractVM.load('NexSwap.py', check_limits=False)
+        unchecked.nex.mint(self.addr, Fixed8.FromDecimal(10000).value)
+        unchecked.nex.approve(self.addr, unchecked.script_hash, Fixed8.FromDecimal(10000).value)
+
+        for vm in [self.vm, unchecked]:
+            invocation = vm.invoke('swapToEth', [self.addr, self.eth_addr, Fixed8.FromDecimal(500).value], witnesses=[self.addr])
+            self.assertTrue(invocation.halted)
+
+        self.assertEqual(unchecked.storage, self.vm.storage)
+
+    def test_price_exception_faults(self):
+
+        unchecked = ContractVM.load('NexSwap.py', check_limits=False)
+
+        for vm in [self.vm, unchecked]:
+            with patch.object(ContractVMEngine, 'GetPrice', side_effect=Exception("no price")):
+                invocation = vm.invoke('totalSwapped')
+            self.assertFalse(invocation.halted)
+            self.assertIsNone(invocation.result)
+
+    def test_fuzz_swap_ledger(self):
+
+        rng = random.Random(1)
+        vm = ContractVM.load('NexSwap.py', check_limits=False)
+        owners = self.owners(vm)
+        vm.invoke('setMinter', [self.minter], witnesses=owners[:3])
+
+        addrs = [bytes([i]) * 20 for i in range(1, 5)]
+        for addr in addrs:
+            vm.nex.mint(addr, Fixed8.FromDecimal(5000).value)
+            vm.nex.approve(addr, vm.script_hash, Fixed8.FromDecimal(5000).value)
+
+        swapped_in = swapped_out = swaps = 0
+        for swap_id in range(60):
+            addr = rng.choice(addrs)
+            amount = Fixed8.FromDecimal(rng.randint(400, 900)).value
+            witnesses = rng.choice([[addr], [self.minter], []])
+
+            if rng.random() < 0.6:
+                invocation = vm.invoke('swapToEth', [addr, self.eth_addr, amount], witnesses=witnesses)
+                if invocation.halted:
+                    swapped_in += amount
+                    swaps += 1
+            else:
+                invocation = vm.invoke('swapFromEth', [addr, self.eth_addr, amount, swap_id], witnesses=witnesses)
+                if invocation.halted and invocation.result.GetBoolean():
+                    swapped_out += amount
+
+            outstanding = vm.invoke('totalSwapped').result.GetBigInteger()
+            self.assertEqual(outstanding, swapped_in - swapped_out)
+            self.assertEqual(vm.nex.balance_of(vm.script_hash), outstanding)
+
+        self.assertGreater(swaps, 0)
+        self.assertGreater(swapped_out, 0)
+        self.assertEqual(vm.invoke('reconcileSwapped').result.GetArray()[3].GetBigInteger(), swapped_in - swapped_out)
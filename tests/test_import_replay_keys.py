@@ -0,0 +1,139 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from neocore.UInt160 import UInt160
+
+from neo.Core.State.StorageItem import StorageItem
+from tools.import_replay_keys import (REPLAY_KEY_LENGTH, ImportProgress,
+                                      ReplayKeyImporter, chunk_replay_keys,
+                                      read_replay_keys)
+
+
+class TestImportReplayKeys(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_keys(self, lines):
+        path = os.path.join(self.dir.name, 'keys.txt')
+        with open(path, 'w') as handle:
+            handle.write('\n'.join(lines))
+        return path
+
+    def test_read_and_chunk(self):
+
+        keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in range(5)]
+        path = self.write_keys([key.hex() for key in keys] + [''])
+
+        self.assertEqual(list(read_replay_keys(path)), keys)
+
+        chunks = list(chunk_replay_keys(read_replay_keys(path), 2))
+        self.assertEqual(chunks, [keys[0] + keys[1], keys[2] + keys[3], keys[4]])
+
+    def test_invalid_key(self):
+
+        path = self.write_keys(['00' * REPLAY_KEY_LENGTH, '00' * (REPLAY_KEY_LENGTH - 1)])
+
+        with self.assertRaises(ValueError):
+            list(read_replay_keys(path))
+
+    def test_progress_resume(self):
+
+        path = os.path.join(self.dir.name, 'keys.progress.json')
+
+        progress = ImportProgress(path, 10)
+        progress.sent('aa' * 32)
+        progress.confirm()
+        progress.sent('bb' * 32)
+
+        progress = ImportProgress(path, 10)
+        self.assertEqual(progress.confirmed, 1)
+        self.assertEqual(progress.pending_tx, 'bb' * 32)
+
+        # chunks would not line up with a different chunk size
+        with self.assertRaises(Exception):
+            ImportProgress(path, 20)
+
+    def test_resend_failed_chunk(self):
+
+        keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in range(1, 4)]
+        chunks = list(chunk_replay_keys(keys, 2))
+        progress = ImportProgress(os.path.join(self.dir.name, 'keys.progress.json'), 2)
+
+        storage = {}
+        blockchain = MagicMock(Height=10)
+        blockchain.GetTransaction.return_value = (object(), 10)
+        blockchain.GetStorageItem.side_effect = lambda storage_key: storage.get(bytes(storage_key.Key))
+
+        sent = []
+
+        def send_chunk(chunk):
+            sent.append(chunk)
+            tx = MagicMock()
+            tx.Hash.ToString.return_value = '%02x' % len(sent) * 32
+            return tx
+
+        wallet = MagicMock()
+        importer = ReplayKeyImporter(UInt160(data=bytearray(20)), [wallet], chunks, progress)
+        importer.send_chunk = send_chunk
+
+        with patch('tools.import_replay_keys.Blockchain.Default', return_value=blockchain):
+            importer.step()
+            self.assertEqual(sent, [chunks[0]])
+
+            # the transaction is in a block, but it FAULTed
+            importer.step()
+            self.assertEqual(sent, [chunks[0], chunks[0]])
+            self.assertEqual(progress.confirmed, 0)
+
+            storage[keys[0]] = StorageItem(b'\x01')
+            storage[keys[1]] = StorageItem(b'\x01')
+            importer.step()
+            self.assertEqual(sent, [chunks[0], chunks[0], chunks[1]])
+            self.assertEqual(progress.confirmed, 1)
+
+            storage[keys[2]] = StorageItem(b'\x01')
+            importer.step()
+            self.assertEqual(progress.confirmed, 2)
+            self.assertTrue(importer.done)
+
+    def test_last_key_set_before(self):
+
+        keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in range(1, 4)]
+        progress = ImportProgress(os.path.join(self.dir.name, 'keys.progress.json'), 3)
+
+        # the last key was imported before, the others are missing
+        storage = {keys[2]: StorageItem(b'\x01')}
+        blockchain = MagicMock(Height=10)
+        blockchain.GetTransaction.return_value = (object(), 10)
+        blockchain.GetStorageItem.side_effect = lambda storage_key: storage.get(bytes(storage_key.Key))
+
+        sent = []
+
+        def send_chunk(chunk):
+            sent.append(chunk)
+            tx = MagicMock()
+            tx.Hash.ToString.return_value = '%02x' % len(sent) * 32
+            return tx
+
+        importer = ReplayKeyImporter(UInt160(data=bytearray(20)), [MagicMock()], chunk_replay_keys(keys, 3), progress)
+        importer.send_chunk = send_chunk
+
+        with patch('tools.import_replay_keys.Blockchain.Default', return_value=blockchain):
+            importer.step()
+
+            # the transaction FAULTed, the last key alone does not confirm it
+            importer.step()
+            self.assertEqual(len(sent), 2)
+            self.assertEqual(progress.confirmed, 0)
+
+            storage[keys[0]] = StorageItem(b'\x01')
+            storage[keys[1]] = StorageItem(b'\x01')
+            importer.step()
+            self.assertEqual(progress.confirmed, 1)
+            self.assertTrue(importer.done)
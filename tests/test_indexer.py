@@ -0,0 +1,170 @@
+import binascii
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import plyvel
+from events import Events
+from neocore.BigInteger import BigInteger
+from neocore.Fixed8 import Fixed8
+from neocore.UInt160 import UInt160
+from neocore.UInt256 import UInt256
+
+from neo.Core.TX.InvocationTransaction import InvocationTransaction
+from neo.SmartContract.ContractParameter import ContractParameter
+from neo.SmartContract.ContractParameterType import ContractParameterType
+from neo.SmartContract.SmartContractEvent import (NotifyEvent,
+                                                  SmartContractEvent)
+from neo.VM.ScriptBuilder import ScriptBuilder
+from tools.backfill import NOTIFICATION_BLOCK_PREFIX
+from tools.indexer import (NEX_SCRIPT_HASH, SWAP_FROM_ETH, SWAP_TO_ETH,
+                           SwapEventIndexer, SwapIndex, decode_swap_event)
+
+
+class TestIndexer(TestCase):
+
+    contract_hash = UInt160(data=bytearray(b'\x01' * 20))
+    addr = b'\xa3(\x0f\xb5\x00\x93\x10\xad\xe9\xb3<\x07\xe6\xa6|U2\xe2\xfc\x10'
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.index = SwapIndex(os.path.join(self.dirname, 'swaps.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.dirname)
+
+    def notify_event(self, event, swap_id, block, contract_hash=None):
+        payload = ContractParameter(ContractParameterType.Array, value=[
+            ContractParameter(ContractParameterType.ByteArray, value=event.encode()),
+            ContractParameter(ContractParameterType.ByteArray, value=self.addr),
+            ContractParameter(ContractParameterType.ByteArray, value=self.eth_addr),
+            ContractParameter(ContractParameterType.ByteArray, value=(100000000000).to_bytes(5, 'little')),
+            ContractParameter(ContractParameterType.Integer, value=str(swap_id)),
+        ])
+        return NotifyEvent(SmartContractEvent.RUNTIME_NOTIFY, payload, contract_hash or self.contract_hash,
+                           block, UInt256(data=bytearray(32)), execution_success=True)
+
+    def test_decode_swap_event(self):
+
+        swap_event = decode_swap_event(self.notify_event(SWAP_TO_ETH, 12, 5))
+        self.assertEqual(swap_event.event, SWAP_TO_ETH)
+        self.assertEqual(swap_event.swap_id, 12)
+        self.assertEqual(swap_event.addr, self.addr)
+        self.assertEqual(swap_event.eth_addr, self.eth_addr)
+        self.assertEqual(swap_event.amount, 100000000000)
+        self.assertEqual(swap_event.block, 5)
+
+        self.assertIsNone(decode_swap_event(self.notify_event('transfer', 12, 5)))
+
+    def test_index_checkpoint(self):
+
+        self.assertEqual(self.index.checkpoint, -1)
+        self.index.commit_block(4, [])
+
+        indexer = SwapEventIndexer(self.index, self.contract_hash)
+        indexer.on_smart_contract_event(self.notify_event(SWAP_TO_ETH, 1, 5))
+        indexer.on_smart_contract_event(self.notify_event(SWAP_FROM_ETH, 1, 5))
+        # other contracts are ignored
+        indexer.on_smart_contract_event(self.notify_event(SWAP_TO_ETH, 2, 5, contract_hash=UInt160(data=bytearray(20))))
+
+        block = type('Block', (), {'Index': 5})
+        indexer.on_persist_completed(block)
+
+        self.assertEqual(self.index.checkpoint, 5)
+        self.assertEqual(self.index.get_swap(SWAP_TO_ETH, 1).block, 5)
+        self.assertEqual(self.index.get_swap(SWAP_FROM_ETH, 1).swap_id, 1)
+        self.assertIsNone(self.index.get_swap(SWAP_TO_ETH, 2))
+        self.assertEqual(len(self.index.get_by_addr(self.addr)), 2)
+        self.assertEqual(len(self.index.get_by_eth_addr(self.eth_addr)), 2)
+
+        # blocks before the checkpoint are not indexed again
+        indexer.on_smart_contract_event(self.notify_event(SWAP_TO_ETH, 3, 4))
+        indexer.on_persist_completed(type('Block', (), {'Index': 4}))
+        self.assertIsNone(self.index.get_swap(SWAP_TO_ETH, 3))
+        self.assertEqual(self.index.checkpoint, 5)
+
+    def replay_chain(self, blocks):
+        """
+        A chain with a swapToEth of 100 in each of the given blocks, and their transfers in a NotificationDB
+        """
+        transactions = {}
+        notification_db = plyvel.DB(os.path.join(self.dirname, 'notifications'), create_if_missing=True)
+
+        for height in blocks:
+            sb = ScriptBuilder()
+            sb.EmitAppCallWithOperationAndArgs(self.contract_hash, 'swapToEth', [bytearray(self.addr), bytearray(self.eth_addr), BigInteger(100)])
+            tx = InvocationTransaction()
+            tx.Version = 1
+            tx.Gas = Fixed8.Zero()
+            tx.Script = binascii.unhexlify(sb.ToArray())
+            transactions[height] = tx
+
+            payload = ContractParameter(ContractParameterType.Array, value=[
+                ContractParameter(ContractParameterType.ByteArray, value=b'transfer'),
+                ContractParameter(ContractParameterType.ByteArray, value=self.addr),
+                ContractParameter(ContractParameterType.ByteArray, value=bytes(self.contract_hash.Data)),
+                ContractParameter(ContractParameterType.Integer, value='100'),
+            ])
+            transfer = NotifyEvent(SmartContractEvent.RUNTIME_NOTIFY, payload, NEX_SCRIPT_HASH, height, tx.Hash, execution_success=True)
+            notification_db.put(NOTIFICATION_BLOCK_PREFIX + height.to_bytes(4, 'little') + bytes(4), transfer.ToByteArray())
+
+        chain_db = plyvel.DB(os.path.join(self.dirname, 'chain'), create_if_missing=True)
+        self.addCleanup(chain_db.close)
+        self.addCleanup(notification_db.close)
+
+        def block(height):
+            if height > max(blocks):
+                return None
+            return type('Block', (), {'Index': height, 'FullTransactions': [transactions[height]] if height in transactions else []})
+
+        blockchain = type('Blockchain', (), {'_db': chain_db, 'Height': max(blocks), 'GetBlockByHeight': staticmethod(block)})
+        return blockchain, type('NotificationDB', (), {'db': notification_db})
+
+    def test_catch_up_gap(self):
+
+        blockchain, notification_db = self.replay_chain([6, 7])
+        self.index.commit_block(5, [])
+
+        indexer = SwapEventIndexer(self.index, self.contract_hash)
+        indexer.on_smart_contract_event(self.notify_event(SWAP_TO_ETH, 3, 8))
+
+        with patch('tools.indexer.Blockchain.Default', return_value=blockchain), \
+                patch('neo.Implementations.Notifications.LevelDB.NotificationDB.NotificationDB.instance', return_value=notification_db):
+            indexer.on_persist_completed(type('Block', (), {'Index': 8}))
+
+        self.assertEqual(self.index.checkpoint, 8)
+        self.assertEqual(self.index.get_swap(SWAP_TO_ETH, 1).block, 6)
+        self.assertEqual(self.index.get_swap(SWAP_TO_ETH, 2).block, 7)
+        self.assertEqual(self.index.get_swap(SWAP_TO_ETH, 3).block, 8)
+
+    def test_refuse_gap(self):
+
+        self.index.commit_block(5, [])
+
+        indexer = SwapEventIndexer(self.index, self.contract_hash)
+        indexer.on_smart_contract_event(self.notify_event(SWAP_TO_ETH, 3, 8))
+
+        # without the NotificationDB the blocks in between can't be replayed
+        with patch('neo.Implementations.Notifications.LevelDB.NotificationDB.NotificationDB.instance', return_value=None):
+            indexer.on_persist_completed(type('Block', (), {'Index': 8}))
+
+        self.assertEqual(self.index.checkpoint, 5)
+        self.assertIsNone(self.index.get_swap(SWAP_TO_ETH, 3))
+
+    def test_catch_up_on_start(self):
+
+        blockchain, notification_db = self.replay_chain([3, 4])
+        blockchain.PersistCompleted = Events()
+
+        indexer = SwapEventIndexer(self.index, self.contract_hash)
+        with patch('tools.indexer.Blockchain.Default', return_value=blockchain), \
+                patch('neo.Implementations.Notifications.LevelDB.NotificationDB.NotificationDB.instance', return_value=notification_db):
+            indexer.start()
+            indexer.stop()
+
+        self.assertEqual(self.index.checkpoint, 4)
+        self.assertEqual([evt.block for evt in self.index.get_by_addr(self.addr)], [3, 4])
@@ -0,0 +1,113 @@
+import tempfile
+from unittest import TestCase
+
+from neocore.UInt160 import UInt160
+
+from neo.Core.Block import Block
+from neo.Core.Blockchain import Blockchain
+from neo.Core.TX.MinerTransaction import MinerTransaction
+from neo.Core.Witness import Witness
+from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import \
+    LevelDBBlockchain
+from neo.Settings import settings
+from tests.memory_blockchain import MemoryBlockchain, MemoryDB
+
+
+class TestMemoryBlockchain(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        settings.setup_unittest_net()
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        Blockchain.DeregisterBlockchain()
+        self.dir.cleanup()
+
+    def add_block(self, blockchain, nonce):
+        Blockchain.RegisterBlockchain(blockchain)
+
+        miner = MinerTransaction()
+        miner.Nonce = nonce
+
+        block = Block(prevHash=blockchain.GetBlockByHeight(blockchain.Height).Hash,
+                      timestamp=1546300800 + nonce,
+                      index=blockchain.Height + 1,
+                      consensusData=1234, script=Witness(invocation_script=bytearray([1]), verification_script=bytearray([2])),
+                      nextConsensus=UInt160(data=bytearray(20)), transactions=[miner], build_root=True)
+
+        blockchain.AddHeaders([block.Header])
+        blockchain.AddBlockDirectly(block, do_persist_complete=True)
+
+        Blockchain.DeregisterBlockchain()
+        return block
+
+    def test_db(self):
+
+        db = MemoryDB()
+        db.put(b'b2', b'2')
+        db.put(b'a1', b'1')
+        db.put(b'b1', b'3')
+        db.put(bytearray(b'c1'), bytearray(b'4'))
+
+        self.assertEqual(db.get(b'b2'), b'2')
+        self.assertEqual(db.get(b'x', 0), 0)
+        self.assertEqual(list(db.iterator()), [(b'a1', b'1'), (b'b1', b'3'), (b'b2', b'2'), (b'c1', b'4')])
+        self.assertEqual(list(db.iterator(prefix=b'b', include_value=False)), [b'b1', b'b2'])
+        self.assertEqual(list(db.iterator(prefix=b'b', include_key=False, reverse=True)), [b'2', b'3'])
+
+        snapshot = db.snapshot()
+
+        with db.write_batch() as wb:
+            wb.delete(b'b1')
+            wb.put(b'b3', b'5')
+            self.assertEqual(db.get(b'b3'), None)
+
+        self.assertEqual(list(db.iterator(prefix=b'b', include_value=False)), [b'b2', b'b3'])
+        self.assertEqual(list(snapshot.iterator(prefix=b'b', include_value=False)), [b'b1', b'b2'])
+
+        # only a transaction is discarded on an exception
+        for transaction, expected in [(True, None), (False, b'6')]:
+            with self.assertRaises(ValueError):
+                with db.write_batch(transaction=transaction) as wb:
+                    wb.put(b'd1', b'6')
+                    raise ValueError()
+            self.assertEqual(db.get(b'd1'), expected)
+
+    def test_same_as_leveldb(self):
+
+        leveldb = LevelDBBlockchain(self.dir.name)
+        memory = MemoryBlockchain()
+
+        for blockchain in [leveldb, memory]:
+            for nonce in range(3):
+                self.add_block(blockchain, nonce)
+
+        self.assertEqual(memory.Height, 3)
+        self.assertEqual(memory.CurrentHeaderHash, leveldb.CurrentHeaderHash)
+        self.assertEqual(list(memory._db.iterator()), list(leveldb._db.iterator()))
+
+        leveldb.Dispose()
+
+    def test_from_leveldb(self):
+
+        leveldb = LevelDBBlockchain(self.dir.name)
+        block = self.add_block(leveldb, 1)
+        leveldb.Dispose()
+
+        memory = MemoryBlockchain.from_leveldb(self.dir.name)
+        self.assertEqual(memory.Height, 1)
+
+        # the transactions of a block are read from the registered chain
+        Blockchain.RegisterBlockchain(memory)
+        self.assertEqual(memory.GetBlock(block.Hash.ToBytes()).Hash, block.Hash)
+        Blockchain.DeregisterBlockchain()
+
+        # clones don't see each other's blocks
+        clone = memory.Clone()
+        self.add_block(clone, 2)
+        self.assertEqual(clone.Height, 2)
+        self.assertEqual(memory.Height, 1)
+        self.assertGreater(len(clone._db), len(memory._db))
@@ -0,0 +1,77 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from tools.import_replay_keys import REPLAY_KEY_LENGTH
+from tools.replay_keys import (ReplayKeyFile, convert, decode_replay_key,
+                               difference, intersection, union,
+                               write_replay_keys)
+
+
+class TestReplayKeys(TestCase):
+
+    addr = b'\xa3(\x0f\xb5\x00\x93\x10\xad\xe9\xb3<\x07\xe6\xa6|U2\xe2\xfc\x10'
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def key_file(self, name, keys):
+        write_replay_keys(self.path(name), sorted(keys))
+        return ReplayKeyFile(self.path(name))
+
+    def test_convert(self):
+
+        keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in [5, 3, 9, 3, 1, 7]]
+        with open(self.path('keys.txt'), 'w') as handle:
+            handle.write('\n'.join(key.hex() for key in keys))
+
+        # a run size smaller than the file goes through the merge of sorted runs
+        for run_size in [100, 2]:
+            self.assertEqual(convert(self.path('keys.txt'), self.path('keys.rkeys'), run_size), 5)
+
+            with ReplayKeyFile(self.path('keys.rkeys')) as key_file:
+                self.assertEqual(list(key_file), sorted(set(keys)))
+                self.assertTrue(key_file.is_sorted())
+
+    def test_lookup(self):
+
+        keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in range(0, 200, 2)]
+        with self.key_file('keys.rkeys', keys) as key_file:
+            self.assertEqual(len(key_file), 100)
+            self.assertEqual(key_file[-1], keys[-1])
+            self.assertTrue(all(key in key_file for key in keys))
+            self.assertFalse(any(bytes([i]) * REPLAY_KEY_LENGTH in key_file for i in range(1, 201, 2)))
+
+        with self.key_file('empty.rkeys', []) as key_file:
+            self.assertEqual(len(key_file), 0)
+            self.assertFalse(keys[0] in key_file)
+
+    def test_set_operations(self):
+
+        a_keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in [1, 2, 3, 5, 8]]
+        b_keys = [bytes([i]) * REPLAY_KEY_LENGTH for i in [2, 4, 5, 9]]
+
+        with self.key_file('a.rkeys', a_keys) as a, self.key_file('b.rkeys', b_keys) as b:
+            self.assertEqual(list(union(a, b)), sorted(set(a_keys + b_keys)))
+            self.assertEqual(list(intersection(a, b)), sorted(set(a_keys) & set(b_keys)))
+            self.assertEqual(list(difference(a, b)), sorted(set(a_keys) - set(b_keys)))
+            self.assertEqual(list(difference(b, a)), sorted(set(b_keys) - set(a_keys)))
+
+    def test_write_unsorted(self):
+
+        with self.assertRaises(ValueError):
+            write_replay_keys(self.path('keys.rkeys'), [b'\x02' * REPLAY_KEY_LENGTH, b'\x01' * REPLAY_KEY_LENGTH])
+
+    def test_decode(self):
+
+        tx_hash = bytes(range(32))
+        decoded = decode_replay_key(tx_hash + self.addr)
+
+        self.assertEqual(decoded.tx_hash, tx_hash[::-1].hex())
+        self.assertEqual(decoded.addr, 'AWeZnH735EavQJKbJPC5F8fxutBnJFhukW')
@@ -0,0 +1,120 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import plyvel
+from neocore.BigInteger import BigInteger
+from neocore.IO.BinaryWriter import BinaryWriter
+from neocore.UInt160 import UInt160
+from neocore.UInt256 import UInt256
+
+from neo.Core.State.StorageItem import StorageItem
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from neo.IO.MemoryStream import StreamManager
+from neo.VM.InteropService import Array, ByteArray, Integer
+from tools.storage_snapshot import (LEDGER, OWNER_KEYS, REPLAY, SWAP_RECORDS,
+                                    SWAPID_PAGES, UNKNOWN_HEIGHT, Snapshot,
+                                    StorageEntry, StorageReport,
+                                    diff_snapshots, key_family, read_storage,
+                                    summarize_diff, write_snapshot)
+
+
+class TestStorageSnapshot(TestCase):
+
+    contract_hash = UInt160(data=bytearray(b'\x01' * 20))
+    addr = b'\xa3(\x0f\xb5\x00\x93\x10\xad\xe9\xb3<\x07\xe6\xa6|U2\xe2\xfc\x10'
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+    tx_hash = bytes(range(32))
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def swap_record(self, height):
+        stream = StreamManager.GetStream()
+        Array([ByteArray(self.addr), ByteArray(self.eth_addr), Integer(BigInteger(100)), Integer(BigInteger(height))]).Serialize(BinaryWriter(stream))
+        record = stream.getvalue()
+        StreamManager.ReleaseStream(stream)
+        return bytes(record)
+
+    def create_chain(self):
+        db = plyvel.DB(self.path('chain'), create_if_missing=True)
+
+        prefix = DBPrefix.ST_Storage + bytes(self.contract_hash.Data)
+        storage = {
+            b'swapCounter': b'\x01',
+            b'owners': self.addr * 5,
+            b'swapRecord\x01': self.swap_record(1234),
+            b'swapIdPage': b'\x0c',
+            self.tx_hash + self.addr: b'\x01',
+        }
+        for key, value in storage.items():
+            db.put(prefix + key, StorageItem(value).ToByteArray())
+
+        # storage of another contract
+        db.put(DBPrefix.ST_Storage + b'\x02' * 20 + b'swapCounter', StorageItem(b'\x05').ToByteArray())
+
+        # the transaction of the replay key
+        db.put(DBPrefix.DATA_Transaction + UInt256(data=bytearray(self.tx_hash)).ToBytes(), (1200).to_bytes(4, 'little') + b'00')
+
+        return db
+
+    def test_families(self):
+
+        self.assertEqual(key_family(b'swapCounter'), LEDGER)
+        self.assertEqual(key_family(b'swapRecord\x01'), SWAP_RECORDS)
+        self.assertEqual(key_family(b'swapIdPage\x01'), SWAPID_PAGES)
+        self.assertEqual(key_family(b'owners'), OWNER_KEYS)
+        self.assertEqual(key_family(self.tx_hash + self.addr), REPLAY)
+
+    def test_export_and_report(self):
+
+        db = self.create_chain()
+        entries = list(read_storage(db, self.contract_hash))
+        db.close()
+
+        self.assertEqual(len(entries), 5)
+        self.assertEqual([entry.key for entry in entries], sorted(entry.key for entry in entries))
+
+        heights = {key_family(entry.key): entry.height for entry in entries}
+        self.assertEqual(heights[REPLAY], 1200)
+        self.assertEqual(heights[SWAP_RECORDS], 1234)
+        self.assertEqual(heights[LEDGER], UNKNOWN_HEIGHT)
+
+        self.assertEqual(write_snapshot(self.path('a.snap'), self.contract_hash, 2000, entries), 5)
+
+        with Snapshot(self.path('a.snap')) as snapshot:
+            self.assertEqual(snapshot.height, 2000)
+            self.assertEqual(snapshot.contract_hash, self.contract_hash)
+            self.assertEqual(list(snapshot), entries)
+
+            report = StorageReport(bucket_size=1000)
+            for entry in snapshot:
+                report.add(entry)
+
+        self.assertEqual(report.families[OWNER_KEYS].count, 1)
+        self.assertEqual(report.families[OWNER_KEYS].total_bytes, 6 + 100)
+        self.assertEqual(report.families[REPLAY].growth, {1: 1})
+        self.assertEqual(report.families[LEDGER].growth, {None: 1})
+        self.assertIn('replay keys', report.format())
+
+    def test_diff(self):
+
+        old = [StorageEntry(b'a', b'1', 1), StorageEntry(b'b', b'1', 1), StorageEntry(b'swapCounter', b'\x01', 1)]
+        new = [StorageEntry(b'b', b'1', 1), StorageEntry(b'c', b'1', 1), StorageEntry(b'swapCounter', b'\x02', 1)]
+
+        write_snapshot(self.path('old.snap'), self.contract_hash, 1, old)
+        write_snapshot(self.path('new.snap'), self.contract_hash, 2, new)
+
+        with Snapshot(self.path('old.snap')) as old_snapshot, Snapshot(self.path('new.snap')) as new_snapshot:
+            changes = list(diff_snapshots(old_snapshot, new_snapshot))
+
+        self.assertEqual(changes, [(old[0], None), (None, new[1]), (old[2], new[2])])
+
+        summary = summarize_diff(changes)
+        self.assertEqual(summary[LEDGER], [0, 0, 1])
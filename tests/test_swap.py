@@ -16,6 +16,69 @@ from tests.swap_base import TestSwapBase
 
 class TestSwap(TestSwapBase):
 
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+
+    def setUp(self):
+        super(TestSwap, self).setUp()
+
+        # state a test builds on, on top of the snapshot
+        setup = getattr(self, 'setup_%s' % self._testMethodName, None)
+        if setup:
+            setup()
+
+    def setup_test_c_swap_from_eth(self):
+        # 1600 swapped to eth that can be swapped back, by owner 2 as the minter
+        self.swap_to_eth(1000)
+        self.swap_to_eth(600)
+        self.set_minter()
+
+    def swap_to_eth(self, amount, eth_addr=None):
+        """
+        Swaps NEX of the token owner to eth in a block
+
+        :return: int: the swap id
+        """
+        user_wallet = self.GetTokenOwner()
+        swap_args = [self.token_owner_addr(), eth_addr or self.eth_addr, Fixed8.FromDecimal(amount).value]
+        tx, results = self.invoke_test(user_wallet, 'swapToEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBoolean(), True)
+
+        self.dispatched_events = []
+        self._invoke_tx_on_blockchain(tx, user_wallet)
+        return int(self.dispatched_events[-1].event_payload.Value[4].Value)
+
+    def swap_to_eth_batch(self, legs):
+        """
+        Swaps NEX of the token owner to eth in a block, as a batch of (eth addr, amount) legs
+        """
+        user_wallet = self.GetTokenOwner()
+        legs = [[eth_addr, Fixed8.FromDecimal(amount).value] for eth_addr, amount in legs]
+        tx, results = self.invoke_test(user_wallet, 'swapToEthBatch', [self.token_owner_addr(), legs], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBoolean(), True)
+        self._invoke_tx_on_blockchain(tx, user_wallet)
+
+    def set_minter(self):
+        """
+        Makes owner 2 the minter in a block
+
+        :return: the minter wallet
+        """
+        owner_wallet = self.GetOwner1()
+        tx, results = self.invoke_test(owner_wallet, 'setMinter', [self.owner2_sh()], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+        return self.GetOwner2()
+
+    def swap_from_eth(self, swap_ids, amount):
+        """
+        Swaps amount from eth to the token owner for every swap id in one batch of the minter, in a block
+        """
+        minter_wallet = self.GetOwner2()
+        batch = [[self.token_owner_addr(), self.eth_addr, Fixed8.FromDecimal(amount).value, swap_id] for swap_id in swap_ids]
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEthBatch', batch, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), len(swap_ids))
+        self._invoke_tx_on_blockchain(tx, minter_wallet)
+
     def test_a_swap_from_neo(self):
 
         user_wallet = self.GetTokenOwner()
@@ -174,3 +237,354 @@ class TestSwap(TestSwapBase):
         swap_args = [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(amountToSwap).value, swap_id]
         tx, results = self.invoke_test(minter_wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
         self.assertEqual(len(results), 0)
+
+
+    def test_d_swap_from_eth_batch(self):
+
+        # 1000 left to swap back after swap id 1
+        self.swap_to_eth(2600)
+        minter_wallet = self.set_minter()
+        self.swap_from_eth([1], 1600)
+
+        user_wallet = self.GetTokenOwner()
+        token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
+
+        eth_addr = self.eth_addr
+
+        current_balance_user = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+
+        batch = [
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(400).value, 2],
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(600).value, 3],
+            # already swapped above, should be skipped
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(1600).value, 1],
+        ]
+
+        # only minter can swap from eth
+        tx, results = self.invoke_test(user_wallet, 'swapFromEthBatch', batch, contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        # cant swap back more than has been swapped
+        too_much = [
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(400).value, 2],
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(601).value, 3],
+        ]
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEthBatch', too_much, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
+
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEthBatch', batch, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 2)
+
+        self.dispatched_events = []
+        tx, block = self._invoke_tx_on_blockchain(tx, minter_wallet)
+
+        swap_events = [evt for evt in self.dispatched_events if evt.notify_type == b'onSwapFromEth']
+        self.assertEqual(len(swap_events), 2)
+        self.assertEqual(swap_events[0].event_payload.Value[4].Value, '2')
+        self.assertEqual(swap_events[1].event_payload.Value[4].Value, '3')
+
+        new_balance_user = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+        self.assertEqual(new_balance_user, current_balance_user + 1000)
+
+        tx, results = self.invoke_test(user_wallet, 'totalSwapped', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 0)
+
+        # resubmitting the same batch swaps nothing
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEthBatch', batch, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 0)
+
+
+    def test_e_swap_to_eth_batch(self):
+
+        user_wallet = self.GetTokenOwner()
+        token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
+
+        current_balance_user = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+        current_balance_contract = int(token.GetBalance(user_wallet, TestSwapBase.swap_contract))
+
+        eth_addr1 = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+        eth_addr2 = bytes.fromhex('1FAB4CB3D917719284F9E715A9c6B6FA1fBA2171')
+
+        # every leg needs to be at least the min swap amount
+        legs = [[eth_addr1, Fixed8.FromDecimal(500).value], [eth_addr2, Fixed8.FromDecimal(499.99999).value]]
+        tx, results = self.invoke_test(user_wallet, 'swapToEthBatch', [self.token_owner_addr(), legs], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
+
+        legs = [[eth_addr1, Fixed8.FromDecimal(500).value], [eth_addr2, Fixed8.FromDecimal(700).value]]
+        tx, results = self.invoke_test(user_wallet, 'swapToEthBatch', [self.token_owner_addr(), legs], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBoolean(), True)
+
+        self.dispatched_events = []
+        tx, block = self._invoke_tx_on_blockchain(tx, user_wallet)
+
+        swap_events = [evt for evt in self.dispatched_events if evt.notify_type == b'onSwapToEth']
+        self.assertEqual(len(swap_events), 2)
+
+        event_results = swap_events[0].event_payload.Value
+        self.assertEqual(event_results[2].Value, eth_addr1)
+        self.assertEqual(Fixed8.FromDecimal(500).value, int.from_bytes(event_results[3].Value, 'little'))
+        self.assertEqual(event_results[4].Value, '1')
+
+        event_results = swap_events[1].event_payload.Value
+        self.assertEqual(event_results[2].Value, eth_addr2)
+        self.assertEqual(Fixed8.FromDecimal(700).value, int.from_bytes(event_results[3].Value, 'little'))
+        self.assertEqual(event_results[4].Value, '2')
+
+        new_balance_user = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+        new_balance_contract = int(token.GetBalance(user_wallet, TestSwapBase.swap_contract))
+
+        self.assertEqual(new_balance_contract, current_balance_contract + 1200)
+        self.assertEqual(new_balance_user, current_balance_user - 1200)
+
+
+    def test_f_swap_ledger(self):
+
+        # 2600 + 500 + 700 swapped in, 1600 + 400 + 600 swapped out
+        self.swap_to_eth(2600)
+        self.swap_to_eth_batch([(self.eth_addr, 500), (self.eth_addr, 700)])
+        self.set_minter()
+        self.swap_from_eth([1], 1600)
+        self.swap_from_eth([2], 400)
+        self.swap_from_eth([3], 600)
+
+        user_wallet = self.GetTokenOwner()
+        token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
+        contract_balance = int(token.GetBalance(user_wallet, TestSwapBase.swap_contract))
+
+        tx, results = self.invoke_test(user_wallet, 'totalSwappedIn', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), Fixed8.FromDecimal(3800).value)
+
+        tx, results = self.invoke_test(user_wallet, 'totalSwappedOut', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), Fixed8.FromDecimal(2600).value)
+
+        tx, results = self.invoke_test(user_wallet, 'totalSwapped', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), Fixed8.FromDecimal(1200).value)
+
+        tx, results = self.invoke_test(user_wallet, 'reconcileSwapped', [], contract=TestSwapBase.swap_contract.ToString())
+        ledger = results[0].GetArray()
+        self.assertEqual(ledger[0].GetBigInteger(), Fixed8.FromDecimal(3800).value)
+        self.assertEqual(ledger[1].GetBigInteger(), Fixed8.FromDecimal(2600).value)
+        self.assertEqual(ledger[2].GetBigInteger(), Fixed8.FromDecimal(1200).value)
+        self.assertEqual(ledger[3].GetBigInteger(), Fixed8.FromDecimal(contract_balance).value)
+
+
+    def test_g_multiple_minters(self):
+
+        self.swap_to_eth(1000)
+        minter_wallet = self.set_minter()
+
+        owner_wallet = self.GetOwner1()
+        minter2_wallet = self.GetOwner3()
+
+        eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+
+        # minter 2 can not be set before there is a second slot
+        tx, results = self.invoke_test(owner_wallet, 'setMinter', [self.owner3_sh(), 1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(owner_wallet, 'setMinterSlots', [2], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        tx, results = self.invoke_test(owner_wallet, 'setMinter', [self.owner3_sh(), 1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        tx, results = self.invoke_test(owner_wallet, 'getMinter', [1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetByteArray(), self.owner3_sh())
+
+        # odd swap ids belong to minter 2
+        swap_args = [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(500).value, 7]
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(minter2_wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, minter2_wallet)
+
+        # even swap ids still belong to the original minter
+        swap_args = [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(500).value, 8]
+        tx, results = self.invoke_test(minter2_wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, minter_wallet)
+
+        # a batch can not mix swap ids of different minters
+        batch = [
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(100).value, 10],
+            [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(100).value, 11],
+        ]
+        tx, results = self.invoke_test(minter_wallet, 'swapFromEthBatch', batch, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
+
+        # back to a single minter
+        tx, results = self.invoke_test(owner_wallet, 'setMinterSlots', [1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+
+    def test_h_owners(self):
+
+        owner_wallet = self.GetOwner1()
+
+        tx, results = self.invoke_test(owner_wallet, 'getOwners', [], contract=TestSwapBase.swap_contract.ToString())
+        owners = [item.GetByteArray() for item in results[0].GetArray()]
+        self.assertEqual(len(owners), 5)
+
+        # owners can only be initialized once
+        tx, results = self.invoke_test(owner_wallet, 'initializeOwners', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        # existing owners can't be added twice
+        tx, results = self.invoke_test(owner_wallet, 'addOwner', [owners[0]], contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(owner_wallet, 'addOwner', [self.wtest1_sh()], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        tx, results = self.invoke_test(owner_wallet, 'getOwners', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual([item.GetByteArray() for item in results[0].GetArray()], owners + [self.wtest1_sh()])
+
+        tx, results = self.invoke_test(owner_wallet, 'switchOwner', [self.wtest1_sh(), self.wtest2_sh()], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        tx, results = self.invoke_test(owner_wallet, 'getOwners', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual([item.GetByteArray() for item in results[0].GetArray()], owners + [self.wtest2_sh()])
+
+        tx, results = self.invoke_test(owner_wallet, 'removeOwner', [self.wtest2_sh()], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        tx, results = self.invoke_test(owner_wallet, 'getOwners', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual([item.GetByteArray() for item in results[0].GetArray()], owners)
+
+
+    def test_i_processed_swap_ids(self):
+
+        self.swap_to_eth(2000)
+        self.set_minter()
+        self.swap_from_eth([2, 3, 7, 8], 500)
+
+        user_wallet = self.GetTokenOwner()
+
+        for swap_id, processed in [(2, True), (3, True), (4, False), (8, True), (300, False)]:
+            tx, results = self.invoke_test(user_wallet, 'isSwapIdProcessed', [swap_id], contract=TestSwapBase.swap_contract.ToString())
+            self.assertEqual(results[0].GetBoolean(), processed)
+
+        # the same id, encoded as bytes
+        tx, results = self.invoke_test(user_wallet, 'isSwapIdProcessed', [b'\x02'], contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(user_wallet, 'getSwapIdPage', [0], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), (1 << 2) | (1 << 3) | (1 << 7) | (1 << 8))
+
+        tx, results = self.invoke_test(user_wallet, 'isSwapIdProcessed', [-1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
+
+
+    def test_j_get_swap(self):
+
+        self.swap_to_eth_batch([(self.eth_addr, 500), (self.eth_addr, 700)])
+
+        user_wallet = self.GetTokenOwner()
+
+        eth_addr = bytes.fromhex('2FAB4CB3D917719284F9E715A9c6B6FA1fBA2172')
+        swap_args = [self.token_owner_addr(), eth_addr, Fixed8.FromDecimal(800).value]
+        tx, results = self.invoke_test(user_wallet, 'swapToEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBoolean(), True)
+
+        self.dispatched_events = []
+        tx, block = self._invoke_tx_on_blockchain(tx, user_wallet)
+        swapId = int(self.dispatched_events[-1].event_payload.Value[4].Value)
+
+        tx, results = self.invoke_test(user_wallet, 'getSwap', [swapId], contract=TestSwapBase.swap_contract.ToString())
+        record = results[0].GetArray()
+        self.assertEqual(len(record), 4)
+        self.assertEqual(record[0].GetByteArray(), self.token_owner_sh())
+        self.assertEqual(record[1].GetByteArray(), eth_addr)
+        self.assertEqual(record[2].GetBigInteger(), Fixed8.FromDecimal(800).value)
+        self.assertIn(record[3].GetBigInteger(), [block.Index - 1, block.Index])
+
+        # swaps of a batch are recorded per leg
+        tx, results = self.invoke_test(user_wallet, 'getSwap', [2], contract=TestSwapBase.swap_contract.ToString())
+        record = results[0].GetArray()
+        self.assertEqual(record[2].GetBigInteger(), Fixed8.FromDecimal(700).value)
+
+        tx, results = self.invoke_test(user_wallet, 'getSwap', [swapId + 1], contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+
+    def test_k_get_swap_range(self):
+
+        self.swap_to_eth(1000)
+        self.swap_to_eth(600)
+        self.swap_to_eth(1000)
+        self.swap_to_eth_batch([(self.eth_addr, 500), (bytes.fromhex('1FAB4CB3D917719284F9E715A9c6B6FA1fBA2171'), 700)])
+        self.swap_to_eth(800, bytes.fromhex('2FAB4CB3D917719284F9E715A9c6B6FA1fBA2172'))
+
+        user_wallet = self.GetTokenOwner()
+
+        tx, results = self.invoke_test(user_wallet, 'getSwapRange', [1, 100], contract=TestSwapBase.swap_contract.ToString())
+        counter, records = results[0].GetArray()
+        self.assertEqual(counter.GetBigInteger(), 6)
+
+        amounts = [record.GetArray()[2].GetBigInteger() for record in records.GetArray()]
+        self.assertEqual(amounts, [Fixed8.FromDecimal(amount).value for amount in [1000, 600, 1000, 500, 700, 800]])
+
+        tx, results = self.invoke_test(user_wallet, 'getSwapRange', [5, 1], contract=TestSwapBase.swap_contract.ToString())
+        counter, records = results[0].GetArray()
+        self.assertEqual(len(records.GetArray()), 1)
+        self.assertEqual(records.GetArray()[0].GetArray()[1].GetByteArray(), bytes.fromhex('1FAB4CB3D917719284F9E715A9c6B6FA1fBA2171'))
+
+        # past the counter
+        tx, results = self.invoke_test(user_wallet, 'getSwapRange', [7, 10], contract=TestSwapBase.swap_contract.ToString())
+        counter, records = results[0].GetArray()
+        self.assertEqual(len(records.GetArray()), 0)
+
+
+    def test_l_are_swap_ids_processed(self):
+
+        self.swap_to_eth(2000)
+        self.set_minter()
+        self.swap_from_eth([2, 3, 7, 8], 500)
+
+        user_wallet = self.GetTokenOwner()
+
+        swap_ids = [2, 3, 4, 8, 300, 7]
+        tx, results = self.invoke_test(user_wallet, 'areSwapIdsProcessed', swap_ids, contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 0b101011)
+
+        tx, results = self.invoke_test(user_wallet, 'areSwapIdsProcessed', [4, 5, 6], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 0)
+
+        tx, results = self.invoke_test(user_wallet, 'areSwapIdsProcessed', list(range(241)), contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
+
+
+    def test_m_import_replay_keys(self):
+
+        owner_wallet = self.GetOwner1()
+        user_wallet = self.GetTokenOwner()
+
+        with open('%s/migration/new_930_a.txt' % settings.DATA_DIR_PATH) as handle:
+            keys = [bytes.fromhex(handle.readline().strip()) for i in range(4)]
+
+        # only owners can import
+        tx, results = self.invoke_test(user_wallet, 'importReplayKeys', [b''.join(keys[:3])], contract=TestSwapBase.swap_contract.ToString())
+        self.assertFalse(results[0].GetBoolean())
+
+        tx, results = self.invoke_test(owner_wallet, 'importReplayKeys', [b''.join(keys[:3])], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 3)
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+        # keys that are already set are skipped
+        tx, results = self.invoke_test(owner_wallet, 'importReplayKeys', [b''.join(keys)], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 1)
+
+        # a partial key is rejected
+        tx, results = self.invoke_test(owner_wallet, 'importReplayKeys', [b''.join(keys)[:-1]], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(len(results), 0)
@@ -0,0 +1,113 @@
+import os
+import statistics
+import time
+from uuid import uuid4
+
+from logzero import logger
+from neocore.Fixed8 import Fixed8
+
+from neo.Core.TX.TransactionAttribute import (TransactionAttribute,
+                                              TransactionAttributeUsage)
+from tests.eth_ledger import EthLedger
+from tests.swap_base import TestSwapBase
+
+# Number of NEO -> ETH -> NEO round trips to run
+ROUND_TRIPS = int(os.environ.get('NEX_THROUGHPUT_SWAPS', 10))
+
+
+class TestSwapThroughput(TestSwapBase):
+    """
+    Runs full round trips swapToEth -> Ethereum mint -> Ethereum burn -> swapFromEth
+    against the fixture chain and an in-process Ethereum ledger, and reports
+    sustained swaps per second along with the latency of every leg
+    """
+
+    eth_addr = bytes.fromhex('7FAB4CB3D917719284F9E715A9c6B6FA1fBA217f')
+
+    # the throughput of the node includes writing blocks to LevelDB
+    USE_MEMORY_CHAIN = False
+
+    def setup_swap_contracts(self):
+        super(TestSwapThroughput, self).setup_swap_contracts()
+
+        owner_wallet = self.GetOwner1()
+        tx, results = self.invoke_test(owner_wallet, 'setMinter', [self.owner2_sh()], contract=TestSwapBase.swap_contract.ToString())
+        self._invoke_tx_on_blockchain(tx, owner_wallet)
+
+    def send_unique(self, tx, wallet):
+        # add some unique data so identical invocations get distinct hashes
+        tx.Attributes = [TransactionAttribute(TransactionAttributeUsage.Remark2, data=str(uuid4()))]
+        return self._invoke_tx_on_blockchain(tx, wallet)
+
+    def swap_to_eth(self, wallet, amount):
+
+        swap_args = [self.token_owner_addr(), self.eth_addr, amount]
+        tx, results = self.invoke_test(wallet, 'swapToEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+
+        self.dispatched_events = []
+        self.send_unique(tx, wallet)
+
+        swap_event = [evt for evt in self.dispatched_events if evt.notify_type == b'onSwapToEth'][-1]
+        event_results = swap_event.event_payload.Value
+        return int(event_results[4].Value), event_results[2].Value, int.from_bytes(event_results[3].Value, 'little')
+
+    def swap_from_eth(self, wallet, burn):
+
+        swap_args = [burn.neo_addr, burn.eth_addr, burn.amount, burn.burn_id]
+        tx, results = self.invoke_test(wallet, 'swapFromEth', swap_args, contract=TestSwapBase.swap_contract.ToString())
+        self.assertTrue(results[0].GetBoolean())
+
+        self.dispatched_events = []
+        self.send_unique(tx, wallet)
+
+        swap_event = [evt for evt in self.dispatched_events if evt.notify_type == b'onSwapFromEth'][-1]
+        self.assertEqual(int(swap_event.event_payload.Value[4].Value), burn.burn_id)
+
+    def test_round_trip_throughput(self):
+
+        user_wallet = self.GetTokenOwner()
+        minter_wallet = self.GetOwner2()
+        token = self.nep5_token_from_contract(TestSwapBase.nex_contract)
+
+        eth = EthLedger()
+        amount = Fixed8.FromDecimal(500).value
+
+        balance_before = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+
+        latencies = {'swapToEth': [], 'mint': [], 'burn': [], 'swapFromEth': []}
+
+        started = time.perf_counter()
+
+        for i in range(ROUND_TRIPS):
+
+            t0 = time.perf_counter()
+            swap_id, eth_addr, swapped = self.swap_to_eth(user_wallet, amount)
+            t1 = time.perf_counter()
+            eth.mint(swap_id, eth_addr, swapped)
+            t2 = time.perf_counter()
+            burn = eth.burn(eth_addr, self.token_owner_sh(), swapped)
+            t3 = time.perf_counter()
+            self.swap_from_eth(minter_wallet, burn)
+            t4 = time.perf_counter()
+
+            latencies['swapToEth'].append(t1 - t0)
+            latencies['mint'].append(t2 - t1)
+            latencies['burn'].append(t3 - t2)
+            latencies['swapFromEth'].append(t4 - t3)
+
+        elapsed = time.perf_counter() - started
+
+        logger.info("%s round trips in %.2fs, %.2f swaps/s" % (ROUND_TRIPS, elapsed, ROUND_TRIPS / elapsed))
+        for leg, values in latencies.items():
+            logger.info("%-12s mean %8.2fms  max %8.2fms" % (leg, statistics.mean(values) * 1000, max(values) * 1000))
+
+        # everything that went to eth came back
+        self.assertEqual(eth.total_supply, 0)
+        self.assertEqual(len(eth.mints), ROUND_TRIPS)
+
+        balance_after = int(token.GetBalance(user_wallet, self.token_owner_addr()))
+        self.assertEqual(balance_after, balance_before)
+
+        tx, results = self.invoke_test(user_wallet, 'totalSwapped', [], contract=TestSwapBase.swap_contract.ToString())
+        self.assertEqual(results[0].GetBigInteger(), 0)
@@ -0,0 +1,516 @@
+"""
+NexSwap event backfill
+===================================
+
+Fills a SwapIndex with all swaps since the deployment of the swap
+contract, without replaying the chain block by block.
+
+NEO does not store the notifications of the swap contract, and executing
+old blocks again needs the contract state at their height, so the events
+are rebuilt from the invocations of the swap contract, decoded from the
+transactions, and the NEP5 transfers that neo-python's NotificationDB
+stores. NotificationDB only keeps the notifications of transactions that
+HALTed, so the NEX transfer of a swap confirms it, and the order of the
+transfers in a block is the order in which the swaps were executed. Only
+transfers of the NEX token count, a transfer of another token between
+the same addresses confirms nothing:
+
+- onSwapToEth: confirmed swapToEth and swapToEthBatch invocations get
+  their swap ids from the swap counter, in execution order. Where the
+  contract storage has a record of the swap (see getSwap) it is used to
+  check the swap id, and records of swaps whose invocation could not be
+  decoded are added without a transaction hash.
+- onSwapFromEth: swapFromEth and swapFromEthBatch items whose transfer
+  is confirmed and whose swap id is marked as processed.
+
+LevelDB only allows a single process to open a database, so the chain is
+read once, keeping only the transactions that mention the swap contract,
+and worker processes decode them in ranges of block heights.
+
+Usage:
+
+    python -m tools.backfill --chain ./Chains/SC234 --notifications ./Chains/SC234_notif --db swaps.db <swap contract hash>
+
+"""
+import argparse
+import binascii
+import bisect
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import plyvel
+from logzero import logger
+from neocore.BigInteger import BigInteger
+from neocore.IO.BinaryReader import BinaryReader
+from neocore.UInt160 import UInt160
+
+from neo.Core.State.StorageItem import StorageItem
+from neo.Core.TX.InvocationTransaction import InvocationTransaction
+from neo.Core.TX.Transaction import Transaction
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from neo.IO.MemoryStream import StreamManager
+from neo.SmartContract.SmartContractEvent import (NotifyType,
+                                                  SmartContractEvent)
+from neo.VM.InteropService import StackItem
+from tools.indexer import (NEX_SCRIPT_HASH, SWAP_FROM_ETH, SWAP_TO_ETH,
+                           SwapEvent, SwapIndex)
+
+# Storage keys of NexSwap.py
+SWAP_RECORD_PREFIX = b'swapRecord'
+SWAPID_PAGE_PREFIX = b'swapIdPage'
+SWAPID_PREFIX = b'swapId'
+SWAPID_PAGE_SIZE = 128
+
+PUSH0 = 0x00
+PUSHDATA1 = 0x4C
+PUSHDATA2 = 0x4D
+PUSHDATA4 = 0x4E
+PUSHM1 = 0x4F
+PUSH1 = 0x51
+PUSH16 = 0x60
+NOP = 0x61
+APPCALL = 0x67
+TAILCALL = 0x69
+PACK = 0xC1
+
+# Height ranges per worker process, so a range with many swaps doesn't keep the others waiting
+RANGES_PER_WORKER = 4
+
+# Prefix of the per block notifications of neo-python's NotificationDB,
+# followed by the height and the position in the block
+NOTIFICATION_BLOCK_PREFIX = b'\xCC'
+
+SwapToEthCall = namedtuple('SwapToEthCall', ['tx_hash', 'block', 'addr', 'legs'])
+Transfer = namedtuple('Transfer', ['addr_from', 'addr_to', 'amount', 'position'])
+
+
+def to_int(value):
+    if isinstance(value, int):
+        return value
+    return int(BigInteger.FromBytes(value, signed=True))
+
+
+def decode_invocations(script, contract_hash):
+    """
+    Decodes the calls to a contract in an invocation script, as far as
+    they only push constants, which is how wallets build invocations
+
+    :param script: bytes: the invocation script
+    :param contract_hash: bytes: the 20 byte script hash of the contract
+    :return: list: a list of (operation, args) tuples
+    """
+    invocations = []
+    stack = []
+    i = 0
+
+    while i < len(script):
+        op = script[i]
+        i += 1
+
+        if op == PUSH0:
+            stack.append(b'')
+        elif op < PUSHDATA1:
+            stack.append(script[i:i + op])
+            i += op
+        elif op in (PUSHDATA1, PUSHDATA2, PUSHDATA4):
+            size_length = {PUSHDATA1: 1, PUSHDATA2: 2, PUSHDATA4: 4}[op]
+            size = int.from_bytes(script[i:i + size_length], 'little')
+            i += size_length
+            stack.append(script[i:i + size])
+            i += size
+        elif op == PUSHM1:
+            stack.append(-1)
+        elif PUSH1 <= op <= PUSH16:
+            stack.append(op - PUSH1 + 1)
+        elif op == NOP:
+            pass
+        elif op == PACK:
+            count = to_int(stack.pop())
+            items = [stack.pop() for _ in range(count)]
+            stack.append(items)
+        elif op in (APPCALL, TAILCALL):
+            called = script[i:i + 20]
+            i += 20
+            if called == contract_hash and len(stack) >= 2:
+                operation = stack.pop()
+                args = stack.pop()
+                if isinstance(operation, bytes) and isinstance(args, list):
+                    invocations.append((operation.decode('utf-8', errors='replace'), args))
+            stack = []
+        else:
+            # anything else can't be decoded without executing the script
+            stack = []
+
+    return invocations
+
+
+def decode_swaps_from_eth(args, operation):
+
+    if operation == 'swapFromEth' and len(args) == 4:
+        return [args]
+
+    if operation == 'swapFromEthBatch':
+        return [swap for swap in args if isinstance(swap, list) and len(swap) == 4]
+
+    return []
+
+
+def decode_swaps_to_eth(args, operation):
+    """
+    :return: list: (addr, list of (ethAddr, amount) legs) tuples
+    """
+    if operation == 'swapToEth' and len(args) == 3:
+        return [(args[0], [(args[1], args[2])])]
+
+    if operation == 'swapToEthBatch' and len(args) == 2 and isinstance(args[1], list):
+        legs = [tuple(leg) for leg in args[1] if isinstance(leg, list) and len(leg) == 2]
+        if len(legs) == len(args[1]):
+            return [(args[0], legs)]
+
+    return []
+
+
+def decode_transaction(tx, height, contract_hash, calls, candidates):
+    """
+    Decodes the swaps of a transaction that calls the swap contract
+
+    :param tx: Transaction
+    :param height: int: the height of the block of the transaction
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :param calls: list: the SwapToEthCall of the transaction are added to it
+    :param candidates: list: the SwapEvent candidates of swaps from eth are added to it
+    """
+    if not isinstance(tx, InvocationTransaction):
+        return
+
+    tx_hash = tx.Hash.ToString()
+
+    for operation, args in decode_invocations(bytes(tx.Script), contract_hash):
+        try:
+            for addr, legs in decode_swaps_to_eth(args, operation):
+                calls.append(SwapToEthCall(tx_hash=tx_hash, block=height, addr=bytes(addr),
+                                           legs=[(bytes(eth_addr), to_int(amount)) for eth_addr, amount in legs]))
+
+            for addr, eth_addr, amount, swap_id in decode_swaps_from_eth(args, operation):
+                candidates.append(SwapEvent(event=SWAP_FROM_ETH, swap_id=to_int(swap_id), addr=bytes(addr),
+                                            eth_addr=bytes(eth_addr), amount=to_int(amount), block=height, tx_hash=tx_hash))
+        except (TypeError, ValueError):
+            continue
+
+
+def height_ranges(start_height, end_height, count):
+    """
+    :param count: int: the number of ranges to split the heights into
+    :return: list: (first height, last height) tuples, in height order
+    """
+    size = max(1, -(-(end_height - start_height + 1) // count))
+    return [(start, min(start + size - 1, end_height)) for start in range(start_height, end_height + 1, size)]
+
+
+def read_transactions(db, contract_hash, ranges):
+    """
+    Reads the stored transactions that mention the swap contract, without decoding them
+
+    :param db: plyvel.DB: the LevelDB chain
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :param ranges: list: (first height, last height) tuples, in height order, see height_ranges
+    :return: list: the stored transactions in each range
+    """
+    needle = binascii.hexlify(contract_hash)
+    starts = [start for start, stop in ranges]
+    transactions = [[] for _ in ranges]
+
+    if not ranges:
+        return transactions
+
+    for key, value in db.iterator(prefix=DBPrefix.DATA_Transaction):
+        height = int.from_bytes(value[:4], 'little')
+        if height < ranges[0][0] or height > ranges[-1][1] or needle not in value:
+            continue
+
+        transactions[bisect.bisect_right(starts, height) - 1].append(value)
+
+    return transactions
+
+
+def decode_transactions(transactions, contract_hash):
+    """
+    Decodes the swaps of stored transactions, runs in a worker process
+
+    :param transactions: list: stored transactions, the height followed by the transaction as hex
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :return: tuple: a list of SwapToEthCall and a list of SwapEvent candidates of swaps from eth
+    """
+    calls = []
+    candidates = []
+
+    for value in sorted(transactions, key=lambda value: int.from_bytes(value[:4], 'little')):
+        height = int.from_bytes(value[:4], 'little')
+        decode_transaction(Transaction.DeserializeFromBufer(binascii.unhexlify(value[4:])), height, contract_hash, calls, candidates)
+
+    return calls, candidates
+
+
+def scan_blocks(blockchain, contract_hash, start_height, end_height):
+    """
+    Decodes the swaps of the transactions in a few blocks, which is cheaper
+    than scanning all transactions when only a few blocks are missing
+
+    :param blockchain: Blockchain
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :return: tuple: a list of SwapToEthCall and a list of SwapEvent candidates of swaps from eth
+    """
+    calls = []
+    candidates = []
+
+    for height in range(start_height, end_height + 1):
+        block = blockchain.GetBlockByHeight(height)
+        if block is None:
+            raise Exception("Block %s is not in the chain" % height)
+
+        for tx in block.FullTransactions:
+            decode_transaction(tx, height, contract_hash, calls, candidates)
+
+    return calls, candidates
+
+
+def read_transfers(notification_db, heights, token_hash):
+    """
+    Reads the transfers of a NEP5 token that neo-python's NotificationDB stored for some blocks.
+    It only stores the notifications of transactions that HALTed
+
+    :param notification_db: plyvel.DB: the NotificationDB
+    :param heights: iterable of int: the heights to read
+    :param token_hash: bytes: the 20 byte script hash of the token, transfers of other tokens are skipped
+    :return: dict: the list of Transfer of each transaction hash
+    """
+    transfers = {}
+
+    for height in sorted(set(heights)):
+        prefix = NOTIFICATION_BLOCK_PREFIX + height.to_bytes(4, 'little')
+
+        # the position in the block is little endian, so the keys are not in block order
+        notifications = sorted(notification_db.iterator(prefix=prefix), key=lambda item: int.from_bytes(item[0][-4:], 'little'))
+
+        for position, (key, value) in enumerate(notifications):
+            notification = SmartContractEvent.FromByteArray(value)
+            if notification.notify_type != NotifyType.TRANSFER or bytes(notification.contract_hash.Data) != token_hash:
+                continue
+
+            transfer = Transfer(addr_from=bytes(notification.addr_from.Data), addr_to=bytes(notification.addr_to.Data),
+                                amount=notification.amount, position=(height, position))
+            transfers.setdefault(notification.tx_hash.ToString(), []).append(transfer)
+
+    return transfers
+
+
+def take_transfer(transfers, addr_from, addr_to, amount):
+    """
+    Finds a transfer and removes it, so that it only confirms one swap
+
+    :param transfers: list of Transfer of a transaction, of the NEX token only, see read_transfers
+    :return: Transfer or None
+    """
+    for transfer in transfers:
+        if transfer.addr_from == addr_from and transfer.addr_to == addr_to and transfer.amount == amount:
+            transfers.remove(transfer)
+            return transfer
+    return None
+
+
+class SwapStorage:
+    """
+    The parts of the swap contract storage needed to rebuild swap events
+    """
+
+    def __init__(self, db, contract_hash: UInt160):
+        self.records = {}
+        self.pages = {}
+        self.legacy_swap_ids = set()
+
+        prefix = DBPrefix.ST_Storage + bytes(contract_hash.Data)
+
+        for key, value in db.iterator(prefix=prefix):
+            key = key[len(prefix):]
+            value = StorageItem.DeserializeFromDB(binascii.unhexlify(value)).Value
+
+            if key.startswith(SWAP_RECORD_PREFIX):
+                self.records[to_int(key[len(SWAP_RECORD_PREFIX):])] = value
+            elif key.startswith(SWAPID_PAGE_PREFIX):
+                self.pages[to_int(key[len(SWAPID_PAGE_PREFIX):])] = to_int(value)
+            elif key.startswith(SWAPID_PREFIX) and to_int(value) > 0:
+                self.legacy_swap_ids.add(to_int(key[len(SWAPID_PREFIX):]))
+
+    def is_processed(self, swap_id):
+        page = self.pages.get(swap_id // SWAPID_PAGE_SIZE, 0)
+        if page & (1 << (swap_id % SWAPID_PAGE_SIZE)):
+            return True
+        return swap_id in self.legacy_swap_ids
+
+    def swap_record(self, swap_id):
+        """
+        :return: SwapEvent: the swap to eth of a swap record without a transaction hash, or None if there is no record
+        """
+        record = self.records.get(swap_id)
+        if record is None:
+            return None
+
+        reader = BinaryReader(StreamManager.GetStream(data=record))
+        addr, eth_addr, amount, height = StackItem.DeserializeStackItem(reader).GetArray()
+
+        return SwapEvent(event=SWAP_TO_ETH, swap_id=swap_id, addr=bytes(addr.GetByteArray()),
+                         eth_addr=bytes(eth_addr.GetByteArray()), amount=int(amount.GetBigInteger()),
+                         block=int(height.GetBigInteger()), tx_hash=None)
+
+
+def chain_height(db):
+    """
+    :param db: plyvel.DB: the LevelDB chain
+    :return: int: the height of the last persisted block
+    """
+    current = db.get(DBPrefix.SYS_CurrentBlock)
+    return int.from_bytes(current[-4:], 'little')
+
+
+def rebuild_swap_events(storage: SwapStorage, transfers, contract_hash, calls, candidates, start_height, end_height, first_swap_id):
+    """
+    Rebuilds the swap events from the decoded invocations and the transfers that confirm them
+
+    :param transfers: dict: the list of Transfer of each transaction hash, see read_transfers
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :param calls: list of SwapToEthCall
+    :param candidates: list of SwapEvent candidates of swaps from eth
+    :param first_swap_id: int: the swap id of the first swap to eth at or after start_height
+    :return: list: the swap events, in swap id order
+    """
+    confirmed = []
+    for call in calls:
+        total = sum(amount for eth_addr, amount in call.legs)
+        transfer = take_transfer(transfers.get(call.tx_hash, []), call.addr, contract_hash, total)
+        if transfer:
+            confirmed.append((transfer.position, call))
+
+    swaps_to_eth = {}
+    swap_id = first_swap_id
+    for position, call in sorted(confirmed, key=lambda item: item[0]):
+        for eth_addr, amount in call.legs:
+            swap_event = SwapEvent(event=SWAP_TO_ETH, swap_id=swap_id, addr=call.addr, eth_addr=eth_addr,
+                                   amount=amount, block=call.block, tx_hash=call.tx_hash)
+
+            record = storage.swap_record(swap_id)
+            if record and (record.addr, record.eth_addr, record.amount) != (call.addr, eth_addr, amount):
+                logger.warning("Swap %s of %s does not match its swap record, a swap before it was not decoded" % (swap_id, call.tx_hash))
+                swap_event = record
+
+            swaps_to_eth[swap_id] = swap_event
+            swap_id += 1
+
+    # swaps whose invocation could not be decoded, but that have a record
+    for swap_id in storage.records:
+        if swap_id not in swaps_to_eth:
+            record = storage.swap_record(swap_id)
+            if start_height <= record.block <= end_height:
+                swaps_to_eth[swap_id] = record
+
+    swaps_from_eth = {}
+    for candidate in sorted(candidates, key=lambda evt: evt.block):
+        if candidate.swap_id in swaps_from_eth or not storage.is_processed(candidate.swap_id):
+            continue
+        if take_transfer(transfers.get(candidate.tx_hash, []), contract_hash, candidate.addr, candidate.amount):
+            swaps_from_eth[candidate.swap_id] = candidate
+
+    swap_events = list(swaps_to_eth.values()) + list(swaps_from_eth.values())
+    swap_events.sort(key=lambda evt: (evt.swap_id, evt.event))
+    return swap_events
+
+
+def scan_parallel(db, contract_hash, start_height, end_height, workers):
+    """
+    Decodes the swaps of the transactions between two heights in worker processes
+
+    :param db: plyvel.DB: the LevelDB chain
+    :param contract_hash: bytes: the 20 byte script hash of the swap contract
+    :param workers: int: number of worker processes
+    :return: tuple: a list of SwapToEthCall and a list of SwapEvent candidates of swaps from eth, in height order
+    """
+    ranges = height_ranges(start_height, end_height, workers * RANGES_PER_WORKER)
+    transactions = read_transactions(db, contract_hash, ranges)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(decode_transactions, transactions, [contract_hash] * len(transactions)))
+
+    calls = [call for result in results for call in result[0]]
+    candidates = [candidate for result in results for candidate in result[1]]
+    return calls, candidates
+
+
+def backfill(chain_path, notifications_path, contract_hash: UInt160, index: SwapIndex, end_height, start_height=0, workers=None,
+             token_hash: UInt160 = NEX_SCRIPT_HASH):
+    """
+    Rebuilds the swap events between two heights and writes them to the index
+
+    :param chain_path: str: path of the LevelDB chain, it may not be opened by another process
+    :param notifications_path: str: path of the NotificationDB of the chain
+    :param contract_hash: UInt160: script hash of the swap contract
+    :param index: SwapIndex
+    :param end_height: int: the last height to backfill, the index checkpoint is moved there
+    :param start_height: int: the first height to backfill, the swaps to eth before it need to be in the index already
+    :param workers: int: number of worker processes, defaults to the number of cores
+    :param token_hash: UInt160: script hash of the NEX token whose transfers confirm swaps
+    :return: list: the swap events written to the index, in swap id order
+    """
+    contract_data = bytes(contract_hash.Data)
+
+    db = plyvel.DB(chain_path, create_if_missing=False)
+    try:
+        storage = SwapStorage(db, contract_hash)
+        calls, candidates = scan_parallel(db, contract_data, start_height, end_height, workers or os.cpu_count())
+    finally:
+        db.close()
+
+    logger.info("Decoded %s swaps to eth and %s swaps from eth" % (len(calls), len(candidates)))
+
+    notification_db = plyvel.DB(notifications_path, create_if_missing=False)
+    try:
+        transfers = read_transfers(notification_db, [call.block for call in calls] + [candidate.block for candidate in candidates],
+                                   bytes(token_hash.Data))
+    finally:
+        notification_db.close()
+
+    first_swap_id = 1 if start_height == 0 else index.last_swap_id(SWAP_TO_ETH) + 1
+    swap_events = rebuild_swap_events(storage, transfers, contract_data, calls, candidates, start_height, end_height, first_swap_id)
+
+    index.commit_block(max(end_height, index.checkpoint), swap_events)
+
+    return swap_events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("contract", help="Script hash of the swap contract")
+    parser.add_argument("--chain", action="store", required=True, help="Path of the LevelDB chain")
+    parser.add_argument("--notifications", action="store", required=True, help="Path of the NotificationDB of the chain")
+    parser.add_argument("--db", action="store", default="swaps.db", help="Path of the SQLite index")
+    parser.add_argument("--start", action="store", type=int, default=0, help="First height to backfill")
+    parser.add_argument("--end", action="store", type=int, help="Last height to backfill, defaults to the chain height")
+    parser.add_argument("--workers", action="store", type=int, help="Number of worker processes")
+    parser.add_argument("--token", action="store", default=NEX_SCRIPT_HASH.ToString(), help="Script hash of the NEX token")
+    args = parser.parse_args()
+
+    end_height = args.end
+    if end_height is None:
+        db = plyvel.DB(args.chain, create_if_missing=False)
+        end_height = chain_height(db)
+        db.close()
+
+    index = SwapIndex(args.db)
+    swap_events = backfill(args.chain, args.notifications, UInt160.ParseString(args.contract), index, end_height,
+                           start_height=args.start, workers=args.workers, token_hash=UInt160.ParseString(args.token))
+    index.close()
+
+    logger.info("Backfilled %s swaps up to block %s" % (len(swap_events), end_height))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+NexSwap compile cache
+===================================
+
+Compiling a contract with neo-boa takes a while, so the .avm and
+.debug.json output is cached, keyed by a sha256 of the compiler version,
+the contract source and the sources of the local modules it imports
+(e.g. nash/owner.py for NexSwap.py). Any change to one of those gives a
+new key, and every cache entry stores the sha256 of its .avm, so a
+damaged entry is compiled again as well.
+
+Usage:
+
+    python -m tools.compile_cache NexSwap.py
+
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+from uuid import uuid4
+
+import boa
+from boa.compiler import Compiler
+
+DEFAULT_CACHE_DIR = '.compile_cache'
+
+MANIFEST = 'manifest.json'
+
+
+def imported_sources(path, root, found=None):
+    """
+    The contract source and the local modules it imports, recursively
+
+    :param path: str: path of a python source
+    :param root: str: directory imports are resolved against
+    :return: list: paths of the sources, the contract first
+    """
+    if found is None:
+        found = []
+
+    path = os.path.abspath(path)
+    if path in found:
+        return found
+    found.append(path)
+
+    with open(path, 'rb') as handle:
+        tree = ast.parse(handle.read(), filename=path)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            modules = [node.module]
+        elif isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        else:
+            continue
+
+        for module in modules:
+            module_path = os.path.join(root, *module.split('.'))
+            for candidate in ['%s.py' % module_path, os.path.join(module_path, '__init__.py')]:
+                if os.path.isfile(candidate):
+                    imported_sources(candidate, root, found)
+
+    return found
+
+
+def contract_hash(path):
+    """
+    :param path: str: path of the contract source
+    :return: str: the cache key of the contract
+    """
+    root = os.path.dirname(os.path.abspath(path))
+    sha256 = hashlib.sha256(('neo-boa %s\n' % boa.__version__).encode('utf-8'))
+
+    for source in sorted(imported_sources(path, root)):
+        with open(source, 'rb') as handle:
+            content = handle.read()
+        sha256.update(('%s %s\n' % (os.path.relpath(source, root), len(content))).encode('utf-8'))
+        sha256.update(content)
+
+    return sha256.hexdigest()
+
+
+def file_hash(path):
+    with open(path, 'rb') as handle:
+        return hashlib.sha256(handle.read()).hexdigest()
+
+
+def cached_entry(entry_path, name):
+    """
+    :return: bool: whether the cache entry is complete and its .avm unchanged
+    """
+    try:
+        with open(os.path.join(entry_path, MANIFEST)) as handle:
+            manifest = json.load(handle)
+        return manifest['avm_sha256'] == file_hash(os.path.join(entry_path, '%s.avm' % name)) and \
+            os.path.isfile(os.path.join(entry_path, '%s.debug.json' % name))
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def compile_contract(path, output_path=None, cache_dir=None):
+    """
+    Compiles a contract, or copies the output of an earlier compile from the cache
+
+    :param path: str: path of the contract source
+    :param output_path: str: path of the .avm, defaults to the source path with .avm
+    :param cache_dir: str: defaults to DEFAULT_CACHE_DIR next to the source
+    :return: str: the output path
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    root = os.path.dirname(os.path.abspath(path))
+
+    if output_path is None:
+        output_path = os.path.join(root, '%s.avm' % name)
+    if cache_dir is None:
+        cache_dir = os.path.join(root, DEFAULT_CACHE_DIR)
+
+    # boa derives the .debug.json path by replacing '.avm' anywhere in the path
+    if '.avm' in os.path.abspath(cache_dir):
+        raise ValueError("The cache path may not contain '.avm'")
+
+    key = contract_hash(path)
+    entry_path = os.path.join(cache_dir, key)
+
+    if not cached_entry(entry_path, name):
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+        # compile next to the entry and rename, so an entry is never seen half written
+        build_path = '%s.%s' % (entry_path, uuid4().hex)
+        os.makedirs(build_path)
+
+        avm_path = os.path.join(build_path, '%s.avm' % name)
+        Compiler.instance().load_and_save(path, output_path=avm_path)
+
+        with open(os.path.join(build_path, MANIFEST), 'w') as handle:
+            json.dump({
+                'compiler': 'neo-boa %s' % boa.__version__,
+                'sources': [os.path.relpath(source, root) for source in imported_sources(path, root)],
+                'avm_sha256': file_hash(avm_path),
+            }, handle, indent=4)
+
+        try:
+            os.rename(build_path, entry_path)
+        except OSError:
+            # compiled by another process in the meantime
+            shutil.rmtree(build_path, ignore_errors=True)
+
+    shutil.copyfile(os.path.join(entry_path, '%s.avm' % name), output_path)
+    shutil.copyfile(os.path.join(entry_path, '%s.debug.json' % name), '%s.debug.json' % os.path.splitext(output_path)[0])
+
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("contract", help="Path of the contract source")
+    parser.add_argument("--output", action="store", help="Path of the .avm, defaults to the source path with .avm")
+    parser.add_argument("--cache-dir", action="store", help="Defaults to %s next to the source" % DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    print(compile_contract(args.contract, args.output, args.cache_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+NexSwap replay key import
+===================================
+
+Imports replay keys of swaps to eth, like the ones in the migration
+directory, with the importReplayKeys operation of the swap contract.
+
+A key file has one replay key per line, hex encoded: the 32 byte tx hash
+followed by the 20 byte addr, as written by swapToEth. The file is read
+as a stream and split into chunks that fit in a single transaction.
+
+Chunks are sent one at a time, each after the previous one is confirmed.
+A chunk is confirmed once its transaction is in a block and every key of
+the chunk can be read back from the contract storage. A key may have been
+set before, e.g. by a chunk of an earlier import, so no single key tells
+whether the transaction was applied. A transaction that is in a block
+while keys of its chunk are missing FAULTed, and the chunk is sent again.
+The progress is written to a JSON file next to the key file, so after a
+restart the import resumes with the first chunk that is not confirmed yet.
+Sending a chunk twice is harmless, as the contract skips keys that are
+already set.
+
+importReplayKeys needs the witnesses of ADMINS_REQUIRED owners, so the
+wallets of that many owners have to be given. The first wallet pays the
+fees, which are about 1 GAS per key.
+
+Usage:
+
+    python -m tools.import_replay_keys --mainnet --wallet owner1.wallet --wallet owner2.wallet \\
+        --wallet owner3.wallet <swap contract hash> migration/new_930_a.txt
+
+"""
+import argparse
+import json
+import os
+
+from logzero import logger
+
+from neo.Core.Blockchain import Blockchain
+from neo.Core.State.StorageKey import StorageKey
+from neo.Core.TX.TransactionAttribute import (TransactionAttribute,
+                                              TransactionAttributeUsage)
+from neo.Implementations.Wallets.peewee.UserWallet import UserWallet
+from neo.Network.NodeLeader import NodeLeader
+from neo.Prompt.Commands.Invoke import (TestInvokeContract,
+                                        make_unique_script_attr)
+from neo.SmartContract.ContractParameterContext import \
+    ContractParametersContext
+
+REPLAY_KEY_LENGTH = 52
+
+# Maximum size of a transaction accepted by the network
+MAX_TX_SIZE = 102400
+
+# Room for the inputs, attributes and witnesses of the owners
+TX_SIZE_MARGIN = 4096
+
+MAX_KEYS_PER_CHUNK = (MAX_TX_SIZE - TX_SIZE_MARGIN) // REPLAY_KEY_LENGTH
+
+# A chunk that is not in a block after this many blocks is sent again
+RESEND_AFTER_BLOCKS = 5
+
+
+def read_replay_keys(path):
+    """
+    Reads a key file line by line
+
+    :param path: str: path of the key file
+    :return: generator of the 52 byte replay keys
+    """
+    with open(path, 'r') as handle:
+        for number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                key = bytes.fromhex(line)
+            except ValueError:
+                raise ValueError("Invalid hex on line %s of %s" % (number, path))
+
+            if len(key) != REPLAY_KEY_LENGTH:
+                raise ValueError("Invalid replay key length on line %s of %s" % (number, path))
+
+            yield key
+
+
+def chunk_replay_keys(keys, chunk_size=MAX_KEYS_PER_CHUNK):
+    """
+    :param keys: iterable of replay keys
+    :param chunk_size: int: maximum number of keys per chunk
+    :return: generator of the concatenated keys of each chunk
+    """
+    chunk = []
+    for key in keys:
+        chunk.append(key)
+        if len(chunk) == chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+
+    if chunk:
+        yield b''.join(chunk)
+
+
+class ImportProgress:
+    """
+    The number of chunks that are confirmed, and the transaction
+    of the chunk that was sent last, stored as JSON
+    """
+
+    def __init__(self, path, chunk_size):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.confirmed = 0
+        self.pending_tx = None
+
+        if os.path.exists(path):
+            with open(path, 'r') as handle:
+                progress = json.load(handle)
+
+            if progress['chunk_size'] != chunk_size:
+                raise Exception("%s was written with a chunk size of %s" % (path, progress['chunk_size']))
+
+            self.confirmed = progress['confirmed']
+            self.pending_tx = progress['pending_tx']
+
+    def save(self):
+        progress = {
+            'chunk_size': self.chunk_size,
+            'confirmed': self.confirmed,
+            'pending_tx': self.pending_tx,
+        }
+
+        temp_path = '%s.tmp' % self.path
+        with open(temp_path, 'w') as handle:
+            json.dump(progress, handle, indent=4)
+        os.replace(temp_path, self.path)
+
+    def sent(self, tx_hash):
+        self.pending_tx = tx_hash
+        self.save()
+
+    def confirm(self):
+        self.confirmed += 1
+        self.pending_tx = None
+        self.save()
+
+
+class ReplayKeyImporter:
+    """
+    Sends the chunks of a key file one by one. step() is called
+    periodically while the node is running
+    """
+
+    def __init__(self, contract_hash, wallets, chunks, progress: ImportProgress):
+        """
+        :param contract_hash: UInt160: script hash of the swap contract
+        :param wallets: list: the owner wallets, the first one pays the fees
+        :param chunks: iterable of the concatenated keys of each chunk
+        :param progress: ImportProgress
+        """
+        self.contract_hash = contract_hash
+        self.wallets = wallets
+        self.owners = [wallet.GetDefaultContract().ScriptHash for wallet in wallets]
+        self.chunks = iter(chunks)
+        self.progress = progress
+        self.done = False
+        self.sent_height = None
+
+        # skip the chunks that are confirmed already
+        for i in range(progress.confirmed):
+            next(self.chunks, None)
+
+        self.chunk = next(self.chunks, None)
+
+    def step(self):
+
+        if self.done:
+            return
+
+        if self.progress.pending_tx:
+            tx, height = Blockchain.Default().GetTransaction(self.progress.pending_tx)
+            if tx is None:
+                current_height = Blockchain.Default().Height
+                if self.sent_height is None:
+                    self.sent_height = current_height
+                if current_height - self.sent_height < RESEND_AFTER_BLOCKS:
+                    return
+                logger.warning("Chunk %s is not in a block, sending it again" % self.progress.confirmed)
+            elif not self.is_imported(self.chunk):
+                logger.warning("Chunk %s is in block %s but its keys are not set, the transaction failed, sending it again"
+                               % (self.progress.confirmed, height))
+            else:
+                logger.info("Chunk %s is in block %s" % (self.progress.confirmed, height))
+                self.progress.confirm()
+                self.chunk = next(self.chunks, None)
+
+        if self.chunk is None:
+            logger.info("Imported %s chunks" % self.progress.confirmed)
+            self.done = True
+            return
+
+        tx = self.send_chunk(self.chunk)
+        if tx:
+            logger.info("Sent chunk %s in %s" % (self.progress.confirmed, tx.Hash.ToString()))
+            self.sent_height = Blockchain.Default().Height
+            self.progress.sent(tx.Hash.ToString())
+
+    def is_imported(self, chunk):
+        """
+        Reads every key of a chunk back from the contract storage
+
+        :param chunk: the concatenated keys of the chunk
+        :return: bool: whether all keys of the chunk are set
+        """
+        blockchain = Blockchain.Default()
+        for start in range(0, len(chunk), REPLAY_KEY_LENGTH):
+            key = chunk[start:start + REPLAY_KEY_LENGTH]
+            item = blockchain.GetStorageItem(StorageKey(script_hash=self.contract_hash, key=key))
+            if item is None or len(item.Value) == 0:
+                return False
+
+        return True
+
+    def send_chunk(self, chunk):
+        payer = self.wallets[0]
+
+        tx, fee, results, num_ops = TestInvokeContract(payer, [self.contract_hash.ToString(), 'importReplayKeys', [bytearray(chunk)]],
+                                                       owners=self.owners)
+        if not tx or not results:
+            raise Exception("Could not test importReplayKeys")
+
+        wallet_tx = payer.MakeTransaction(tx=tx, fee=fee, use_standard=True)
+
+        for owner in self.owners:
+            wallet_tx.Attributes.append(TransactionAttribute(usage=TransactionAttributeUsage.Script, data=owner))
+        wallet_tx.Attributes = make_unique_script_attr(wallet_tx.Attributes)
+
+        context = ContractParametersContext(wallet_tx)
+        for wallet in self.wallets:
+            wallet.Sign(context)
+
+        if not context.Completed:
+            raise Exception("Could not sign chunk with the given wallets")
+
+        wallet_tx.scripts = context.GetScripts()
+
+        if NodeLeader.Instance().Relay(wallet_tx):
+            payer.SaveTransaction(wallet_tx)
+            return wallet_tx
+
+        logger.warning("Could not relay %s, retrying" % wallet_tx.Hash.ToString())
+        return None
+
+
+def main():
+    from getpass import getpass
+
+    from neocore.UInt160 import UInt160
+    from twisted.internet import reactor, task
+
+    from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import \
+        LevelDBBlockchain
+    from neo.Settings import settings
+    from neo.Wallets.utils import to_aes_key
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("contract", help="Script hash of the swap contract")
+    parser.add_argument("keys", help="Path of the key file")
+    parser.add_argument("--wallet", action="append", required=True, help="Path of an owner wallet, the first one pays the fees")
+    parser.add_argument("--chunk-size", action="store", type=int, default=MAX_KEYS_PER_CHUNK, help="Keys per transaction")
+    parser.add_argument("--progress", action="store", help="Path of the progress file, defaults to <keys>.progress.json")
+    group_network = parser.add_mutually_exclusive_group()
+    group_network.add_argument("--mainnet", action="store_true", default=False, help="Use MainNet")
+    group_network.add_argument("--testnet", action="store_true", default=False, help="Use TestNet")
+    group_network.add_argument("--config", action="store", help="Use a specific config file")
+    args = parser.parse_args()
+
+    if args.chunk_size < 1 or args.chunk_size > MAX_KEYS_PER_CHUNK:
+        parser.error("The chunk size has to be between 1 and %s" % MAX_KEYS_PER_CHUNK)
+
+    if args.config:
+        settings.setup(args.config)
+    elif args.mainnet:
+        settings.setup_mainnet()
+    elif args.testnet:
+        settings.setup_testnet()
+
+    # validate the whole file before sending anything
+    total = sum(1 for key in read_replay_keys(args.keys))
+    logger.info("Importing %s replay keys in chunks of %s" % (total, args.chunk_size))
+
+    wallets = [UserWallet.Open(path, to_aes_key(getpass("Password for %s: " % path))) for path in args.wallet]
+
+    blockchain = LevelDBBlockchain(settings.chain_leveldb_path)
+    Blockchain.RegisterBlockchain(blockchain)
+
+    progress = ImportProgress(args.progress or '%s.progress.json' % args.keys, args.chunk_size)
+    importer = ReplayKeyImporter(UInt160.ParseString(args.contract), wallets,
+                                 chunk_replay_keys(read_replay_keys(args.keys), args.chunk_size), progress)
+
+    dbloop = task.LoopingCall(Blockchain.Default().PersistBlocks)
+    dbloop.start(.1)
+
+    walletloop = task.LoopingCall(wallets[0].ProcessBlocks)
+    walletloop.start(1)
+
+    def step():
+        importer.step()
+        if importer.done:
+            reactor.stop()
+
+    # only send once the node is in sync, so the fee can be paid
+    def start():
+        if Blockchain.Default().Height < Blockchain.Default().HeaderHeight or wallets[0].WalletHeight <= Blockchain.Default().Height:
+            reactor.callLater(5, start)
+            return
+        task.LoopingCall(step).start(5)
+
+    NodeLeader.Instance().Start()
+    reactor.callLater(5, start)
+    reactor.run()
+
+    for wallet in wallets:
+        wallet.Close()
+    Blockchain.Default().Dispose()
+    NodeLeader.Instance().Shutdown()
+
+
+if __name__ == "__main__":
+    main()
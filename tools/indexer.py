@@ -0,0 +1,317 @@
+"""
+NexSwap event indexer
+===================================
+
+Follows the blockchain of a neo-python node and writes the onSwapToEth
+and onSwapFromEth notifications of the swap contract to a SQLite index,
+keyed by swap id, addr and ethAddr.
+
+NEO does not persist notifications of non NEP5 events, so like the
+NotificationDB of neo-python the indexer collects them while blocks are
+persisted. The events of a block are committed together with the height
+of that block, so after a restart the indexer resumes at its checkpoint.
+
+Blocks that were persisted while the indexer was not running are replayed
+from the chain and the NotificationDB of the node, see tools/backfill.py,
+and the checkpoint never moves past a block that was not indexed.
+
+Usage:
+
+    python -m tools.indexer --mainnet --db swaps.db <swap contract hash>
+
+"""
+import argparse
+import sqlite3
+from collections import namedtuple
+
+from logzero import logger
+from neocore.BigInteger import BigInteger
+from neocore.UInt160 import UInt160
+
+from neo.Core.Blockchain import Blockchain
+from neo.EventHub import events
+from neo.SmartContract.ContractParameterType import ContractParameterType
+from neo.SmartContract.SmartContractEvent import (NotifyEvent,
+                                                  SmartContractEvent)
+
+SWAP_TO_ETH = 'onSwapToEth'
+SWAP_FROM_ETH = 'onSwapFromEth'
+
+# AppCallNex of NexSwap.py, only its transfers confirm replayed swaps
+NEX_SCRIPT_HASH = UInt160.ParseString('3A4ACD3647086E7C44398AAC0349802E6A171129')
+
+SwapEvent = namedtuple('SwapEvent', ['event', 'swap_id', 'addr', 'eth_addr', 'amount', 'block', 'tx_hash'])
+
+
+def parameter_to_int(parameter):
+    """
+    Integers in notifications are either strings or little endian byte arrays
+
+    :param parameter: ContractParameter
+    :return: int
+    """
+    if isinstance(parameter.Value, (bytes, bytearray)):
+        return int(BigInteger.FromBytes(parameter.Value))
+    return int(parameter.Value)
+
+
+def decode_swap_event(sc_event: NotifyEvent):
+    """
+    Decodes an onSwapToEth or onSwapFromEth notification
+
+    :param sc_event: NotifyEvent
+    :return: SwapEvent or None if this is not a swap notification
+    """
+    if sc_event.event_payload.Type != ContractParameterType.Array:
+        return None
+
+    payload = sc_event.event_payload.Value
+    if len(payload) != 5:
+        return None
+
+    event = payload[0].Value
+    if isinstance(event, (bytes, bytearray)):
+        event = event.decode('utf-8', errors='replace')
+
+    if event not in [SWAP_TO_ETH, SWAP_FROM_ETH]:
+        return None
+
+    tx_hash = sc_event.tx_hash.ToString() if sc_event.tx_hash else None
+
+    return SwapEvent(event=event,
+                     swap_id=parameter_to_int(payload[4]),
+                     addr=bytes(payload[1].Value),
+                     eth_addr=bytes(payload[2].Value),
+                     amount=parameter_to_int(payload[3]),
+                     block=sc_event.block_number,
+                     tx_hash=tx_hash)
+
+
+class SwapIndex:
+    """
+    SQLite index of swap events along with the height of the last indexed block
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS swaps (
+                event TEXT NOT NULL,
+                swap_id INTEGER NOT NULL,
+                addr BLOB NOT NULL,
+                eth_addr BLOB NOT NULL,
+                amount INTEGER NOT NULL,
+                block INTEGER NOT NULL,
+                tx_hash TEXT,
+                PRIMARY KEY (event, swap_id)
+            );
+            CREATE INDEX IF NOT EXISTS swaps_addr ON swaps (addr);
+            CREATE INDEX IF NOT EXISTS swaps_eth_addr ON swaps (eth_addr);
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                height INTEGER NOT NULL
+            );
+        """)
+
+    @property
+    def checkpoint(self):
+        """
+        :return: int: the height of the last indexed block, or -1 if nothing was indexed yet
+        """
+        row = self._db.execute("SELECT height FROM checkpoint WHERE id = 0").fetchone()
+        return row[0] if row else -1
+
+    def commit_block(self, height, swap_events):
+        """
+        Writes the swap events of a block and moves the checkpoint to it in one transaction
+
+        :param height: int: the height of the block
+        :param swap_events: list of SwapEvent
+        """
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO swaps VALUES (?, ?, ?, ?, ?, ?, ?)", [tuple(evt) for evt in swap_events])
+            self._db.execute("INSERT OR REPLACE INTO checkpoint VALUES (0, ?)", (height,))
+
+    def add_events(self, swap_events):
+        """
+        Writes swap events without moving the checkpoint
+
+        :param swap_events: iterable of SwapEvent
+        """
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO swaps VALUES (?, ?, ?, ?, ?, ?, ?)", [tuple(evt) for evt in swap_events])
+
+    def last_swap_id(self, event):
+        """
+        :return: int: the highest swap id of an event, or 0 if there is none
+        """
+        row = self._db.execute("SELECT MAX(swap_id) FROM swaps WHERE event = ?", (event,)).fetchone()
+        return row[0] or 0
+
+    def get_swap(self, event, swap_id):
+        row = self._db.execute("SELECT * FROM swaps WHERE event = ? AND swap_id = ?", (event, swap_id)).fetchone()
+        return SwapEvent(*row) if row else None
+
+    def get_by_addr(self, addr):
+        rows = self._db.execute("SELECT * FROM swaps WHERE addr = ? ORDER BY block, swap_id", (bytes(addr),))
+        return [SwapEvent(*row) for row in rows]
+
+    def get_by_eth_addr(self, eth_addr):
+        rows = self._db.execute("SELECT * FROM swaps WHERE eth_addr = ? ORDER BY block, swap_id", (bytes(eth_addr),))
+        return [SwapEvent(*row) for row in rows]
+
+    def close(self):
+        self._db.close()
+
+
+class SwapEventIndexer:
+    """
+    Collects the swap notifications of a contract while blocks are
+    persisted and commits them to a SwapIndex once a block is complete
+    """
+
+    def __init__(self, index: SwapIndex, contract_hash: UInt160, token_hash: UInt160 = NEX_SCRIPT_HASH):
+        self.index = index
+        self.contract_hash = contract_hash
+        self.token_hash = token_hash
+        self._events_to_write = []
+
+    def start(self):
+
+        height = Blockchain.Default().Height
+        checkpoint = self.index.checkpoint
+
+        if checkpoint > height:
+            logger.warning("Swap index is at block %s but the chain is only at %s, was the chain reset?" % (checkpoint, height))
+        elif checkpoint < height:
+            logger.info("Swap index is at block %s, replaying blocks up to %s" % (checkpoint, height))
+            self.catch_up(height)
+
+        events.on(SmartContractEvent.RUNTIME_NOTIFY, self.on_smart_contract_event)
+        Blockchain.Default().PersistCompleted.on_change += self.on_persist_completed
+
+    def catch_up(self, height):
+        """
+        Indexes the blocks after the checkpoint up to a height from the chain,
+        as their notifications were dispatched before the indexer was running
+
+        :param height: int: the last block to index
+        """
+        # tools.backfill builds on this module
+        from tools.backfill import (SwapStorage, read_transfers,
+                                    rebuild_swap_events, scan_blocks)
+        from neo.Implementations.Notifications.LevelDB.NotificationDB import \
+            NotificationDB
+
+        start_height = self.index.checkpoint + 1
+        if start_height > height:
+            return
+
+        notification_db = NotificationDB.instance()
+        if notification_db is None:
+            raise Exception("Replaying blocks needs the NotificationDB of the node")
+
+        blockchain = Blockchain.Default()
+        contract_hash = bytes(self.contract_hash.Data)
+
+        calls, candidates = scan_blocks(blockchain, contract_hash, start_height, height)
+        transfers = read_transfers(notification_db.db, [call.block for call in calls] + [candidate.block for candidate in candidates],
+                                   bytes(self.token_hash.Data))
+        storage = SwapStorage(blockchain._db, self.contract_hash)
+
+        swap_events = rebuild_swap_events(storage, transfers, contract_hash, calls, candidates, start_height, height,
+                                          self.index.last_swap_id(SWAP_TO_ETH) + 1)
+        self.index.commit_block(height, swap_events)
+
+        logger.info("Replayed blocks %s to %s, %s swaps" % (start_height, height, len(swap_events)))
+
+    def stop(self):
+        events.off(SmartContractEvent.RUNTIME_NOTIFY, self.on_smart_contract_event)
+        Blockchain.Default().PersistCompleted.on_change -= self.on_persist_completed
+
+    def on_smart_contract_event(self, sc_event: NotifyEvent):
+
+        if not isinstance(sc_event, NotifyEvent) or sc_event.test_mode or not sc_event.execution_success:
+            return
+
+        if sc_event.contract_hash != self.contract_hash:
+            return
+
+        swap_event = decode_swap_event(sc_event)
+        if swap_event:
+            self._events_to_write.append(swap_event)
+
+    def on_persist_completed(self, block):
+
+        checkpoint = self.index.checkpoint
+
+        # Blocks persisted before the indexer caught up are skipped
+        if block.Index <= checkpoint:
+            self._events_to_write = []
+            return
+
+        if block.Index > checkpoint + 1:
+            try:
+                self.catch_up(block.Index - 1)
+            except Exception as e:
+                logger.error("Could not replay blocks %s to %s, not indexing block %s: %s" % (checkpoint + 1, block.Index - 1, block.Index, e))
+                self._events_to_write = []
+                return
+
+        swap_events = [evt for evt in self._events_to_write if evt.block == block.Index]
+        self.index.commit_block(block.Index, swap_events)
+        self._events_to_write = []
+
+
+def main():
+    from twisted.internet import reactor, task
+
+    from neo.Implementations.Blockchains.LevelDB.LevelDBBlockchain import \
+        LevelDBBlockchain
+    from neo.Implementations.Notifications.LevelDB.NotificationDB import \
+        NotificationDB
+    from neo.Network.NodeLeader import NodeLeader
+    from neo.Settings import settings
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("contract", help="Script hash of the swap contract")
+    parser.add_argument("--db", action="store", default="swaps.db", help="Path of the SQLite index")
+    parser.add_argument("--token", action="store", default=NEX_SCRIPT_HASH.ToString(), help="Script hash of the NEX token")
+    group_network = parser.add_mutually_exclusive_group()
+    group_network.add_argument("--mainnet", action="store_true", default=False, help="Use MainNet")
+    group_network.add_argument("--testnet", action="store_true", default=False, help="Use TestNet")
+    group_network.add_argument("--config", action="store", help="Use a specific config file")
+    args = parser.parse_args()
+
+    if args.config:
+        settings.setup(args.config)
+    elif args.mainnet:
+        settings.setup_mainnet()
+    elif args.testnet:
+        settings.setup_testnet()
+
+    blockchain = LevelDBBlockchain(settings.chain_leveldb_path)
+    Blockchain.RegisterBlockchain(blockchain)
+
+    # swaps are confirmed by their transfers when blocks are replayed
+    NotificationDB.instance().start()
+
+    index = SwapIndex(args.db)
+    indexer = SwapEventIndexer(index, UInt160.ParseString(args.contract), UInt160.ParseString(args.token))
+    indexer.start()
+
+    dbloop = task.LoopingCall(Blockchain.Default().PersistBlocks)
+    dbloop.start(.1)
+
+    NodeLeader.Instance().Start()
+    reactor.run()
+
+    indexer.stop()
+    index.close()
+    NotificationDB.close()
+    Blockchain.Default().Dispose()
+    NodeLeader.Instance().Shutdown()
+
+
+if __name__ == "__main__":
+    main()
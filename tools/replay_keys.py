@@ -0,0 +1,344 @@
+"""
+NexSwap replay key files
+===================================
+
+Replay keys are the 52 byte concat(txHash, addr) keys that swapToEth
+writes. Key lists, like the ones in the migration directory, are hex
+text files with one unsorted key per line, which is slow to search and
+compare.
+
+This converts them to a binary file of sorted, unique 52 byte records
+without a header. The file is memory mapped and searched with binary
+search, and files are combined with merge based union, intersection and
+difference, which stream through both inputs and use constant memory.
+The contract storage of a LevelDB chain is iterated in the same byte
+order, so a key file can be compared with the keys on chain the same way.
+
+Usage:
+
+    python -m tools.replay_keys convert migration/new_930_a.txt new_930_a.rkeys
+    python -m tools.replay_keys show new_930_a.rkeys
+    python -m tools.replay_keys diff new_930_a.rkeys final_930_a.rkeys --out remaining.rkeys
+    python -m tools.replay_keys chain --chain ./Chains/SC234 <swap contract hash> new_930_a.rkeys --out missing.rkeys
+
+"""
+import argparse
+import heapq
+import mmap
+import os
+import tempfile
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import islice
+
+from neocore.Cryptography.Crypto import Crypto
+from neocore.UInt160 import UInt160
+from neocore.UInt256 import UInt256
+
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from tools.import_replay_keys import REPLAY_KEY_LENGTH, read_replay_keys
+
+ReplayKey = namedtuple('ReplayKey', ['tx_hash', 'addr'])
+
+# Number of keys sorted in memory at once when converting
+DEFAULT_RUN_SIZE = 1000000
+
+
+def decode_replay_key(key) -> ReplayKey:
+    """
+    :param key: bytes: a 52 byte replay key
+    :return: ReplayKey: the tx hash as hex string and the addr as address
+    """
+    if len(key) != REPLAY_KEY_LENGTH:
+        raise ValueError("Invalid replay key length")
+
+    return ReplayKey(tx_hash=UInt256(data=bytearray(key[:32])).ToString(),
+                     addr=Crypto.ToAddress(UInt160(data=bytearray(key[32:]))))
+
+
+def unique(keys):
+    """
+    :param keys: iterable of sorted keys
+    :return: generator of the keys without duplicates
+    """
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+            previous = key
+
+
+def write_replay_keys(path, keys):
+    """
+    Writes sorted keys to a key file, duplicates are dropped
+
+    :param path: str
+    :param keys: iterable of sorted 52 byte keys
+    :return: int: the number of keys written
+    """
+    count = 0
+    previous = None
+
+    with open(path, 'wb') as handle:
+        for key in keys:
+            if len(key) != REPLAY_KEY_LENGTH:
+                raise ValueError("Invalid replay key length")
+            if previous is not None:
+                if key < previous:
+                    raise ValueError("Keys are not sorted")
+                if key == previous:
+                    continue
+
+            handle.write(key)
+            previous = key
+            count += 1
+
+    return count
+
+
+def convert(text_path, path, run_size=DEFAULT_RUN_SIZE):
+    """
+    Converts a hex key file. Runs of run_size keys are sorted in memory
+    and written to temporary files, which are then merged
+
+    :param text_path: str: the hex key file
+    :param path: str: the key file to write
+    :param run_size: int: number of keys sorted in memory at once
+    :return: int: the number of unique keys
+    """
+    keys = read_replay_keys(text_path)
+    run_paths = []
+    pending = []
+
+    try:
+        while True:
+            run = pending + list(islice(keys, run_size - len(pending)))
+            run.sort()
+            peek = next(keys, None)
+
+            # everything fit in a single run
+            if peek is None and not run_paths:
+                return write_replay_keys(path, run)
+
+            handle, run_path = tempfile.mkstemp(suffix='.rkeys', dir=os.path.dirname(os.path.abspath(path)))
+            os.close(handle)
+            run_paths.append(run_path)
+            write_replay_keys(run_path, run)
+
+            if peek is None:
+                break
+            pending = [peek]
+
+        runs = [ReplayKeyFile(run_path) for run_path in run_paths]
+        try:
+            return write_replay_keys(path, heapq.merge(*runs))
+        finally:
+            for run_file in runs:
+                run_file.close()
+    finally:
+        for run_path in run_paths:
+            os.remove(run_path)
+
+
+class ReplayKeyFile:
+    """
+    A memory mapped key file. Supports len(), indexing, iteration
+    in sorted order and `key in file`, which is a binary search
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = open(path, 'rb')
+        self._count = 0
+        self._mmap = None
+
+        size = os.fstat(self._handle.fileno()).st_size
+        if size % REPLAY_KEY_LENGTH != 0:
+            self._handle.close()
+            raise ValueError("%s is not a replay key file" % path)
+
+        self._count = size // REPLAY_KEY_LENGTH
+
+        # empty files can't be mapped
+        if size:
+            self._mmap = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("Replay key index out of range")
+
+        start = index * REPLAY_KEY_LENGTH
+        return self._mmap[start:start + REPLAY_KEY_LENGTH]
+
+    def __iter__(self):
+        for start in range(0, self._count * REPLAY_KEY_LENGTH, REPLAY_KEY_LENGTH):
+            yield self._mmap[start:start + REPLAY_KEY_LENGTH]
+
+    def __contains__(self, key):
+        index = bisect_left(self, bytes(key))
+        return index < self._count and self[index] == key
+
+    def is_sorted(self):
+        """
+        Checks that the keys are sorted and unique, which every other operation relies on
+        """
+        previous = None
+        for key in self:
+            if previous is not None and key <= previous:
+                return False
+            previous = key
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def union(a, b):
+    """
+    :param a: iterable of sorted, unique keys
+    :param b: iterable of sorted, unique keys
+    :return: generator of the sorted keys in a or b
+    """
+    return unique(heapq.merge(a, b))
+
+
+def intersection(a, b):
+    """
+    :param a: iterable of sorted, unique keys
+    :param b: iterable of sorted, unique keys
+    :return: generator of the sorted keys in both a and b
+    """
+    a = iter(a)
+    b = iter(b)
+    key_a = next(a, None)
+    key_b = next(b, None)
+
+    while key_a is not None and key_b is not None:
+        if key_a < key_b:
+            key_a = next(a, None)
+        elif key_b < key_a:
+            key_b = next(b, None)
+        else:
+            yield key_a
+            key_a = next(a, None)
+            key_b = next(b, None)
+
+
+def difference(a, b):
+    """
+    :param a: iterable of sorted, unique keys
+    :param b: iterable of sorted, unique keys
+    :return: generator of the sorted keys in a that are not in b
+    """
+    b = iter(b)
+    key_b = next(b, None)
+
+    for key_a in a:
+        while key_b is not None and key_b < key_a:
+            key_b = next(b, None)
+        if key_a != key_b:
+            yield key_a
+
+
+def chain_replay_keys(db, contract_hash: UInt160):
+    """
+    The replay keys in the storage of the swap contract. LevelDB iterates
+    in byte order, so they come out sorted like a key file
+
+    :param db: plyvel.DB: the LevelDB chain
+    :param contract_hash: UInt160: script hash of the swap contract
+    :return: generator of 52 byte keys
+    """
+    prefix = DBPrefix.ST_Storage + bytes(contract_hash.Data)
+
+    for key in db.iterator(prefix=prefix, include_value=False):
+        key = key[len(prefix):]
+        if len(key) == REPLAY_KEY_LENGTH:
+            yield key
+
+
+def write_result(keys, out):
+    if out:
+        print("Wrote %s keys" % write_replay_keys(out, keys))
+    else:
+        print("%s keys" % sum(1 for key in keys))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+
+    convert_parser = commands.add_parser('convert', help="Convert a hex key file")
+    convert_parser.add_argument("text", help="Path of the hex key file")
+    convert_parser.add_argument("out", help="Path of the key file to write")
+    convert_parser.add_argument("--run-size", action="store", type=int, default=DEFAULT_RUN_SIZE, help="Keys sorted in memory at once")
+
+    show_parser = commands.add_parser('show', help="Print the tx hash and addr of every key")
+    show_parser.add_argument("keys", help="Path of the key file")
+
+    find_parser = commands.add_parser('find', help="Check whether a key is in a key file")
+    find_parser.add_argument("keys", help="Path of the key file")
+    find_parser.add_argument("key", help="Hex encoded replay key")
+
+    for name, description in [('union', "Keys in a or b"), ('intersect', "Keys in both a and b"), ('diff', "Keys in a but not in b")]:
+        operation_parser = commands.add_parser(name, help=description)
+        operation_parser.add_argument("a", help="Path of a key file")
+        operation_parser.add_argument("b", help="Path of a key file")
+        operation_parser.add_argument("--out", action="store", help="Path of the key file to write, the keys are counted if not given")
+
+    chain_parser = commands.add_parser('chain', help="Keys of a key file that are not in the contract storage")
+    chain_parser.add_argument("contract", help="Script hash of the swap contract")
+    chain_parser.add_argument("keys", help="Path of the key file")
+    chain_parser.add_argument("--chain", action="store", required=True, help="Path of the LevelDB chain")
+    chain_parser.add_argument("--out", action="store", help="Path of the key file to write, the keys are counted if not given")
+
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        print("Wrote %s keys" % convert(args.text, args.out, args.run_size))
+
+    elif args.command == 'show':
+        with ReplayKeyFile(args.keys) as keys:
+            for key in keys:
+                decoded = decode_replay_key(key)
+                print("%s %s" % (decoded.tx_hash, decoded.addr))
+
+    elif args.command == 'find':
+        with ReplayKeyFile(args.keys) as keys:
+            print(bytes.fromhex(args.key) in keys)
+
+    elif args.command in ('union', 'intersect', 'diff'):
+        operation = {'union': union, 'intersect': intersection, 'diff': difference}[args.command]
+        with ReplayKeyFile(args.a) as a, ReplayKeyFile(args.b) as b:
+            write_result(operation(a, b), args.out)
+
+    elif args.command == 'chain':
+        import plyvel
+
+        db = plyvel.DB(args.chain, create_if_missing=False)
+        try:
+            with ReplayKeyFile(args.keys) as keys:
+                write_result(difference(keys, chain_replay_keys(db, UInt160.ParseString(args.contract))), args.out)
+        finally:
+            db.close()
+
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+NexSwap storage snapshots
+===================================
+
+Exports the storage of the swap contract from a LevelDB chain to a
+binary snapshot in a single pass, reports how much storage every key
+family uses and how fast it grew, and diffs two snapshots, e.g. from
+before and after a migration.
+
+Where the chain records when a key was written, the snapshot keeps that
+height too: replay keys by the height of their transaction, swap records
+by the height stored in them. Other keys are counted without a height.
+
+A snapshot is a header followed by the storage items in key order,
+which is the order LevelDB iterates in, so two snapshots are diffed by
+merging them without loading either one.
+
+Usage:
+
+    python -m tools.storage_snapshot export --chain ./Chains/SC234 <swap contract hash> swap.snap
+    python -m tools.storage_snapshot report swap.snap --bucket 100000
+    python -m tools.storage_snapshot diff before.snap after.snap
+
+"""
+import argparse
+import binascii
+import struct
+from collections import OrderedDict, namedtuple
+
+import plyvel
+from neocore.IO.BinaryReader import BinaryReader
+from neocore.UInt160 import UInt160
+from neocore.UInt256 import UInt256
+
+from neo.Core.State.StorageItem import StorageItem
+from neo.Implementations.Blockchains.LevelDB.DBPrefix import DBPrefix
+from neo.IO.MemoryStream import StreamManager
+from neo.VM.InteropService import StackItem
+from tools.backfill import (SWAP_RECORD_PREFIX, SWAPID_PAGE_PREFIX,
+                            SWAPID_PREFIX, chain_height)
+from tools.import_replay_keys import REPLAY_KEY_LENGTH
+
+SNAPSHOT_MAGIC = b'NXSS'
+SNAPSHOT_VERSION = 1
+
+# magic, version, chain height, contract hash, number of items
+HEADER = struct.Struct('<4sBI20sQ')
+
+# key length, value length, height
+RECORD = struct.Struct('<HII')
+
+UNKNOWN_HEIGHT = 0xFFFFFFFF
+
+StorageEntry = namedtuple('StorageEntry', ['key', 'value', 'height'])
+
+REPLAY = 'replay keys'
+SWAP_RECORDS = 'swap records'
+SWAPID_PAGES = 'swap id pages'
+SWAPIDS = 'swap id keys'
+OWNER_KEYS = 'owner keys'
+MINTER_KEYS = 'minter keys'
+LEDGER = 'ledger'
+OTHER = 'other'
+
+FAMILIES = [REPLAY, SWAP_RECORDS, SWAPID_PAGES, SWAPIDS, OWNER_KEYS, MINTER_KEYS, LEDGER, OTHER]
+
+# Storage keys of NexSwap.py and nash/owner.py
+OWNER_KEY_NAMES = {b'owners', b'owners_initialized', b'owner1', b'owner2', b'owner3', b'owner4', b'owner5'}
+MINTER_PREFIX = b'minter_'
+LEDGER_KEY_NAMES = {b'swapCounter', b'swappedIn', b'swappedOut', b'swappedOutstanding'}
+
+
+def key_family(key):
+    """
+    :param key: bytes: a storage key of the swap contract
+    :return: str: one of FAMILIES
+    """
+    if key.startswith(SWAP_RECORD_PREFIX):
+        return SWAP_RECORDS
+    if key.startswith(SWAPID_PAGE_PREFIX):
+        return SWAPID_PAGES
+    if key in LEDGER_KEY_NAMES:
+        return LEDGER
+    if key.startswith(SWAPID_PREFIX):
+        return SWAPIDS
+    if key in OWNER_KEY_NAMES:
+        return OWNER_KEYS
+    if key.startswith(MINTER_PREFIX):
+        return MINTER_KEYS
+    if len(key) == REPLAY_KEY_LENGTH:
+        return REPLAY
+    return OTHER
+
+
+def entry_height(db, key, value):
+    """
+    The height a storage item was written at, as far as the chain records it
+
+    :return: int: the height or UNKNOWN_HEIGHT
+    """
+    family = key_family(key)
+
+    if family == REPLAY:
+        tx = db.get(DBPrefix.DATA_Transaction + UInt256(data=bytearray(key[:32])).ToBytes())
+        if tx is not None:
+            return int.from_bytes(tx[:4], 'little')
+
+    elif family == SWAP_RECORDS:
+        try:
+            reader = BinaryReader(StreamManager.GetStream(data=value))
+            return int(StackItem.DeserializeStackItem(reader).GetArray()[3].GetBigInteger())
+        except Exception:
+            pass
+
+    return UNKNOWN_HEIGHT
+
+
+def read_storage(db, contract_hash: UInt160):
+    """
+    :param db: plyvel.DB: the LevelDB chain
+    :param contract_hash: UInt160: script hash of the swap contract
+    :return: generator of StorageEntry in key order
+    """
+    prefix = DBPrefix.ST_Storage + bytes(contract_hash.Data)
+
+    for key, value in db.iterator(prefix=prefix):
+        key = key[len(prefix):]
+        value = bytes(StorageItem.DeserializeFromDB(binascii.unhexlify(value)).Value)
+        yield StorageEntry(key, value, entry_height(db, key, value))
+
+
+def write_snapshot(path, contract_hash: UInt160, height, entries):
+    """
+    :param path: str
+    :param contract_hash: UInt160: script hash of the swap contract
+    :param height: int: height of the chain the entries were read at
+    :param entries: iterable of StorageEntry in key order
+    :return: int: the number of entries written
+    """
+    count = 0
+
+    with open(path, 'wb') as handle:
+        # the count is filled in at the end
+        handle.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height, bytes(contract_hash.Data), 0))
+
+        for entry in entries:
+            handle.write(RECORD.pack(len(entry.key), len(entry.value), entry.height))
+            handle.write(entry.key)
+            handle.write(entry.value)
+            count += 1
+
+        handle.seek(0)
+        handle.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height, bytes(contract_hash.Data), count))
+
+    return count
+
+
+class Snapshot:
+    """
+    Reads a snapshot. Iterating yields the StorageEntry items in key order
+    without loading the whole file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = open(path, 'rb')
+
+        header = self._handle.read(HEADER.size)
+        if len(header) != HEADER.size:
+            self._handle.close()
+            raise ValueError("%s is not a storage snapshot" % path)
+
+        magic, version, self.height, contract_hash, self.count = HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self._handle.close()
+            raise ValueError("%s is not a storage snapshot" % path)
+
+        self.contract_hash = UInt160(data=bytearray(contract_hash))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        self._handle.seek(HEADER.size)
+
+        for i in range(self.count):
+            key_length, value_length, height = RECORD.unpack(self._handle.read(RECORD.size))
+            key = self._handle.read(key_length)
+            value = self._handle.read(value_length)
+            yield StorageEntry(key, value, height)
+
+    def close(self):
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FamilyUsage:
+
+    def __init__(self):
+        self.count = 0
+        self.key_bytes = 0
+        self.value_bytes = 0
+        self.growth = {}
+
+    @property
+    def total_bytes(self):
+        return self.key_bytes + self.value_bytes
+
+
+class StorageReport:
+    """
+    Key counts, byte totals and growth per block range of every key family
+    """
+
+    def __init__(self, bucket_size=100000):
+        self.bucket_size = bucket_size
+        self.families = OrderedDict((family, FamilyUsage()) for family in FAMILIES)
+
+    def add(self, entry: StorageEntry):
+        usage = self.families[key_family(entry.key)]
+        usage.count += 1
+        usage.key_bytes += len(entry.key)
+        usage.value_bytes += len(entry.value)
+
+        bucket = None if entry.height == UNKNOWN_HEIGHT else entry.height // self.bucket_size
+        usage.growth[bucket] = usage.growth.get(bucket, 0) + 1
+
+    def format(self):
+        lines = ["%-16s %10s %12s %12s %12s" % ('family', 'keys', 'key bytes', 'value bytes', 'total bytes')]
+
+        for family, usage in self.families.items():
+            if usage.count:
+                lines.append("%-16s %10s %12s %12s %12s" % (family, usage.count, usage.key_bytes, usage.value_bytes, usage.total_bytes))
+
+        total = sum(usage.count for usage in self.families.values())
+        total_bytes = sum(usage.total_bytes for usage in self.families.values())
+        lines.append("%-16s %10s %38s" % ('total', total, total_bytes))
+
+        for family, usage in self.families.items():
+            known = sorted(bucket for bucket in usage.growth if bucket is not None)
+            if not known:
+                continue
+
+            lines.append("")
+            lines.append("%s per %s blocks" % (family, self.bucket_size))
+            for bucket in known:
+                lines.append("  %10s - %10s %10s" % (bucket * self.bucket_size, (bucket + 1) * self.bucket_size - 1, usage.growth[bucket]))
+            if None in usage.growth:
+                lines.append("  %23s %10s" % ('unknown height', usage.growth[None]))
+
+        return "\n".join(lines)
+
+
+def diff_snapshots(old, new):
+    """
+    Merges two snapshots in key order
+
+    :param old: iterable of StorageEntry in key order
+    :param new: iterable of StorageEntry in key order
+    :return: generator of (old entry, new entry) pairs of the keys that differ,
+        the old entry is None for added keys and the new entry for removed keys
+    """
+    old = iter(old)
+    new = iter(new)
+    old_entry = next(old, None)
+    new_entry = next(new, None)
+
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry.key < new_entry.key):
+            yield old_entry, None
+            old_entry = next(old, None)
+        elif old_entry is None or new_entry.key < old_entry.key:
+            yield None, new_entry
+            new_entry = next(new, None)
+        else:
+            if old_entry.value != new_entry.value:
+                yield old_entry, new_entry
+            old_entry = next(old, None)
+            new_entry = next(new, None)
+
+
+def summarize_diff(changes):
+    """
+    :param changes: pairs as returned by diff_snapshots
+    :return: OrderedDict: family -> [added, removed, changed]
+    """
+    summary = OrderedDict((family, [0, 0, 0]) for family in FAMILIES)
+
+    for old_entry, new_entry in changes:
+        if old_entry is None:
+            summary[key_family(new_entry.key)][0] += 1
+        elif new_entry is None:
+            summary[key_family(old_entry.key)][1] += 1
+        else:
+            summary[key_family(new_entry.key)][2] += 1
+
+    return summary
+
+
+def export(chain_path, contract_hash: UInt160, path):
+    """
+    :return: int: the number of entries written
+    """
+    db = plyvel.DB(chain_path, create_if_missing=False)
+    try:
+        return write_snapshot(path, contract_hash, chain_height(db), read_storage(db, contract_hash))
+    finally:
+        db.close()
+
+
+def print_changes(changes):
+    for old_entry, new_entry in changes:
+        sign = '+' if old_entry is None else '-' if new_entry is None else '~'
+        key = (new_entry or old_entry).key
+        print("%s %-16s %s" % (sign, key_family(key), key.hex()))
+        yield old_entry, new_entry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command')
+
+    export_parser = commands.add_parser('export', help="Export the contract storage to a snapshot")
+    export_parser.add_argument("contract", help="Script hash of the swap contract")
+    export_parser.add_argument("out", help="Path of the snapshot to write")
+    export_parser.add_argument("--chain", action="store", required=True, help="Path of the LevelDB chain")
+
+    report_parser = commands.add_parser('report', help="Storage usage and growth per key family")
+    report_parser.add_argument("snapshot", help="Path of the snapshot")
+    report_parser.add_argument("--bucket", action="store", type=int, default=100000, help="Blocks per growth range")
+
+    diff_parser = commands.add_parser('diff', help="Keys added, removed and changed between two snapshots")
+    diff_parser.add_argument("old", help="Path of the older snapshot")
+    diff_parser.add_argument("new", help="Path of the newer snapshot")
+    diff_parser.add_argument("--keys", action="store_true", default=False, help="Print every key that differs")
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        count = export(args.chain, UInt160.ParseString(args.contract), args.out)
+        print("Exported %s storage items" % count)
+
+    elif args.command == 'report':
+        report = StorageReport(args.bucket)
+        with Snapshot(args.snapshot) as snapshot:
+            print("Contract %s at height %s" % (snapshot.contract_hash.ToString(), snapshot.height))
+            for entry in snapshot:
+                report.add(entry)
+        print(report.format())
+
+    elif args.command == 'diff':
+        with Snapshot(args.old) as old, Snapshot(args.new) as new:
+            print("Height %s -> %s" % (old.height, new.height))
+            changes = diff_snapshots(old, new)
+            if args.keys:
+                changes = print_changes(changes)
+
+            summary = summarize_diff(changes)
+
+            print("%-16s %10s %10s %10s" % ('family', 'added', 'removed', 'changed'))
+            for family, (added, removed, changed) in summary.items():
+                if added or removed or changed:
+                    print("%-16s %10s %10s %10s" % (family, added, removed, changed))
+
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()